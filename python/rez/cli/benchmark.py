@@ -0,0 +1,168 @@
+'''
+Benchmark the resolver against a synthetic package repository.
+
+Resolves each request cold (a new resolver, no memcached) and then warm (again, with the
+same resolver), and writes the time taken, filesystem lookups and peak memory of each as json.
+With --generate, the repository and its requests are generated first. With --compare-solvers,
+each request is resolved cold by each resolver backend, and the requests they resolve
+differently are listed.
+'''
+import os
+import sys
+from rez.cli import error, output
+
+def setup_parser(parser):
+    import rez.public_enums as enums
+    import rez.rez_benchmark as bm
+
+    parser.add_argument("path", type=str,
+                        help="the package repository to resolve against. Nothing else is searched")
+    parser.add_argument("--generate", dest="generate", action="store_true",
+                        default=False,
+                        help="generate a synthetic repository into path first, which must be empty")
+    parser.add_argument("--requests", dest="requests", type=str,
+                        default="",
+                        help="file of requests to resolve, one per line [default = the requests "
+                        "generated with the repository]")
+    parser.add_argument("-o", "--output", dest="output", type=str,
+                        default="",
+                        help="write the json results to the given file [default = stdout]")
+    parser.add_argument("-m", "--mode", dest="mode",
+                        default=enums.RESOLVE_MODE_LATEST,
+                        choices=[enums.RESOLVE_MODE_LATEST,
+                                 enums.RESOLVE_MODE_EARLIEST],
+                        help="set resolution mode")
+    parser.add_argument("--solver", dest="solver",
+                        default=enums.SOLVER_DEFAULT,
+                        choices=[enums.SOLVER_DEFAULT,
+                                 enums.SOLVER_SAT],
+                        help="set the resolver backend")
+    parser.add_argument("--compare-solvers", dest="compare_solvers", action="store_true",
+                        default=False,
+                        help="resolve each request cold with each resolver backend, and list the "
+                        "requests that they resolve differently. --solver and --no-warm are ignored")
+    parser.add_argument("-d", "--no-assume-dt", dest="no_assume_dt",
+                        action="store_true", default=False,
+                        help="do not assume dependency transitivity")
+    parser.add_argument("--no-warm", dest="no_warm", action="store_true",
+                        default=False,
+                        help="only do cold resolves")
+    parser.add_argument("--max-time", dest="max_time", type=float,
+                        default=-1,
+                        help="abandon each resolve after N seconds [default = no limit]")
+
+    # repository generation
+    parser.add_argument("--families", dest="num_families", type=int,
+                        default=100,
+                        help="number of families to generate")
+    parser.add_argument("--versions", dest="num_versions", type=int,
+                        default=5,
+                        help="number of versions of each family")
+    parser.add_argument("--fan-out", dest="fan_out", type=int,
+                        default=3,
+                        help="number of families that each family requires")
+    parser.add_argument("--variant-matrix", dest="variant_matrix", type=str,
+                        default=bm.DEFAULT_VARIANT_MATRIX,
+                        help="variant axes, each a family and its versions. Families with variants "
+                        "have one for every combination")
+    parser.add_argument("--variant-fraction", dest="variant_fraction", type=float,
+                        default=0.2,
+                        help="fraction of families that have variants")
+    parser.add_argument("--anti-fraction", dest="anti_fraction", type=float,
+                        default=0.05,
+                        help="chance of a package having an anti-requirement")
+    parser.add_argument("--weak-fraction", dest="weak_fraction", type=float,
+                        default=0.05,
+                        help="chance of a package having a weak requirement")
+    parser.add_argument("--conditional-fraction", dest="conditional_fraction", type=float,
+                        default=0.05,
+                        help="chance of a package having a conditional requirement")
+    parser.add_argument("--num-requests", dest="num_requests", type=int,
+                        default=20,
+                        help="number of requests to generate")
+    parser.add_argument("--request-size", dest="request_size", type=int,
+                        default=3,
+                        help="number of families in each generated request")
+    parser.add_argument("--seed", dest="seed", type=int,
+                        default=0,
+                        help="random seed for generation")
+
+def command(opts):
+    import json
+    import time
+    import yaml
+    import rez.rez_benchmark as bm
+    from rez.rez_exceptions import RezError
+
+    path = os.path.abspath(opts.path)
+    if opts.generate:
+        try:
+            bm.generate_repository(path, opts.num_families, opts.num_versions, opts.fan_out,
+                                   opts.variant_matrix, opts.variant_fraction,
+                                   opts.anti_fraction, opts.weak_fraction,
+                                   opts.conditional_fraction, opts.num_requests,
+                                   opts.request_size, opts.seed)
+        except RezError, e:
+            error(str(e))
+            sys.exit(1)
+    elif not os.path.isdir(path):
+        error("no repository at '%s', use --generate to create one" % path)
+        sys.exit(1)
+
+    requests_file = opts.requests or os.path.join(path, bm.REQUESTS_FILENAME)
+    if not os.path.isfile(requests_file):
+        error("no requests file at '%s', use --requests" % requests_file)
+        sys.exit(1)
+    requests = bm.load_requests(requests_file)
+
+    spec = None
+    spec_file = os.path.join(path, bm.SPEC_FILENAME)
+    if os.path.isfile(spec_file):
+        with open(spec_file) as f:
+            spec = yaml.safe_load(f)
+
+    results = {
+        "rez_version":  os.getenv("REZ_VERSION"),
+        "time":         int(time.time()),
+        "repository":   spec,
+        "options":      {"mode": opts.mode,
+                         "solver": opts.solver,
+                         "assume_dt": not opts.no_assume_dt} }
+
+    if opts.compare_solvers:
+        comparison = bm.compare_solvers(path, requests, opts.mode, not opts.no_assume_dt,
+                                        opts.max_time)
+        results["options"]["solver"] = "compare"
+        results["differences"] = comparison.pop("differences")
+        results["summary"] = dict((k, bm.summarise(v)) for k, v in comparison.iteritems())
+        results["requests"] = comparison
+    else:
+        entries = bm.benchmark_resolves(path, requests, opts.mode, opts.solver,
+                                        not opts.no_assume_dt, not opts.no_warm, opts.max_time)
+        results["summary"] = bm.summarise(entries)
+        results["requests"] = entries
+
+    s = json.dumps(results, indent=2, sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(s + '\n')
+    else:
+        output(s)
+
+
+#    Copyright 2008-2012 Dr D Studios Pty Limited (ACN 127 184 954) (Dr. D Studios)
+#
+#    This file is part of Rez.
+#
+#    Rez is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Rez is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Rez.  If not, see <http://www.gnu.org/licenses/>.
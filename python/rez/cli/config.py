@@ -50,11 +50,75 @@ def setup_shared_parser(parser):
     parser.add_argument("--no-local", dest="no_local",
                         action="store_true", default=False,
                         help="don't load local packages")
+    parser.add_argument("--solver", dest="solver",
+                        default=enums.SOLVER_DEFAULT,
+                        choices=[enums.SOLVER_DEFAULT,
+                                 enums.SOLVER_SAT],
+                        help="set the resolver backend. 'sat' uses a clause-learning SAT solver, "
+                        "which can be much faster on requests with many conflicts")
+    parser.add_argument("--max-time", dest="max_time", type=float,
+                        default=-1,
+                        help="abandon the resolve after N seconds [default = no limit]")
+    parser.add_argument("--max-configs", dest="max_configs", type=int,
+                        default=-1,
+                        help="abandon the resolve after spawning N configurations [default = no limit]")
+    parser.add_argument("--max-fs-ops", dest="max_fs_ops", type=int,
+                        default=-1,
+                        help="abandon the resolve after N filesystem lookups [default = no limit]")
+    parser.add_argument("--max-memory", dest="max_memory", type=int,
+                        default=-1,
+                        help="abandon the resolve once peak memory use exceeds N megabytes [default = no limit]")
+    parser.add_argument("--max-fail-history", dest="max_fail_history", type=int,
+                        default=-1,
+                        help="bound memory use on long resolves by keeping only the N most recent "
+                        "failed configuration attempts, described briefly [default = keep all]")
+    parser.add_argument("-j", "--procs", dest="num_procs", type=int,
+                        default=1,
+                        help="resolve candidate configurations speculatively in up to N processes [default = %(default)s]")
+    parser.add_argument("--profile", dest="profile", action="store_true",
+                        default=False,
+                        help="print a summary of where the time went in the resolve")
+    parser.add_argument("--profile-json", dest="profile_json", type=str,
+                        default="",
+                        help="write a detailed profile of the resolve to the given file, as json")
+    parser.add_argument("--from-lock", dest="from_lock", type=str,
+                        default="",
+                        help="build the environment recorded in the given lock file (see "
+                        "rez-config --write-lock) without resolving. Fails if any locked package "
+                        "is missing or has changed")
 
 def setup_parser(parser):
     # usage = "usage: %prog [options] pkg1 pkg2 ... pkgN"
-    parser.add_argument("pkg", nargs='+',
+    parser.add_argument("pkg", nargs='*',
                         help='list of package names')
+    parser.add_argument("--batch", dest="batch", type=str,
+                        default="",
+                        help="resolve each request in the given file (one per line, '-' for stdin), "
+                        "and print the resolved packages of each. With --procs, the requests are "
+                        "resolved in a pool of N processes")
+    parser.add_argument("--overlay", dest="overlay", type=str,
+                        default="",
+                        help="resolve as though the packages in the given yaml file (a list of "
+                        "package definitions, each with an optional 'timestamp') had been released. "
+                        "Nothing is written to disk. Useful with --batch, to see which requests "
+                        "would pick up a new release")
+    parser.add_argument("--record-fixture", dest="record_fixture", type=str,
+                        default="",
+                        help="resolve the request, and write everything the resolver read from the "
+                        "package repository to the given fixture file, so that the resolve can be "
+                        "replayed without the repository")
+    parser.add_argument("--replay-fixture", dest="replay_fixture", type=str,
+                        default="",
+                        help="replay the resolve recorded in the given fixture file, and report the "
+                        "time taken and whether the result matches the recording")
+    parser.add_argument("--write-lock", dest="write_lock", type=str,
+                        default="",
+                        help="write the resolved packages to the given lock file, so that the "
+                        "environment can be built again without resolving, with --from-lock")
+    parser.add_argument("--bisect-time", dest="bisect_time", type=int, nargs=2,
+                        metavar=("START", "END"),
+                        help="find the first epoch time between START and END at which the resolve "
+                        "changes or fails, and the package release responsible")
     parser.add_argument("-v", "--verbosity", dest="verbosity", type=int,
                         default=0, choices=[0, 1, 2],
                         help="set verbosity")
@@ -72,6 +136,10 @@ def setup_parser(parser):
     parser.add_argument("--env-file", dest="env_file", type=str,
                         default="",
                         help="write commands which, if run, would produce the configured environment")
+    parser.add_argument("--context-file", dest="context_file", type=str,
+                        default="",
+                        help="write the resolved environment to the given file as structured data "
+                        "(json), from which shell code is generated on demand. See rez_context")
     parser.add_argument("--print-env", dest="print_env", action="store_true",
                         default=False,
                         help="print commands which, if run, would produce the configured environment")
@@ -100,6 +168,15 @@ def setup_parser(parser):
 
     return parser
 
+def get_defaults():
+    '''
+    the default value of every rez-config option, as a dict
+    '''
+    import argparse
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    return vars(parser.parse_args([]))
+
 def command(opts):
 
     if opts.version:
@@ -122,35 +199,110 @@ def command(opts):
         rez.rez_util.hide_local_packages()
 
     import rez.rez_config as dc
+
+    if opts.batch:
+        _batch_command(opts)
+        return
+
+    if opts.bisect_time:
+        _bisect_command(opts)
+        return
+
+    if opts.replay_fixture:
+        _replay_command(opts)
+        return
+
+    if opts.from_lock:
+        if opts.pkg or opts.write_lock:
+            error("packages and --write-lock cannot be given with --from-lock")
+            sys.exit(1)
+        resolver, result, request = _lock_resolve(opts, do_quiet, meta_vars,
+                                                  shallow_meta_vars)
+        _print_result(opts, resolver, result, request, do_quiet)
+        return
+
+    if not opts.pkg:
+        error("no packages specified")
+        sys.exit(1)
+
     ##########################################################################################
     # construct package request
     ##########################################################################################
     resolver = dc.Resolver(opts.mode, do_quiet, opts.verbosity, opts.max_fails,
                            time_epoch, opts.buildreqs, not opts.no_assume_dt,
-                           not opts.no_cache)
+                           not opts.no_cache, opts.solver,
+                           opts.max_time, opts.max_configs,
+                           opts.max_fs_ops, opts.max_memory,
+                           opts.num_procs, (opts.profile or bool(opts.profile_json)),
+                           opts.max_fail_history)
+    _set_overlay(opts, resolver)
+
+    if opts.record_fixture:
+        _record_command(opts, resolver)
+        return
 
     if opts.no_catch:
         pkg_reqs = [dc.str_to_pkg_req(x) for x in opts.pkg]
         result = resolver.resolve(pkg_reqs, opts.no_os,
                                   opts.no_path_append, opts.wrapper,
                                   meta_vars, shallow_meta_vars)
+        _write_profile(opts, resolver)
     else:
+        # set by rez-env when patching an environment
+        prev_resolve = getattr(opts, "prev_resolve", None)
+        changed_pkgs = getattr(opts, "changed_pkgs", None)
+
         result = resolver.guarded_resolve(opts.pkg, opts.no_os,
                                           opts.no_path_append, opts.wrapper,
                                           meta_vars, shallow_meta_vars,
-                                          opts.dot_file, opts.print_dot)
+                                          opts.dot_file, opts.print_dot,
+                                          prev_resolve, changed_pkgs)
+
+        # report the profile even if the resolve failed
+        _write_profile(opts, resolver)
 
         if not result:
             sys.exit(1)
 
+        if prev_resolve:
+            num_pinned, num_prev, fell_back, secs = resolver.get_incremental_info()
+            if fell_back:
+                msg = "incremental resolve failed, did a full resolve in %.2fs" % secs
+            else:
+                msg = "incremental resolve: %d of %d packages reused, took %.2fs" \
+                    % (num_pinned, num_prev, secs)
+                prev_secs = os.getenv("REZ_RESOLVE_DURATION")
+                if prev_secs:
+                    msg += " (the previous resolve took %ss)" % prev_secs
+            sys.stderr.write(msg + '\n')
+
+    import rez.rez_filesys
+    request = ([] if opts.no_os else [rez.rez_filesys._g_os_pkg]) + opts.pkg
+    _print_result(opts, resolver, result, request, do_quiet)
+
+
+def _print_result(opts, resolver, result, request, do_quiet):
+    """
+    request: the resolved request, including the OS package if it was requested
+    """
     pkg_ress, commands, dot_graph, num_fails = result
 
+    if opts.write_lock:
+        try:
+            resolver.write_lock(opts.pkg, result, opts.write_lock, opts.no_os)
+        except Exception, e:
+            error("could not write lock file '%s': %s" % (opts.write_lock, str(e)))
+            sys.exit(1)
+
     ##########################################################################################
     # print result
     ##########################################################################################
 
-    if not do_quiet:
+    if not do_quiet and not opts.from_lock:
         print "\nsuccessful configuration found after " + str(num_fails) + " failed attempts."
+        num_pruned = resolver.get_num_pruned_configs()
+        if num_pruned:
+            print str(num_pruned) + " configurations were skipped due to known conflicts."
 
     if opts.print_env or opts.env_file:
         import rez.rex
@@ -171,6 +323,199 @@ def command(opts):
             for env_cmd in env_cmds:
                 f.write(env_cmd + '\n')
 
+    if opts.context_file:
+        import rez.rez_context
+        context = rez.rez_context.create_context(request, result, resolver.rctxt.resolve_mode,
+                                                 resolver.rctxt.time_epoch)
+        context.save(opts.context_file)
+
+
+def _lock_resolve(opts, do_quiet, meta_vars, shallow_meta_vars):
+    import rez.rez_config as dc
+    from rez.rez_exceptions import RezError
+
+    try:
+        lock = dc.load_resolve_lock(opts.from_lock)
+    except Exception, e:
+        error("could not load lock file '%s': %s" % (opts.from_lock, str(e)))
+        sys.exit(1)
+
+    resolver = lock.create_resolver(quiet=do_quiet, caching=not opts.no_cache)
+    try:
+        result = resolver.resolve_from_lock(lock, opts.no_path_append, opts.wrapper,
+                                            meta_vars, shallow_meta_vars)
+    except RezError, e:
+        error("could not build the environment from '%s': %s" % (opts.from_lock, str(e)))
+        sys.exit(1)
+
+    if opts.print_dot:
+        print(lock.dot_graph)
+    if opts.dot_file:
+        import rez.rez_util
+        rez.rez_util.gen_dotgraph_image(lock.dot_graph, opts.dot_file)
+    return resolver, result, lock.request
+
+
+def _set_overlay(opts, resolver):
+    if not opts.overlay:
+        return
+
+    import rez.rez_config as dc
+    try:
+        overlay = dc.load_package_overlay(opts.overlay)
+        resolver.set_overlay(overlay)
+    except Exception, e:
+        error("could not load overlay '%s': %s" % (opts.overlay, str(e)))
+        sys.exit(1)
+
+
+def _write_profile(opts, resolver):
+    profile = resolver.get_profile()
+    if not profile:
+        return
+
+    if opts.profile:
+        sys.stderr.write(profile.summary() + '\n')
+
+    if opts.profile_json:
+        import json
+        with open(opts.profile_json, 'w') as f:
+            json.dump(profile.to_dict(), f, indent=2, sort_keys=True)
+
+
+def _batch_command(opts):
+    import rez.rez_config as dc
+
+    if opts.batch == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(opts.batch) as f:
+            lines = f.readlines()
+
+    requests = []
+    for line in lines:
+        line = line.split('#')[0].strip()
+        if line:
+            requests.append(line.split())
+
+    # the pool takes the place of speculative resolving
+    resolver = dc.Resolver(opts.mode, True, opts.verbosity, opts.max_fails,
+                           opts.time, opts.buildreqs, not opts.no_assume_dt,
+                           not opts.no_cache, opts.solver,
+                           opts.max_time, opts.max_configs,
+                           opts.max_fs_ops, opts.max_memory,
+                           max_fail_history=opts.max_fail_history)
+    _set_overlay(opts, resolver)
+    memcache = resolver.get_memcache()
+
+    num_failed = 0
+    for i, result in resolver.resolve_many(requests, opts.no_os, opts.no_path_append,
+                                           opts.wrapper, num_workers=opts.num_procs):
+        request_str = ' '.join(requests[i])
+        if isinstance(result, Exception):
+            num_failed += 1
+            output("%d: %s: FAILED (%s): %s" % (i, request_str, result.__class__.__name__,
+                                              str(result)))
+        else:
+            line = "%d: %s: %s" % (i, request_str,
+                                   ' '.join(x.short_name() for x in result[0]))
+            overlay_pkgs = [x.short_name() for x in result[0] \
+                            if memcache.is_overlay_path(x.base)]
+            if overlay_pkgs:
+                line += " (overlay: %s)" % ' '.join(overlay_pkgs)
+            output(line)
+
+    if num_failed:
+        sys.exit(1)
+
+
+def _bisect_command(opts):
+    import time
+    import rez.rez_config as dc
+
+    if not opts.pkg:
+        error("no packages specified")
+        sys.exit(1)
+
+    start_epoch, end_epoch = opts.bisect_time
+    if start_epoch >= end_epoch:
+        error("--bisect-time START must be earlier than END")
+        sys.exit(1)
+
+    resolver = dc.Resolver(opts.mode, True, opts.verbosity, opts.max_fails,
+                           end_epoch, opts.buildreqs, not opts.no_assume_dt,
+                           not opts.no_cache, opts.solver,
+                           opts.max_time, opts.max_configs,
+                           opts.max_fs_ops, opts.max_memory,
+                           max_fail_history=opts.max_fail_history)
+    _set_overlay(opts, resolver)
+
+    def _time_str(epoch):
+        return "%d (%s)" % (epoch, time.strftime("%a %b %d %H:%M:%S %Z %Y",
+                                                 time.localtime(epoch)))
+
+    def _result_str(result):
+        if isinstance(result, Exception):
+            return "FAILED (%s): %s" % (result.__class__.__name__, str(result))
+        return ' '.join(result)
+
+    t = time.time()
+    bisection = resolver.bisect_time(opts.pkg, start_epoch, end_epoch, opts.no_os)
+    if not bisection:
+        output("the resolve is the same at %s and %s" % (_time_str(start_epoch),
+                                                          _time_str(end_epoch)))
+        return
+
+    epoch, before, after, releases, num_probes = bisection
+    output("the resolve changed at %s" % _time_str(epoch))
+    if releases:
+        output("released at this time: %s" % ' '.join(releases))
+    else:
+        output("no release of the families involved was made at this time")
+    output("before: %s" % _result_str(before))
+    output("after: %s" % _result_str(after))
+    sys.stderr.write("%d resolves, took %.2fs\n" % (num_probes, time.time() - t))
+
+
+def _record_command(opts, resolver):
+    from rez.rez_exceptions import RezError
+    from rez.versions import VersionError
+
+    try:
+        result = resolver.record_resolve(opts.pkg, opts.record_fixture, opts.no_os)
+    except (RezError, VersionError), e:
+        sys.stderr.write("resolve FAILED (%s): %s\n" % (e.__class__.__name__, str(e)))
+        sys.stderr.write("the failure was recorded in %s\n" % opts.record_fixture)
+        sys.exit(1)
+
+    output(' '.join(x.short_name() for x in result[0]))
+    sys.stderr.write("the resolve was recorded in %s\n" % opts.record_fixture)
+
+
+def _replay_command(opts):
+    import rez.rez_config as dc
+
+    try:
+        fixture = dc.load_resolve_fixture(opts.replay_fixture)
+    except Exception, e:
+        error("could not load fixture '%s': %s" % (opts.replay_fixture, str(e)))
+        sys.exit(1)
+
+    resolver = fixture.create_resolver(quiet=True, max_time=opts.max_time,
+                                       max_configs=opts.max_configs,
+                                       max_fs_ops=opts.max_fs_ops,
+                                       max_memory=opts.max_memory)
+    result, secs = fixture.replay(resolver)
+    if isinstance(result, Exception):
+        output("FAILED (%s): %s" % (result.__class__.__name__, str(result)))
+    else:
+        output(' '.join(result))
+
+    if fixture.matches(result):
+        sys.stderr.write("the result matches the recording, took %.3fs\n" % secs)
+    else:
+        sys.stderr.write("the result DIFFERS from the recording, took %.3fs\n" % secs)
+        sys.exit(1)
 
 
 #    Copyright 2008-2012 Dr D Studios Pty Limited (ACN 127 184 954) (Dr. D Studios)
@@ -26,7 +26,7 @@ def setup_parser(parser):
                         help="list package dependencies")
 
 def command(opts):
-    import yaml
+    from rez.rez_metafile import load_metadict
     import rez.sigint as sigint
     import rez.rez_filesys as fs
 
@@ -56,7 +56,7 @@ def command(opts):
         vers = [x[0] for x in fs.get_versions_in_directory(fullpath, False)]
         if vers:
             filename = fullpath + '/' + str(vers[-1][0]) + "/package.yaml"
-            metadict = yaml.load(open(filename).read())
+            metadict = load_metadict(filename)
 
             ln = fullpath.split('/')[-1]
 
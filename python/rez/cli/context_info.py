@@ -3,13 +3,31 @@ Report on the current rez-configured environment.
 '''
 import os
 import sys
+from rez.cli import error, output
 
 def setup_parser(parser):
-    pass
+    parser.add_argument("--script", dest="script", type=str,
+                        default="",
+                        help="print the file of shell code which configures the current environment "
+                        "in the given shell (bash, csh, tcsh), generating it if necessary")
 
 def command(opts):
     import time
 
+    # the structured context, if the environment was created by a rez-env that writes one
+    context = None
+    data_file = os.getenv("REZ_CONTEXT_DATA")
+    if data_file and os.path.exists(data_file):
+        import rez.rez_context
+        context = rez.rez_context.load_context(data_file)
+
+    if opts.script:
+        if not context:
+            error("not in a resolved environment context with a context data file.")
+            sys.exit(1)
+        output(context.get_script_file(opts.script))
+        return
+
     print
     print "running rez-config v" + os.getenv('REZ_VERSION')
     print
@@ -19,6 +37,10 @@ def command(opts):
         print "not in a resolved environment context."
         sys.exit(1)
 
+    if context:
+        _print_context(context, context_file)
+        return
+
     resolve_mode = os.getenv('REZ_RESOLVE_MODE')
     request_time = int(os.getenv('REZ_REQUEST_TIME'))
     readable_time = time.strftime("%a %b %d %H:%M:%S %Z %Y",
@@ -60,6 +82,36 @@ def command(opts):
 
     print
 
+def _print_context(context, context_file):
+    import time
+
+    readable_time = time.strftime("%a %b %d %H:%M:%S %Z %Y",
+                                  time.localtime(context.request_time))
+    print "requested packages (mode=%s, time=%s: %s):" % (context.resolve_mode,
+                                                          context.request_time,
+                                                          readable_time)
+    print '\n'.join(context.request)
+    print
+
+    names = context.get_resolve()
+    column = max([len(pkg) for pkg in names] or [0])
+    column += 8
+    local_path = os.getenv('REZ_LOCAL_PACKAGES_PATH')
+    print 'resolved packages:'
+    for name, pkg in sorted(zip(names, context.packages)):
+        local = (' (local)' if local_path and pkg["root"].startswith(local_path) else '')
+        print name.ljust(column) + pkg["root"] + local
+
+    print
+    print "number of failed attempts: " + str(context.num_fails)
+
+    print
+    print "context file:"
+    print context_file
+    print context.filename
+
+    print
+
 #    Copyright 2008-2012 Dr D Studios Pty Limited (ACN 127 184 954) (Dr. D Studios)
 #
 #    This file is part of Rez.
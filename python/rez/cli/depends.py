@@ -31,28 +31,28 @@ import os
 import sys
 from rez.cli import error, output
 
-def _detect_cycle(pkgmap, depchain, depset):
-    pkg = depchain[-1]
-    if pkg in pkgmap:
-        for pkg2 in pkgmap[pkg]:
-            if pkg2 in depset:
-                depchain2 = depchain[:]
-                while depchain2[0] != pkg2:
-                    del depchain2[0]
-                depchain2.append(pkg2)
-                return depchain2
-
-            depchain2 = depchain[:]
-            depset2 = depset.copy()
-            depchain2.append(pkg2)
-            depset2.add(pkg2)
-            depchain3 = _detect_cycle(pkgmap, depchain2, depset2)
-            if len(depchain3) > 0:
-                return depchain3
-    return []
-
-def detect_cycle(pkg, pkgmap):
-    return _detect_cycle(pkgmap, [pkg], set(pkg))
+def detect_cycles(pkgmap):
+    """
+    Given a map of package to the set of packages that depend on it, return a list of
+    (cycle, packages) tuples, one per group of cyclically dependent packages. 'cycle' is
+    a list of packages forming a cycle, that starts and ends with the smallest package
+    name in the group, and 'packages' is every package in the group.
+    """
+    from rez.rez_depgraph import DependencyGraph
+
+    graph = DependencyGraph()
+    for pkg in sorted(pkgmap):
+        for pkg2 in sorted(pkgmap[pkg]):
+            graph.add_edge(pkg2, pkg)
+
+    cycles = []
+    for component in graph.get_cycles():
+        component = sorted(component)
+        # reversed, so that each package is followed by a package that depends on it
+        cycle = graph.find_cycle(component)
+        cycle.reverse()
+        cycles.append((cycle, component))
+    return cycles
 
 def setup_parser(parser):
     # usage = "usage: %prog [options] pkg1 pkg2 ... pkgN"
@@ -81,7 +81,7 @@ def setup_parser(parser):
                         help="display dependency info in a dot graph")
 
 def command(opts):
-    import yaml
+    from rez.rez_metafile import load_metadict
     import rez.sigint
     import rez.rez_filesys as fs
 
@@ -139,7 +139,7 @@ def command(opts):
         vers = [x[0] for x in fs.get_versions_in_directory(fullpath, False)]
         if vers:
             filename = fullpath + '/' + str(vers[-1][0]) + "/package.yaml"
-            metadict = yaml.load(open(filename).read())
+            metadict = load_metadict(filename)
 
             reqs = metadict["requires"] if ("requires" in metadict) else []
             vars = metadict["variants"] if ("variants" in metadict) else []
@@ -168,25 +168,9 @@ def command(opts):
     cycles = set()
     cycle_pkgs = set()
 
-    for pkg in all_packages:
-        cycle = detect_cycle(pkg, dependsMap)
-        if len(cycle) > 0:
-
-            # A<--B<--A is the same as B<--A<--B so rotate the list until the smallest string
-            # is at the front, so we don't get multiple reports of the same cycle
-            del cycle[-1]
-            smallest_str = cycle[0]
-            for cpkg in cycle:
-                if cpkg < smallest_str:
-                    smallest_str = cpkg
-            while cycle[0] != smallest_str:
-                cycle.append(cycle[0])
-                del cycle[0]
-
-            cycle_pkgs |= set(cycle)
-            cycle.append(cycle[0])
-            cycle_str = str("<--").join(cycle)
-            cycles.add(cycle_str)
+    for cycle, pkgs in detect_cycles(dependsMap):
+        cycle_pkgs |= set(pkgs)
+        cycles.add(str("<--").join(cycle))
 
     if len(cycles) > 0:
             if not opts.quiet:
@@ -19,7 +19,7 @@ from . import config as rez_cli_config
 
 def setup_parser(parser):
 
-    parser.add_argument("pkg", nargs='+',
+    parser.add_argument("pkg", nargs='*',
                         help='list of package names')
 
     # settings shared with `rez config`
@@ -53,6 +53,9 @@ def setup_parser(parser):
                         dest="add_strict",
                         action="store_true", default=False,
                         help="Add mode (strict). Packages will override or add to the existing resolve list")
+    parser.add_argument("--no-incremental", dest="no_incremental",
+                        action="store_true", default=False,
+                        help="when patching, resolve from scratch rather than reusing the current resolve")
     parser.add_argument("-f", "--view-fail", "--view_fail", dest="view_fail", type=int,
                         default=-1,
                         help="View the dotgraph for the Nth failed config attempt")
@@ -64,6 +67,14 @@ def command(opts):
     import tempfile
     autowrappers = _autowrappers(opts.pkg)
     raw_request = os.getenv('REZ_RAW_REQUEST', '')
+    if opts.from_lock:
+        if opts.pkg or opts.add_loose or opts.add_strict:
+            error("packages and patching cannot be used with --from-lock")
+            sys.exit(1)
+    elif not opts.pkg:
+        error("no packages specified")
+        sys.exit(1)
+
     if opts.add_loose or opts.add_strict:
         if autowrappers:
             error("Patching of auto-wrapper environments is not yet supported.")
@@ -124,30 +135,31 @@ def command(opts):
     ##############################################################################
     # call rez-config, and write env into bake file
     ##############################################################################
-    context_file = tempfile.mktemp(dir=opts.tmpdir, prefix='.rez-context.')
+    import rez.rez_context
+    # the structured context, and the bash script generated from it
+    context_base = tempfile.mktemp(dir=opts.tmpdir, prefix='.rez-context.')
+    data_file = context_base + ".json"
+    context_file = rez.rez_context.get_script_filename(data_file, 'bash')
     source_file = context_file + ".source"
     dot_file = context_file + ".dot"
 
-    # setup args for rez-config
-    # TODO: provide a util which reads defaults for the cli function
-    kwargs = dict(verbosity=0,
-                  version=False,
-                  print_env=False,
-                  print_dot=False,
-                  meta_info='tools',
+    # setup args for rez-config, starting from its defaults so that options added to
+    # rez-config need no changes here
+    kwargs = rez_cli_config.get_defaults()
+    kwargs.update(meta_info='tools',
                   meta_info_shallow='tools',
-                  env_file=context_file,
+                  context_file=data_file,
                   dot_file=dot_file,
-                  max_fails=opts.view_fail,
-                  wrapper=False,
-                  no_catch=False,
-                  no_path_append=False,
-                  print_pkgs=False)
+                  max_fails=opts.view_fail)
     # copy settings that are the same between rez-env and rez-config
     kwargs.update(vars(opts))
     # override values that differ
     kwargs['quiet'] = True
     kwargs['pkg'] = pkg_list.split()
+    if ctxt_pkg_list and os.getenv('REZ_RESOLVE') and not opts.no_incremental:
+        # patching - only re-resolve what has changed
+        kwargs['prev_resolve'] = os.environ['REZ_RESOLVE'].split()
+        kwargs['changed_pkgs'] = packages.split()
 
     config_opts = argparse.Namespace(**kwargs)
     try:
@@ -165,11 +177,13 @@ def command(opts):
                 rez_cli_dot.command(dot_opts)
             sys.exit(1)
         finally:
-            if os.path.exists(context_file):
-                os.remove(context_file)
+            if os.path.exists(data_file):
+                os.remove(data_file)
             if os.path.exists(dot_file):
                 os.remove(dot_file)
 
+    rez.rez_context.load_context(data_file).get_script_file('bash')
+
     if autowrappers:
         with open(context_file, 'w') as f:
             f.write("export REZ_RAW_REQUEST='%s'\n" % packages)
@@ -183,6 +197,7 @@ def command(opts):
         cmd += "export REZ_RAW_REQUEST='%s';" % packages
 
     cmd += "export REZ_CONTEXT_FILE=%s;" % context_file
+    cmd += "export REZ_CONTEXT_DATA=%s;" % data_file
     cmd += 'export REZ_ENV_PROMPT="%s";' % (os.getenv('REZ_ENV_PROMPT', '') + opts.prompt)
 
     if opts.stdin:
@@ -217,8 +232,8 @@ def command(opts):
         cmd += "ret=$?;"
         cmd += "rm -f %s;" % source_file
 
-    cmd += "rm -f %s;" % context_file
-    cmd += "rm -f %s;" % dot_file
+    # also removes the scripts generated for other shells
+    cmd += "rm -f %s.*;" % context_base
     output(cmd)
     # print "exit $ret;"
 
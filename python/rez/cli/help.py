@@ -11,7 +11,7 @@ import rez.sigint
 suppress_notfound_err = False
 
 def get_help(pkg):
-    import yaml
+    from rez.rez_metafile import load_metadict
     import rez.rez_config as dc
     global suppress_notfound_err
 
@@ -24,7 +24,7 @@ def get_help(pkg):
 
     yaml_file = pkg_base_path + "/package.yaml"
     try:
-        metadict = yaml.load(open(yaml_file).read())
+        metadict = load_metadict(yaml_file)
     except Exception:
         return (pkg_base_path, pkg_base_path, None)
 
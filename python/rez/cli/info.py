@@ -32,7 +32,7 @@ def setup_parser(parser):
 ##########################################################################################
 
 def command(opts):
-    import yaml
+    from rez.rez_metafile import load_metadict
     import rez.rez_config as dc
     import rez.sigint
     from rez.rez_util import get_epoch_time
@@ -59,7 +59,7 @@ def command(opts):
 
     if pkg_info:
         try:
-            metadict = yaml.load(open(yaml_file).read())
+            metadict = load_metadict(yaml_file)
         except Exception:
             error("The package appears to be missing a package.yaml.")
             sys.exit(1)
@@ -90,7 +90,7 @@ def command(opts):
         output(days)
     else:
         try:
-            metadict = yaml.load(open(yaml_file).read())
+            metadict = load_metadict(yaml_file)
             output("The package appears to be external.")
             if "description" in metadict:
                 output("Description:")
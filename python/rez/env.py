@@ -80,6 +80,16 @@ def get_context_dot_path():
     return get_context_path() + ".dot"
 
 
+def get_context():
+    """
+    @return The structured context of the current environment (see rez_context), which holds
+        the request, the resolved packages with their roots and metadata, and the environment
+        commands.
+    """
+    import rez_context
+    return rez_context.load_context(_get_rez_env_var("REZ_CONTEXT_DATA"))
+
+
 def _get_rez_env_var(var):
     val = os.getenv(var)
     if val is None:
@@ -19,6 +19,14 @@ RESOLVE_MODE_EARLIEST = 'earliest'
 # don't try and resolve further, and raise an exception
 RESOLVE_MODE_NONE = 'none'
 
+
+# Resolver backends
+#
+# The default, depth-first search with backtracking
+SOLVER_DEFAULT = 'default'
+# A conflict-driven clause-learning SAT solver, see rez_sat.py
+SOLVER_SAT = 'sat'
+
 #    Copyright 2008-2012 Dr D Studios Pty Limited (ACN 127 184 954) (Dr. D Studios)
 #
 #    This file is part of Rez.
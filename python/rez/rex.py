@@ -390,6 +390,9 @@ class Python(CommandInterpreter):
     def setenv(self, key, value):
         if isinstance(value, (list, tuple)):
             value = self._env_sep(key).join(value)
+        # as in the shells, values such as numbers are set as strings
+        if not isinstance(value, basestring):
+            value = str(value)
         self._environ[key] = self._expand(value)
 
     def unsetenv(self, key):
@@ -0,0 +1,351 @@
+"""
+Synthetic package repositories, and an end-to-end resolver benchmark that runs over them.
+
+generate_repository() writes a repository of made-up packages to disk. Its size and shape
+(families, versions, dependency fan-out, variants, anti, weak and conditional requirements,
+release times) are configurable, and the dependencies are random but reproducible from a
+seed. Families only depend on families generated before them, so there are no cycles.
+
+benchmark_resolves() resolves a list of requests against a repository. Each request is
+resolved cold (by a new resolver, with memcached disabled), then warm (again, by the same
+resolver), in a forked process, so that peak memory is measured per request.
+compare_solvers() does the same with each resolver backend, and lists the requests that they
+resolve differently. See rez-benchmark, which drives these and writes the results as json.
+"""
+import os
+import sys
+import time
+import random
+import itertools
+import resource
+import cPickle
+import yaml
+from rez_config import *
+
+
+# files written alongside the generated families
+SPEC_FILENAME = "benchmark_spec.yaml"
+REQUESTS_FILENAME = "benchmark_requests.txt"
+
+# each item is a variant axis, as a family and its versions
+DEFAULT_VARIANT_MATRIX = "python-2.6,2.7 gcc-4.1,4.8"
+
+# release time of the first generated package
+DEFAULT_START_TIME = 1300000000
+
+
+def parse_variant_matrix(s):
+    """
+    Parse a variant matrix string such as 'python-2.6,2.7 gcc-4.1,4.8' into a list of
+    (family, [versions]).
+    """
+    axes = []
+    for axis in s.split():
+        fam, vers = axis.split('-', 1)
+        axes.append((fam, vers.split(',')))
+    return axes
+
+
+def generate_repository(path, num_families=100, num_versions=5, fan_out=3,
+    variant_matrix=DEFAULT_VARIANT_MATRIX, variant_fraction=0.2, anti_fraction=0.05,
+    weak_fraction=0.05, conditional_fraction=0.05, num_requests=20, request_size=3, seed=0,
+    start_time=DEFAULT_START_TIME, release_interval=3600):
+    """
+    Write a synthetic package repository into the directory 'path', which must be empty or
+    not exist yet.
+    num_families: number of families, named fam00000, fam00001 and so on
+    num_versions: versions per family, 1.0, 1.1, 2.0, 2.1 and so on
+    fan_out: number of families each family requires. These are picked from the families
+        generated just before it. Each version requires the same major version of each of
+        them as its own, or (for some) a similar major version or later.
+    variant_matrix: the variant axes (see parse_variant_matrix). A family with variants has
+        one for every combination of axis versions. The axis families are generated too.
+    variant_fraction: fraction of families that have variants
+    anti_fraction, weak_fraction, conditional_fraction: the chance of each package version
+        having an anti-requirement (of an old version), a weak requirement and a conditional
+        requirement, of other families
+    num_requests, request_size: number of benchmark requests to generate, and families per
+        request, which are picked from the last quarter of the families
+    seed: random seed, the same arguments always generate the same repository
+    start_time, release_interval: packages are released one after the other, in version
+        order, from start_time and release_interval seconds apart
+    The arguments are written to SPEC_FILENAME, and the requests to REQUESTS_FILENAME,
+    one per line. Returns the requests, as lists of package strings.
+    """
+    if os.path.exists(path) and os.listdir(path):
+        raise PkgSystemError("cannot generate a repository into '%s', it is not empty" % path)
+
+    spec = {
+        "num_families":         num_families,
+        "num_versions":         num_versions,
+        "fan_out":              fan_out,
+        "variant_matrix":       variant_matrix,
+        "variant_fraction":     variant_fraction,
+        "anti_fraction":        anti_fraction,
+        "weak_fraction":        weak_fraction,
+        "conditional_fraction": conditional_fraction,
+        "num_requests":         num_requests,
+        "request_size":         request_size,
+        "seed":                 seed,
+        "start_time":           start_time,
+        "release_interval":     release_interval }
+
+    rng = random.Random(seed)
+    axes = parse_variant_matrix(variant_matrix)
+    variants = [list(x) for x in itertools.product(
+        *[[fam + '-' + ver for ver in vers] for fam, vers in axes])] if axes else []
+
+    for fam, vers in axes:
+        for ver in vers:
+            _write_package(path, fam, ver, {}, start_time)
+
+    names = ["fam%05d" % i for i in range(num_families)]
+    versions = ["%d.%d" % (k / 2 + 1, k % 2) for k in range(num_versions)]
+    num_majors = (num_versions + 1) / 2
+    window = max(fan_out * 10, 20)
+
+    for i, name in enumerate(names):
+        lower = range(max(0, i - window), i)
+        deps = rng.sample(lower, min(fan_out, len(lower)))
+        # each major version of a family requires the same major version of a dependency,
+        # or that version or one before it onwards. Later versions never require earlier
+        # versions, so dependency transitivity holds
+        open_ended = [(rng.random() < 0.3) for j in deps]
+        offsets = [(rng.choice((-1, 0)) if open_ else 0) for open_ in open_ended]
+        has_variants = bool(variants) and (rng.random() < variant_fraction)
+
+        for k, ver in enumerate(versions):
+            requires = []
+            for j, offset, open_ in zip(deps, offsets, open_ended):
+                major = max(1, (k / 2) + 1 + offset)
+                requires.append("%s-%d%s" % (names[j], major, '+' if open_ else ''))
+
+            others = [j for j in lower if j not in deps]
+            if others and (rng.random() < anti_fraction):
+                requires.append("!%s-1" % names[rng.choice(others)])
+            if others and (rng.random() < weak_fraction):
+                requires.append("~%s-%d+" % (names[rng.choice(others)], \
+                    rng.randint(1, num_majors)))
+            if (len(others) > 1) and (rng.random() < conditional_fraction):
+                j, j2 = rng.sample(others, 2)
+                requires.append("%s?%s" % (names[j], names[j2]))
+
+            metadict = {}
+            if requires:
+                metadict["requires"] = requires
+            if has_variants:
+                metadict["variants"] = variants
+            timestamp = start_time + ((k * num_families) + i + 1) * release_interval
+            _write_package(path, name, ver, metadict, timestamp)
+
+    top = names[-max(1, num_families / 4):]
+    requests = []
+    for i in range(num_requests):
+        requests.append(sorted(rng.sample(top, min(request_size, len(top)))))
+
+    with open(os.path.join(path, SPEC_FILENAME), 'w') as f:
+        yaml.safe_dump(spec, f, default_flow_style=False)
+    with open(os.path.join(path, REQUESTS_FILENAME), 'w') as f:
+        for request in requests:
+            f.write(' '.join(request) + '\n')
+    return requests
+
+
+def _write_package(path, name, version, metadict, timestamp):
+    base = os.path.join(path, name, version)
+    os.makedirs(os.path.join(base, ".metadata"))
+
+    metadict = dict(metadict)
+    metadict["config_version"] = 0
+    metadict["name"] = name
+    metadict["version"] = version
+    with open(os.path.join(base, PKG_METADATA_FILENAME), 'w') as f:
+        yaml.safe_dump(metadict, f, default_flow_style=False)
+    with open(os.path.join(base, ".metadata", "release_time.txt"), 'w') as f:
+        f.write(str(timestamp))
+
+    for variant in metadict.get("variants", []):
+        os.makedirs(os.path.join(base, *variant))
+
+
+def load_requests(filename):
+    """
+    Read requests from a file, one per line. Blank lines and '#' comments are ignored.
+    """
+    requests = []
+    with open(filename) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if line:
+                requests.append(line.split())
+    return requests
+
+
+def benchmark_resolves(path, requests, resolve_mode=RESOLVE_MODE_LATEST,
+    solver=SOLVER_DEFAULT, assume_dt=True, warm=True, max_time=-1):
+    """
+    Resolve each request against the packages in 'path' only, cold and then (if warm is
+    True) warm. Returns a list with a dict for each request, holding the request, the
+    results of each resolve (see _timed_resolve), and the peak memory of the process that
+    resolved it, in megabytes.
+    """
+    resolver_args = (resolve_mode, solver, assume_dt, max_time)
+    entries = []
+    for i, request in enumerate(requests):
+        sys.stderr.write("[%d/%d] %s\n" % (i + 1, len(requests), ' '.join(request)))
+        entries.append(_run_in_child(_benchmark_request, path, request, resolver_args, warm))
+    return entries
+
+
+def compare_solvers(path, requests, resolve_mode=RESOLVE_MODE_LATEST, assume_dt=True,
+    max_time=-1):
+    """
+    Resolve each request cold with each resolver backend (see benchmark_resolves). Returns
+    a dict holding the entries of each backend, keyed by solver, and 'differences' - a
+    dict for each request that the backends resolve to different packages (or that one of
+    them fails), holding the request and the result of each backend.
+    """
+    results = {}
+    for solver in (SOLVER_DEFAULT, SOLVER_SAT):
+        results[solver] = benchmark_resolves(path, requests, resolve_mode, solver, assume_dt,
+                                             False, max_time)
+
+    differences = []
+    for entry, entry_sat in zip(results[SOLVER_DEFAULT], results[SOLVER_SAT]):
+        result = _get_result(entry["cold"])
+        result_sat = _get_result(entry_sat["cold"])
+        if result != result_sat:
+            differences.append({
+                "request":          entry["request"],
+                SOLVER_DEFAULT:     result,
+                SOLVER_SAT:         result_sat })
+    results["differences"] = differences
+    return results
+
+
+def summarise(entries):
+    """
+    Return totals over the result of benchmark_resolves, for each of 'cold' and 'warm'.
+    """
+    summary = {}
+    for phase in ("cold", "warm"):
+        results = [x[phase] for x in entries if phase in x]
+        if not results:
+            continue
+        secs = [x["secs"] for x in results]
+        summary[phase] = {
+            "num_resolves":     len(results),
+            "num_failed":       len([x for x in results if x["result"] != "ok"]),
+            "total_secs":       sum(secs),
+            "mean_secs":        sum(secs) / len(secs),
+            "max_secs":         max(secs),
+            "total_fs_ops":     sum(x["fs_ops"] for x in results),
+            "total_passes":     sum(x["passes"] for x in results),
+            "total_visits":     sum(x["visits"] for x in results) }
+    if entries:
+        summary["max_peak_memory_mb"] = max(x["peak_memory_mb"] for x in entries)
+    return summary
+
+
+def _benchmark_request(path, request, resolver_args, warm):
+    resolve_mode, solver, assume_dt, max_time = resolver_args
+    resolver = Resolver(resolve_mode, quiet=True, assume_dt=assume_dt, caching=False,
+        solver=solver, max_time=max_time)
+    resolver.get_memcache().set_package_paths([path])
+
+    entry = {"request": ' '.join(request)}
+    entry["cold"] = _timed_resolve(resolver, request)
+    if warm:
+        entry["warm"] = _timed_resolve(resolver, request)
+    # ru_maxrss is in kilobytes on linux
+    entry["peak_memory_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return entry
+
+
+def _timed_resolve(resolver, request):
+    """
+    Resolve the request, returning a dict of the seconds taken, the number of filesystem
+    lookups made, the passes made over configurations and the packages they visited (see
+    Resolver.get_num_passes), and the result - 'ok', or the name of the exception raised
+    (of any type).
+    A successful resolve also gives the resolved packages, as sorted strings. The OS package
+    is not requested.
+    """
+    memcache = resolver.get_memcache()
+    start_fs_ops = memcache.num_fs_ops
+    start_time = time.time()
+    entry = {}
+    try:
+        pkg_reqs = [str_to_pkg_req(x, memcache) for x in request]
+        pkg_res_list = resolver.resolve(pkg_reqs, True)[0]
+        entry["result"] = "ok"
+        entry["num_packages"] = len(pkg_res_list)
+        entry["packages"] = sorted(x.short_name() for x in pkg_res_list)
+    except Exception, e:
+        # failures are results too - a request that stops resolving, or starts raising
+        # (eg a regression that deepens the search past python's recursion limit), shows
+        # up here rather than ending the run
+        entry["result"] = e.__class__.__name__
+    entry["secs"] = time.time() - start_time
+    entry["fs_ops"] = memcache.num_fs_ops - start_fs_ops
+    entry["passes"], entry["visits"] = resolver.get_num_passes()
+    return entry
+
+
+def _get_result(entry):
+    # the resolved packages, or the name of the error raised
+    if entry["result"] == "ok":
+        return entry["packages"]
+    return entry["result"]
+
+
+def _run_in_child(fn, *args):
+    """
+    Call fn(*args) in a forked process, and return its result, which must be picklable.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    fd_read, fd_write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(fd_read)
+        try:
+            data = cPickle.dumps(fn(*args), cPickle.HIGHEST_PROTOCOL)
+            while data:
+                data = data[os.write(fd_write, data):]
+        except:
+            import traceback
+            traceback.print_exc()
+        finally:
+            os._exit(0)
+
+    os.close(fd_write)
+    chunks = []
+    while True:
+        chunk = os.read(fd_read, 1 << 16)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(fd_read)
+    os.waitpid(pid, 0)
+    if not chunks:
+        raise PkgSystemError("benchmark process failed")
+    return cPickle.loads(''.join(chunks))
+
+
+#    Copyright 2008-2012 Dr D Studios Pty Limited (ACN 127 184 954) (Dr. D Studios)
+#
+#    This file is part of Rez.
+#
+#    Rez is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Rez is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Rez.  If not, see <http://www.gnu.org/licenses/>.
@@ -44,12 +44,15 @@ import time
 import yaml
 import sys
 import random
+import bisect
+import collections
 import subprocess as sp
 from versions import *
 from public_enums import *
 from rez_exceptions import *
 from rez_metafile import *
 from rez_memcached import *
+from rez_depgraph import DependencyGraph
 import rez_filesys
 import rez_util
 import rex
@@ -172,7 +175,9 @@ class Resolver(object):
 	Where all the action happens. This class performs a package resolve.
 	"""
 	def __init__(self, resolve_mode, quiet=False, verbosity=0, max_fails=-1, time_epoch=0,
-		build_requires=False, assume_dt=False, caching=True):
+		build_requires=False, assume_dt=False, caching=True, solver=SOLVER_DEFAULT,
+		max_time=-1, max_configs=-1, max_fs_ops=-1, max_memory=-1, num_procs=1,
+		profile=False, max_fail_history=-1):
 		"""
 		resolve_mode: one of: RESOLVE_MODE_EARLIEST, RESOLVE_MODE_LATEST
 		quiet: if True then hides unnecessary output (such as the progress dots)
@@ -182,6 +187,22 @@ class Resolver(object):
 			case, meaning do not ignore any packages
 		assume_dt: Assume dependency transitivity
 		caching: If True, resolve info is read from and written to a memcache daemon if possible.
+		solver: one of: SOLVER_DEFAULT, SOLVER_SAT. The SAT solver is not used in
+			RESOLVE_MODE_NONE, and its resolves are never cached.
+		max_time: abandon the resolve after N seconds, default -1 (no limit)
+		max_configs: abandon the resolve after spawning N configurations, default -1 (no limit)
+		max_fs_ops: abandon the resolve after N filesystem lookups, default -1 (no limit)
+		max_memory: abandon the resolve once the process' peak memory usage exceeds N
+			megabytes, default -1 (no limit)
+		A resolve that exceeds a budget raises PkgResolveBudgetError.
+		num_procs: if > 1, the candidate versions of the first package that needs searching
+			are resolved speculatively in up to N forked processes. The result is the same
+			as a sequential resolve. This is not done when max_fails or verbosity are set.
+		profile: if True, record where the time goes in each resolve, see get_profile().
+			Candidates are not resolved speculatively when profiling.
+		max_fail_history: if >= 0, run in memory-bounded mode - only the N most recent failed
+			configuration attempts are kept (the total is still counted), and each is described
+			by its package names rather than the whole configuration. Default -1 (keep all).
 		"""
 		if not time_epoch:
 			time_epoch = int(time.time())
@@ -195,21 +216,60 @@ class Resolver(object):
 		self.rctxt.assume_dt = assume_dt
 		self.rctxt.time_epoch = time_epoch
 		self.rctxt.memcache = RezMemCache(time_epoch, caching)
+		self.rctxt.solver = solver
+		self.rctxt.max_time = max_time
+		self.rctxt.max_configs = max_configs
+		self.rctxt.max_fs_ops = max_fs_ops
+		self.rctxt.max_memory = max_memory
+		self.rctxt.num_procs = num_procs
+		self.rctxt.max_fail_history = max_fail_history
+		self.profile = profile
+		self.incremental_info = None
+		if resolve_mode == RESOLVE_MODE_NONE:
+			self.rctxt.solver = SOLVER_DEFAULT
 
 	def get_memcache(self):
 		return self.rctxt.memcache
 
+	def get_profile(self):
+		"""
+		Return the profile of the last resolve (see _ResolveProfile), or None if profiling is
+		not enabled.
+		"""
+		return self.rctxt.profile
+
+	def get_num_pruned_configs(self):
+		"""
+		Return the number of candidate configurations that were skipped during the last
+		resolve, because they contained a combination of packages already known to conflict.
+		"""
+		return self.rctxt.num_pruned
+
+	def get_num_passes(self):
+		"""
+		Return the number of passes made over the packages of a configuration during the
+		last resolve, and the number of packages those passes visited.
+		"""
+		return (self.rctxt.num_passes, self.rctxt.num_visits)
+
 	def guarded_resolve(self, pkg_req_strs, no_os=False, no_path_append=False, is_wrapper=False,
-		meta_vars=None, shallow_meta_vars=None, dot_file=None, print_dot=False):
+		meta_vars=None, shallow_meta_vars=None, dot_file=None, print_dot=False,
+		prev_resolve=None, changed_pkg_strs=None):
 		"""
 		Just a wrapper for resolve() which does some command-line friendly stuff and has some 
-		extra options for convenience.
+		extra options for convenience. If prev_resolve is given, resolve_incremental() is
+		used instead.
 		@return None on failure, same as resolve() otherwise.
 		"""
 		try:
 			pkg_reqs = [str_to_pkg_req(x, self.rctxt.memcache) for x in pkg_req_strs]
-			result = self.resolve(pkg_reqs, no_os, no_path_append, is_wrapper, \
-				meta_vars, shallow_meta_vars)
+			if prev_resolve:
+				changed_pkg_reqs = [str_to_pkg_req(x, self.rctxt.memcache) for x in (changed_pkg_strs or [])]
+				result = self.resolve_incremental(pkg_reqs, prev_resolve, changed_pkg_reqs, \
+					no_os, no_path_append, is_wrapper, meta_vars, shallow_meta_vars)
+			else:
+				result = self.resolve(pkg_reqs, no_os, no_path_append, is_wrapper, \
+					meta_vars, shallow_meta_vars)
 
 		except PkgSystemError, e:
 			sys.stderr.write(str(e)+'\n')
@@ -270,6 +330,24 @@ class Resolver(object):
 
 			return None
 
+		except PkgResolveBudgetError, e:
+			sys.stderr.write("The configuration could not be resolved, the " + str(e) + ":\n")
+			for p in e.pkg_reqs:
+				sys.stderr.write(str(p)+'\n')
+			if e.fail_config_list:
+				sys.stderr.write("The failed configuration attempts so far were:\n")
+				for s in e.fail_config_list:
+					sys.stderr.write(s+'\n')
+
+			# we still produce a dot-graph on failure
+			if e.last_dot_graph:
+				if dot_file:
+					rez_util.gen_dotgraph_image(e.last_dot_graph, dot_file)
+				if print_dot:
+					print(e.last_dot_graph)
+
+			return None
+
 		except PkgConfigNotResolvedError, e:
 			sys.stderr.write("The configuration could not be resolved:\n")
 			for p in e.pkg_reqs:
@@ -318,6 +396,19 @@ class Resolver(object):
 		-OR-
 		raise the relevant exception, if config resolution is not possible
 		"""
+		if not self.profile:
+			return self._resolve(pkg_reqs, no_os, no_path_append, is_wrapper, \
+				meta_vars, shallow_meta_vars)
+
+		self.rctxt.profile = _ResolveProfile(self.rctxt.solver)
+		try:
+			return self._resolve(pkg_reqs, no_os, no_path_append, is_wrapper, \
+				meta_vars, shallow_meta_vars)
+		finally:
+			self.rctxt.profile.finish()
+
+	def _resolve(self, pkg_reqs, no_os, no_path_append, is_wrapper, meta_vars,
+		shallow_meta_vars):
 		if not no_os:
 			os_pkg_req = str_to_pkg_req(rez_filesys._g_os_pkg)
 			pkg_reqs = [os_pkg_req] + pkg_reqs
@@ -325,12 +416,35 @@ class Resolver(object):
 		if not pkg_reqs:
 			return ([], [], "digraph g{}", 0)
 
-		# get the resolve, possibly read/write cache
-		result = self.get_cached_resolve(pkg_reqs)
-		if not result:
-			result = self.resolve_base(pkg_reqs)
-			self.set_cached_resolve(pkg_reqs, result)
+		# get the resolve, possibly read/write cache. Pinned resolves are not cached, since
+		# the pins are not part of the request
+		prof = self.rctxt.profile
+		if prof:
+			prof.request = [x.short_name() for x in pkg_reqs]
 
+		if self.rctxt.pins:
+			result = self.resolve_base(pkg_reqs)
+		else:
+			t = time.time()
+			result = self.get_cached_resolve(pkg_reqs)
+			if prof:
+				prof.add_phase_time("caching", time.time() - t)
+			if not result:
+				result = self.resolve_base(pkg_reqs)
+				t = time.time()
+				self.set_cached_resolve(pkg_reqs, result)
+				if prof:
+					prof.add_phase_time("caching", time.time() - t)
+
+		return self._add_env_commands(pkg_reqs, result, no_path_append, is_wrapper, \
+			meta_vars, shallow_meta_vars)
+
+	def _add_env_commands(self, pkg_reqs, result, no_path_append, is_wrapper, meta_vars,
+		shallow_meta_vars):
+		"""
+		Add the commands that are not cached with a resolve (system paths, wrapper and meta
+		env-vars) to the result of resolve_base.
+		"""
 		recorder = rex.CommandRecorder()
 
 		if not is_wrapper:
@@ -382,7 +496,381 @@ class Resolver(object):
 
 		return pkg_res_list, recorder.commands, dot_graph, nfails
 
+	def resolve_many(self, requests, no_os=False, no_path_append=False, is_wrapper=False,
+		meta_vars=None, shallow_meta_vars=None, num_workers=1):
+		"""
+		Perform many package resolves, sharing this resolver's cache and learnt conflicts
+		between them.
+		Inputs:
+		requests: list of requests, where each request is a list of package requests (as
+			strings or PackageRequests)
+		num_workers: if > 1, resolve in a pool of N forked processes
+		The remaining inputs are as for resolve().
+		@yields (index, result) as each resolve finishes, where index is the position of the
+		request in 'requests', and result is either what resolve() returns, or the exception
+		it raised. Identical requests are resolved once, and yielded together. With
+		num_workers > 1, results are yielded in the order the resolves finish.
+		"""
+		global _g_batch_resolve
+
+		# group identical requests
+		fingerprints = []
+		indices = {}
+		pkg_reqs_list = []
+		for i, request in enumerate(requests):
+			try:
+				pkg_reqs = [(str_to_pkg_req(x, self.rctxt.memcache) if isinstance(x, basestring) \
+					else x) for x in request]
+			except (RezError, VersionError), e:
+				yield i, e
+				continue
+
+			fingerprint = _get_request_fingerprint(pkg_reqs)
+			if fingerprint not in indices:
+				indices[fingerprint] = []
+				fingerprints.append(fingerprint)
+				pkg_reqs_list.append(pkg_reqs)
+			indices[fingerprint].append(i)
+
+		args = (no_os, no_path_append, is_wrapper, meta_vars, shallow_meta_vars)
+		if (num_workers > 1) and (len(pkg_reqs_list) > 1):
+			from multiprocessing.pool import Pool
+
+			# workers are forked, and so inherit this resolver and its warm cache
+			_g_batch_resolve = (self, args)
+			pool = Pool(processes=num_workers, initializer=_init_resolve_many_process)
+			try:
+				results = pool.imap_unordered(_resolve_many_process, enumerate(pkg_reqs_list))
+				for j, result in results:
+					for i in indices[fingerprints[j]]:
+						yield i, result
+			finally:
+				pool.terminate()
+				pool.join()
+				_g_batch_resolve = None
+		else:
+			for j, pkg_reqs in enumerate(pkg_reqs_list):
+				try:
+					result = self.resolve(pkg_reqs, *args)
+				except (RezError, VersionError), e:
+					result = e
+				for i in indices[fingerprints[j]]:
+					yield i, result
+
+	def resolve_incremental(self, pkg_reqs, prev_resolve, changed_pkg_reqs, no_os=False,
+		no_path_append=False, is_wrapper=False, meta_vars=None, shallow_meta_vars=None):
+		"""
+		Perform a package resolve, reusing a previous resolve of a similar request.
+		Inputs:
+		pkg_reqs: list of packages to resolve into a configuration
+		prev_resolve: list of the previously resolved packages, as strings (eg 'foo-1.2')
+		changed_pkg_reqs: the packages that differ between the previous request and this one
+		The remaining inputs are as for resolve().
+		Previously resolved packages are pinned (as weak requests) to their previous versions,
+		unless they are in a changed family, or depend on one. If this resolve fails, a full
+		resolve is done instead. get_incremental_info() describes the last incremental resolve.
+		@returns the same as resolve()
+		"""
+		start_time = time.time()
+		changed_fams = set(x.name.lstrip('!~') for x in changed_pkg_reqs)
+		affected = self.get_dependent_families(prev_resolve, changed_fams)
+		pins = [str_to_pkg_req('~' + x) for x in prev_resolve \
+			if (x.split('-', 1)[0] not in affected) and (not x.startswith('!'))]
+
+		args = (no_os, no_path_append, is_wrapper, meta_vars, shallow_meta_vars)
+		self.rctxt.pins = pins
+		try:
+			result = self.resolve(pkg_reqs, *args)
+			fell_back = False
+		except (RezError, VersionError):
+			self.rctxt.pins = []
+			result = self.resolve(pkg_reqs, *args)
+			fell_back = True
+		finally:
+			self.rctxt.pins = []
+
+		self.incremental_info = (len(pins), len(prev_resolve), fell_back, \
+			time.time() - start_time)
+		return result
+
+	def get_incremental_info(self):
+		"""
+		Return (number of pinned packages, number of packages in the previous resolve, True
+		if a full resolve was needed, time taken in seconds) for the last resolve_incremental().
+		"""
+		return self.incremental_info
+
+	def get_dependent_families(self, resolve, fams):
+		"""
+		Return the families in 'fams', and those packages in 'resolve' (a list of package
+		strings) which depend on any of them, directly or indirectly. All variants and
+		conditional requirements of a package count as dependencies.
+		"""
+		memcache = self.rctxt.memcache
+		affected = set(fams)
+		deps = {}
+		for pkg_str in resolve:
+			if pkg_str.startswith('!'):
+				continue
+			try:
+				pkg = _Package(str_to_pkg_req(pkg_str), memcache)
+				found = pkg.resolve_metafile(memcache)
+			except (RezError, VersionError):
+				found = False
+			if not found:
+				# the package has gone, so it must be re-resolved
+				affected.add(pkg_str.split('-', 1)[0])
+				continue
+			reqs = get_metafile_requests(pkg.metadata, memcache)
+			names = set(x.name for x in reqs.get_requires(self.rctxt.build_requires))
+			for req, conds in reqs.get_conditional_requires():
+				names.add(req.name)
+				names.update(conds)
+			for metavar, requests in (reqs.get_variants() or ()):
+				names.update(x.name for x in requests)
+			deps[pkg.name] = set(x.lstrip('!~') for x in names)
+
+		changed = True
+		while changed:
+			changed = False
+			for name, names in deps.iteritems():
+				if (name not in affected) and (names & affected):
+					affected.add(name)
+					changed = True
+		return affected
+
+	def set_time_epoch(self, time_epoch):
+		"""
+		Ignore packages newer than the given time-date in later resolves (0 means the current
+		time). The cache is kept warm - only what depends on the epoch is recomputed. Learnt
+		conflicts are dropped, since they hold requirements such as 'foo=l' as bound at the
+		old epoch.
+		"""
+		if not time_epoch:
+			time_epoch = int(time.time())
+		self.rctxt.time_epoch = time_epoch
+		self.rctxt.memcache.set_epoch(time_epoch)
+		self.rctxt.nogoods = {}
+		self.rctxt.envelopes = {}
+
+	def set_overlay(self, overlay):
+		"""
+		Resolve against the hypothetical packages of the given PackageOverlay (or None), as
+		well as those on disk - see RezMemCache.set_overlay. Learnt conflicts and family
+		envelopes are dropped, since overlay packages can take the place of released ones.
+		"""
+		self.rctxt.memcache.set_overlay(overlay)
+		self.rctxt.nogoods = {}
+		self.rctxt.envelopes = {}
+
+	def bisect_time(self, pkg_req_strs, start_epoch, end_epoch, no_os=False):
+		"""
+		Find the first time-date, after start_epoch and up to end_epoch, at which the resolve
+		of the given request differs from its resolve at start_epoch, or starts or stops
+		failing. The candidate times are the release times of the requested
+		families, and of the families in the resolves at start_epoch and end_epoch. These
+		are binary-searched, so only one result change is assumed between the two times.
+		@returns None if the resolves at start_epoch and end_epoch are the same. Otherwise
+		(epoch, result before, result after, releases at epoch, number of resolves done),
+		where a result is a list of resolved package strings, or the exception raised by the
+		resolve, and releases is a list of package strings (eg 'foo-1.2').
+		"""
+		prev_epoch = self.rctxt.time_epoch
+		probes = {}
+
+		def _probe(epoch):
+			if epoch not in probes:
+				self.set_time_epoch(epoch)
+				try:
+					pkg_reqs = [str_to_pkg_req(x, self.rctxt.memcache) for x in pkg_req_strs]
+					result = self.resolve(pkg_reqs, no_os)[0]
+					key = tuple(x.short_name() for x in result)
+					result = [x.short_name() for x in result]
+				except (RezError, VersionError), e:
+					# all failures count as the same result
+					result = e
+					key = None
+				probes[epoch] = (key, result)
+			return probes[epoch]
+
+		try:
+			start_key, start_result = _probe(start_epoch)
+			end_key, end_result = _probe(end_epoch)
+			if start_key == end_key:
+				return None
+
+			fams = set(x.split('-', 1)[0].lstrip('!~') for x in pkg_req_strs)
+			for result in (start_result, end_result):
+				if not isinstance(result, Exception):
+					fams.update(x.split('-', 1)[0] for x in result)
+
+			# the memcache is now at end_epoch, so no later releases are listed
+			releases = {}
+			for fam in fams:
+				for fam_path, ver, pkg_epoch in self.rctxt.memcache.iter_packages(fam):
+					if start_epoch < pkg_epoch <= end_epoch:
+						releases.setdefault(pkg_epoch, []).append(fam + '-' + str(ver))
+
+			epochs = sorted(releases)
+			if (not epochs) or (epochs[-1] != end_epoch):
+				epochs.append(end_epoch)
+
+			# the resolve at epochs[lo] matches start_epoch, at epochs[hi] it does not
+			lo = -1
+			hi = len(epochs) - 1
+			while (hi - lo) > 1:
+				mid = (lo + hi) / 2
+				if _probe(epochs[mid])[0] == start_key:
+					lo = mid
+				else:
+					hi = mid
+
+			before = probes[epochs[lo] if lo >= 0 else start_epoch][1]
+			after = probes[epochs[hi]][1]
+			return epochs[hi], before, after, sorted(releases.get(epochs[hi], [])), len(probes)
+		finally:
+			self.set_time_epoch(prev_epoch)
+
+	def record_resolve(self, pkg_req_strs, filename, no_os=False):
+		"""
+		Resolve the request, and write a fixture file holding the request, this resolver's
+		options, the result, and every answer the resolver got from the memcache. The fixture
+		can be resolved again without the package repository, see load_resolve_fixture. Use a
+		new Resolver, so that nothing learnt from earlier resolves is left out of the fixture.
+		@returns the same as resolve(), or raises the resolve's exception, once the fixture
+		is written.
+		"""
+		pkg_req_strs = list(pkg_req_strs)
+		if not no_os:
+			pkg_req_strs = [rez_filesys._g_os_pkg] + pkg_req_strs
+
+		memcache = self.rctxt.memcache
+		memcache.start_recording()
+		error = None
+		try:
+			pkg_reqs = [str_to_pkg_req(x, memcache) for x in pkg_req_strs]
+			result = self.resolve(pkg_reqs, True)
+		except (RezError, VersionError), e:
+			error = e
+		finally:
+			answers = memcache.get_recording()
+
+		fixture = {
+			"fixture_version":	ResolveFixture.FIXTURE_VERSION,
+			"request":			pkg_req_strs,
+			"options": {
+				"resolve_mode":		self.rctxt.resolve_mode,
+				"time_epoch":		self.rctxt.time_epoch,
+				"build_requires":	self.rctxt.build_requires,
+				"assume_dt":		self.rctxt.assume_dt,
+				"solver":			self.rctxt.solver },
+			"result":			None,
+			"error":			None,
+			"answers":			answers }
+		if error:
+			fixture["error"] = error.__class__.__name__
+		else:
+			fixture["result"] = [x.short_name() for x in result[0]]
+
+		with open(filename, 'w') as f:
+			yaml.safe_dump(fixture, f, default_flow_style=False)
+
+		if error:
+			raise error
+		return result
+
+	def write_lock(self, pkg_req_strs, result, filename, no_os=False):
+		"""
+		Write a lock file for 'result', the result of resolving 'pkg_req_strs' with this
+		resolver. The lock holds the exact packages resolved - their versions, chosen variant
+		roots and release times, and the contents, mtime and size of their metafiles - so that
+		the environment can be built again without a resolve, see resolve_from_lock.
+		"""
+		pkg_req_strs = list(pkg_req_strs)
+		if not no_os:
+			pkg_req_strs = [rez_filesys._g_os_pkg] + pkg_req_strs
+
+		pkg_res_list, commands, dot_graph, nfails = result
+		packages = []
+		for pkg_res in pkg_res_list:
+			metafile = pkg_res.metadata.filename
+			if self.rctxt.memcache.is_overlay_path(metafile):
+				raise PkgSystemError("cannot lock %s, it is in a package overlay" % \
+					pkg_res.short_name())
+			st = os.stat(metafile)
+			packages.append({
+				"name":				pkg_res.name,
+				"version":			pkg_res.version,
+				"base":				pkg_res.base,
+				"root":				pkg_res.root,
+				"timestamp":		pkg_res.timestamp,
+				"metafile":			metafile,
+				"metafile_mtime":	st.st_mtime,
+				"metafile_size":	st.st_size,
+				"metadata":			load_metadict(metafile) })
+
+		lock = {
+			"lock_version":		ResolveLock.LOCK_VERSION,
+			"request":			pkg_req_strs,
+			"resolve_mode":		self.rctxt.resolve_mode,
+			"time_epoch":		self.rctxt.time_epoch,
+			"packages":			packages,
+			"dot_graph":		dot_graph }
+
+		with open(filename, 'w') as f:
+			yaml.safe_dump(lock, f, default_flow_style=False)
+
+	def resolve_from_lock(self, lock, no_path_append=False, is_wrapper=False, meta_vars=None,
+		shallow_meta_vars=None):
+		"""
+		Build the environment recorded in a ResolveLock, without resolving. Each locked
+		package is only checked - its root must still exist, and its metafile must have the
+		mtime and size it had when the lock was written - which costs two stats per package.
+		Metafiles are not read, their contents (and so their commands) come from the lock.
+		Use a resolver from lock.create_resolver(), so that the environment gets the locked
+		resolve mode and time.
+		@returns the same as resolve(), or raises PkgLockError if a locked package is
+		missing or has changed.
+		"""
+		start_time = time.time()
+		memcache = self.rctxt.memcache
+		pkg_reqs = [str_to_pkg_req(x, memcache) for x in lock.request]
+		self.rctxt.start_resolve(pkg_reqs)
+
+		pkg_res_list = []
+		for entry in lock.packages:
+			name = entry["name"]
+			if not memcache.is_dir(entry["root"]):
+				raise PkgLockError(name, "package root '%s' does not exist" % entry["root"])
+
+			metafile = entry["metafile"]
+			try:
+				st = os.stat(metafile)
+			except OSError, e:
+				raise PkgLockError(name, "could not stat '%s': %s" % (metafile, e.strerror))
+			if (st.st_mtime != entry["metafile_mtime"]) or (st.st_size != entry["metafile_size"]):
+				raise PkgLockError(name, "'%s' has changed since the lock was written" % metafile)
+
+			version = entry["version"]
+			base = entry["base"]
+			root = entry["root"]
+			# the locked contents take the place of the metafile, which is not read. New-style
+			# commands are compiled from them too, see RezMemCache.get_commands_code
+			metadata = ConfigMetadata(metafile, entry["metadata"])
+			memcache.cache["PKGYAML"][metafile] = metadata
+			commands = metadata.get_string_replace_commands(version, base, root)
+			pkg_res_list.append(ResolvedPackage(name, version, base, root, commands, metadata, \
+				entry["timestamp"]))
+
+		full_req_str = str(' ').join(lock.request)
+		commands = self.get_package_commands(pkg_res_list, full_req_str, start_time)
+		result = (pkg_res_list, commands, lock.dot_graph, 0)
+		return self._add_env_commands(pkg_reqs, result, no_path_append, is_wrapper, \
+			meta_vars, shallow_meta_vars)
+
 	def resolve_base(self, pkg_reqs):
+		start_time = time.time()
+		self.rctxt.start_resolve(pkg_reqs)
 		config = _Configuration(self.rctxt)
 		pkg_req_fam_set = set([x.name for x in pkg_reqs if not x.is_anti()])
 		full_req_str = str(' ').join([x.short_name() for x in pkg_reqs])
@@ -392,6 +880,10 @@ class Resolver(object):
 			normalise_pkg_req(pkg_req)
 			config.add_package(pkg_req)
 
+		# pins are added after the request, so they do not affect package order
+		for pkg_req in self.rctxt.pins:
+			config.add_package(pkg_req)
+
 		for pkg_req in pkg_reqs:
 			name = pkg_req.short_name()
 			if name.startswith("__wrapper_"):
@@ -412,7 +904,14 @@ class Resolver(object):
 			config.dump()
 
 		# do the config resolve - all the action happens here!
-		pkg_res_list = config.resolve_packages()
+		if self.rctxt.solver == SOLVER_SAT:
+			pkg_res_list = config._run_phase("sat", self.resolve_sat, config, \
+				pkg_reqs + self.rctxt.pins)
+		else:
+			try:
+				pkg_res_list = config.resolve_packages()
+			finally:
+				self.rctxt.unchecked_config = None
 
 		# color resolved packages in graph
 		for pkg_res in pkg_res_list:
@@ -430,6 +929,33 @@ class Resolver(object):
 			print
 
 		# build the environment commands
+		commands_start_time = time.time()
+		commands = self.get_package_commands(pkg_res_list, full_req_str, start_time)
+
+		if self.rctxt.profile:
+			self.rctxt.profile.add_phase_time("commands", time.time() - commands_start_time)
+
+		# build the dot-graph representation
+		dot_graph = config.get_dot_graph_as_string()
+
+		if self.rctxt.memcache.caching_enabled():
+			# here we remove unnecessary data, because if caching is on then it's gonna be sent over
+			# the network, and we want to minimise traffic.
+			for pkg_res in pkg_res_list:
+				pkg_res.strip()
+
+		result = (pkg_res_list, commands, dot_graph, len(self.rctxt.config_fail_list))
+
+		# we're done
+		return result
+
+	def get_package_commands(self, pkg_res_list, full_req_str, start_time):
+		"""
+		Build the commands which configure the environment of the given resolved packages, in
+		order. The commands of each package are also stored in its 'commands' attribute.
+		full_req_str: the request, as a string
+		start_time: when the resolve started, for REZ_RESOLVE_DURATION
+		"""
 		res_pkg_strs = [x.short_name() for x in pkg_res_list]
 
 		# master recorder. this holds all of the commands to be interpreted
@@ -443,6 +969,7 @@ class Resolver(object):
 		recorder.setenv("REZ_RESOLVE_MODE", self.rctxt.resolve_mode)
 		recorder.setenv("REZ_FAILED_ATTEMPTS", len(self.rctxt.config_fail_list))
 		recorder.setenv("REZ_REQUEST_TIME", self.rctxt.time_epoch)
+		recorder.setenv("REZ_RESOLVE_DURATION", "%.2f" % (time.time() - start_time))
 
 		env = rex.RoutingDict()
 
@@ -504,8 +1031,9 @@ class Resolver(object):
 				env['version'] = pkg_res.version
 				make_version('', pkg_res.version)
 
+				code = self.rctxt.memcache.get_commands_code(pkg_res.metadata.filename)
 				try:
-					exec pkg_res.raw_commands in env
+					exec code in env
 				except Exception as err:
 					import traceback
 					raise PkgCommandError("%s:\n %s" % (pkg_res.short_name(),
@@ -523,23 +1051,62 @@ class Resolver(object):
 		recorder.comment("END of package commands")
 		recorder.comment("-" * 30)
 
-		# build the dot-graph representation
-		dot_graph = config.get_dot_graph_as_string()
-
-		if self.rctxt.memcache.caching_enabled():
-			# here we remove unnecessary data, because if caching is on then it's gonna be sent over
-			# the network, and we want to minimise traffic.
-			for pkg_res in pkg_res_list:
-				pkg_res.strip()
+		return recorder.commands
 
-		result = (pkg_res_list, recorder.commands, dot_graph, len(self.rctxt.config_fail_list))
+	def resolve_sat(self, config, pkg_reqs):
+		"""
+		Resolve with the SAT solver (see rez_sat), then build the resolved configuration from
+		the solution. 'config' must already contain the requested packages.
+		"""
+		import rez_sat
+		sat = rez_sat.SatResolve(self.rctxt)
+		found = sat.solve(pkg_reqs)
 
-		# we're done
-		return result
+		if (self.rctxt.verbosity != 0):
+			print
+			print "SAT solver: %d decisions, %d conflicts, %d variables" % \
+				(sat.solver.num_decisions, sat.solver.num_conflicts, sat.solver.num_vars)
+
+		if not found:
+			self.rctxt.config_fail_list.append("SAT solver: no configuration satisfies the " + \
+				"request (%d conflicts)" % sat.solver.num_conflicts)
+			self.rctxt.last_fail_dot_graph = config.get_dot_graph()
+			raise PkgConfigNotResolvedError(pkg_reqs, self.rctxt.config_fail_list, \
+				self.rctxt.last_fail_dot_graph)
+
+		chosen = dict((x.name, x) for x in sat.packages)
+		for pkg in sat.packages:
+			config.add_package(PackageRequest(pkg.name, str(pkg.version)), None, \
+				_Configuration.PKGCONN_RESOLVE)
+
+		for pkg in sat.packages:
+			# add the dependencies that were used, so that packages are correctly ordered
+			deps = [x for x in pkg.requires if not x.is_anti()]
+			deps += [x for x, conds in pkg.cond_requires if set(conds).issubset(chosen)]
+			if pkg.name in sat.variants:
+				deps += [x for x in pkg.variants[sat.variants[pkg.name]][1] if not x.is_anti()]
+			for dep in deps:
+				if dep.name in chosen:
+					config.dot_graph.append( ( pkg.short_name(), \
+						( chosen[dep.name].short_name(), _Configuration.PKGCONN_REQUIRES ) ) )
+					config.family_edges.append( (pkg.name, dep.name, \
+						_Configuration.PKGCONN_REQUIRES) )
+
+			config_pkg = config.pkgs[pkg.name]
+			config_pkg.resolve_metafile(self.rctxt.memcache)
+			if pkg.name in sat.variants:
+				variant = config_pkg.variants[sat.variants[pkg.name]]
+				config_pkg.variants = [variant]
+				variant.working_list = []
+				config_pkg.resolve(config_pkg.base_path + '/' + str('/').join(variant.metadata))
+
+		return config.get_package_resolutions()
 
 	def set_cached_resolve(self, pkg_reqs, result):
 		if not self.rctxt.memcache.caching_enabled():
 			return
+		if self.rctxt.solver != SOLVER_DEFAULT:
+			return
 
 		# if any local packages are involved, don't cache
 		pkg_res_list = result[0]
@@ -554,6 +1121,8 @@ class Resolver(object):
 		# here and rctxt.time_epoch, the resolve will be the same.
 		if not self.rctxt.memcache.caching_enabled():
 			return None
+		if self.rctxt.solver != SOLVER_DEFAULT:
+			return None
 
 		result, cache_timestamp = self.rctxt.memcache.get_resolve(
 			rez_filesys._g_syspaths_nolocal, pkg_reqs)
@@ -595,10 +1164,110 @@ class Resolver(object):
 		return result
 
 
+class ResolveFixture(object):
+	"""
+	A resolve recorded by Resolver.record_resolve, which can be replayed from memory without
+	the package repository. Replays are deterministic, so fixtures of slow real-world resolves
+	can be used to time the resolver.
+	"""
+	# only update this if the fixture format changes
+	FIXTURE_VERSION = 1
+
+	def __init__(self, data, filename=None):
+		if (not isinstance(data, dict)) or \
+				(data.get("fixture_version") != ResolveFixture.FIXTURE_VERSION):
+			raise PkgSystemError("'%s' is not a version %d resolve fixture" % \
+				(filename, ResolveFixture.FIXTURE_VERSION))
+		self.filename = filename
+		self.request = data["request"]
+		self.options = data["options"]
+		self.answers = data["answers"]
+		self.result = data["result"]
+		self.error = data["error"]
+
+	def create_resolver(self, **kwargs):
+		"""
+		Create a Resolver with the recorded options, which answers only from the recording.
+		Other Resolver options can be given, and 'solver' overrides the recorded solver.
+		"""
+		kwargs.setdefault("solver", self.options["solver"])
+		resolver = Resolver(self.options["resolve_mode"], time_epoch=self.options["time_epoch"],
+			build_requires=self.options["build_requires"], assume_dt=self.options["assume_dt"],
+			caching=False, **kwargs)
+		resolver.get_memcache().replay(self.answers)
+		return resolver
+
+	def replay(self, resolver=None):
+		"""
+		Resolve the recorded request, with a new resolver from create_resolver() if none is
+		given.
+		@returns (result, seconds taken), where result is a list of the resolved package
+		strings, or the exception raised by the resolve.
+		"""
+		if resolver is None:
+			resolver = self.create_resolver(quiet=True)
+
+		start_time = time.time()
+		try:
+			pkg_reqs = [str_to_pkg_req(x, resolver.get_memcache()) for x in self.request]
+			result = [x.short_name() for x in resolver.resolve(pkg_reqs, True)[0]]
+		except (RezError, VersionError), e:
+			result = e
+		return result, time.time() - start_time
+
+	def matches(self, result):
+		"""
+		Return True if the given replay result is the same as the recorded one.
+		"""
+		if isinstance(result, Exception):
+			return result.__class__.__name__ == self.error
+		return result == self.result
+
+
+class ResolveLock(object):
+	"""
+	A resolve written by Resolver.write_lock. Building an environment from a lock skips the
+	resolve entirely, see Resolver.resolve_from_lock.
+	"""
+	# only update this if the lock format changes
+	LOCK_VERSION = 2
+
+	def __init__(self, data, filename=None):
+		if (not isinstance(data, dict)) or \
+				(data.get("lock_version") != ResolveLock.LOCK_VERSION):
+			raise PkgSystemError("'%s' is not a version %d lock file" % \
+				(filename, ResolveLock.LOCK_VERSION))
+		self.filename = filename
+		self.request = data["request"]
+		self.resolve_mode = data["resolve_mode"]
+		self.time_epoch = data["time_epoch"]
+		self.packages = data["packages"]
+		self.dot_graph = data["dot_graph"]
+
+	def create_resolver(self, **kwargs):
+		"""
+		Create a Resolver with the locked resolve mode and time. Other Resolver options can
+		be given.
+		"""
+		return Resolver(self.resolve_mode, time_epoch=self.time_epoch, **kwargs)
+
+
 ##############################################################################
 # Public Functions
 ##############################################################################
 
+def load_resolve_fixture(filename):
+	"""
+	Load a ResolveFixture from a file written by Resolver.record_resolve.
+	"""
+	return ResolveFixture(load_metadict(filename), filename)
+
+def load_resolve_lock(filename):
+	"""
+	Load a ResolveLock from a file written by Resolver.write_lock.
+	"""
+	return ResolveLock(load_metadict(filename), filename)
+
 def str_to_pkg_req(str_, memcache=None):
 	"""
 	Helper function: turns a package string (eg 'boost-1.36') into a PackageRequest.
@@ -642,6 +1311,30 @@ def anti_name(pkg):
 		return '!' + name[1:]
 	return '!' + name
 
+def get_parsed_pkg_req(str_, memcache):
+	"""
+	Like str_to_pkg_req, but each distinct string is only parsed once per memcache, and the
+	same read-only request instance is returned on every subsequent call.
+	"""
+	cache = memcache.cache["PKGREQ"]
+	pkg_req = cache.get(str_)
+	if pkg_req is None:
+		pkg_req = _ParsedPackageRequest(str_to_pkg_req(str_, memcache))
+		cache[str_] = pkg_req
+	return pkg_req
+
+def get_metafile_requests(metadata, memcache):
+	"""
+	Return the _MetafileRequests for the given package metadata, which are cached in the
+	memcache alongside the metadata itself.
+	"""
+	cache = memcache.cache["PKGREQS"]
+	reqs = cache.get(metadata.filename)
+	if reqs is None:
+		reqs = _MetafileRequests(metadata, memcache)
+		cache[metadata.filename] = reqs
+	return reqs
+
 def get_base_path(pkg_str):
 	"""
 	NOTE: This is only used by auxilliary tools such as rez-diff, package searches are not
@@ -704,12 +1397,962 @@ class _ResolvingContext(object):
 		self.verbosity = 0
 		self.max_fails = -1
 		self.config_fail_list = []
+		self.max_fail_history = -1
 		self.last_fail_dot_graph = None
 		self.time_epoch = 0
 		self.quiet = False
 		self.build_requires = False
 		self.assume_dt = False
 		self.memcache = None
+		self.solver = SOLVER_DEFAULT
+		# learnt conflicts, (family, version) -> list of that package's requirements which
+		# have caused a conflict. See _Configuration.find_nogood
+		self.nogoods = {}
+		self.num_pruned = 0
+		# budgets, see Resolver
+		self.max_time = -1
+		self.max_configs = -1
+		self.max_fs_ops = -1
+		self.max_memory = -1
+		self.pkg_reqs = None
+		# set once the search has started. The config it started from is kept until the search
+		# first fails, and the error if it is then found to be unsatisfiable, see
+		# _Configuration.check_request_satisfiable
+		self.request_checked = False
+		self.unchecked_config = None
+		self.unsatisfiable = None
+		self.start_time = 0
+		self.start_fs_ops = 0
+		self.num_configs = 0
+		# speculative resolving, see _Configuration.resolve_speculatively
+		self.num_procs = 1
+		self.is_worker = False
+		self.speculated = False
+		# weak requests added to the resolve, see Resolver.resolve_incremental
+		self.pins = []
+		# set when profiling, see _ResolveProfile
+		self.profile = None
+		# family name -> _FamilyEnvelope, see _Configuration._add_transitive_dependencies
+		self.envelopes = {}
+		# package name -> names of the packages with a variant that could conflict with it,
+		# in any configuration. See _Configuration._package_set
+		self.variant_dependents = {}
+		# numbers the conditional requirements found, see _Configuration.resolve_metafiles
+		self.num_cond_requires = 0
+		# passes made by the phases of _Configuration.resolve_packages_no_filesys, and the
+		# packages they visited
+		self.num_passes = 0
+		self.num_visits = 0
+
+	def start_resolve(self, pkg_reqs):
+		"""
+		Start a resolve of 'pkg_reqs' - this starts counting towards the resolve budgets. Learnt
+		conflicts are kept from earlier resolves, since they only depend on package metadata.
+		"""
+		if self.max_fail_history >= 0:
+			self.config_fail_list = _FailureLog(self.max_fail_history)
+		else:
+			self.config_fail_list = []
+		self.last_fail_dot_graph = None
+		self.num_pruned = 0
+		self.request_checked = False
+		self.unchecked_config = None
+		self.unsatisfiable = None
+		self.pkg_reqs = pkg_reqs
+		self.start_time = time.time()
+		self.start_fs_ops = self.memcache.num_fs_ops
+		self.num_configs = 0
+		self.num_passes = 0
+		self.num_visits = 0
+		self.speculated = False
+
+	def can_speculate(self):
+		"""
+		Return True if candidate configurations should be resolved speculatively. This is
+		only done once per resolve, for the first package whose versions are searched.
+		"""
+		if self.speculated or self.is_worker or (self.num_procs < 2) or \
+				(self.max_fails != -1) or (self.verbosity != 0) or self.profile or \
+				(not hasattr(os, "fork")):
+			return False
+		self.speculated = True
+		return True
+
+	def add_nogoods(self, nogoods):
+		"""
+		Merge in conflicts learnt by another process
+		"""
+		for key, reqs in nogoods.iteritems():
+			reqs_ = self.nogoods.setdefault(key, [])
+			for pkg_req in reqs:
+				if pkg_req not in reqs_:
+					reqs_.append(pkg_req)
+
+	def check_budgets(self, config=None):
+		"""
+		Raise PkgResolveBudgetError if the current resolve has exceeded any of its budgets.
+		'config' is the configuration being resolved, if any - its dot-graph is reported if
+		no configuration has failed yet.
+		"""
+		exceeded = None
+		if self.max_time >= 0:
+			elapsed = time.time() - self.start_time
+			if elapsed > self.max_time:
+				exceeded = ("time", self.max_time, round(elapsed, 2))
+		if (not exceeded) and (self.max_configs >= 0) and (self.num_configs > self.max_configs):
+			exceeded = ("configs", self.max_configs, self.num_configs)
+		if (not exceeded) and (self.max_fs_ops >= 0):
+			num_fs_ops = self.memcache.num_fs_ops - self.start_fs_ops
+			if num_fs_ops > self.max_fs_ops:
+				exceeded = ("fs_ops", self.max_fs_ops, num_fs_ops)
+		if (not exceeded) and (self.max_memory >= 0):
+			import resource
+			# ru_maxrss is in kilobytes on linux
+			mem = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+			if mem > self.max_memory:
+				exceeded = ("memory", self.max_memory, mem)
+		if not exceeded:
+			return
+
+		dot_graph = self.last_fail_dot_graph
+		if (dot_graph is None) and config:
+			dot_graph = config.get_dot_graph()
+		budget, limit, value = exceeded
+		raise PkgResolveBudgetError(budget, limit, value, self.pkg_reqs, \
+			self.config_fail_list, dot_graph)
+
+	def get_family_envelope(self, family_name):
+		"""
+		Return the _FamilyEnvelope of the given family, creating it on first use. Like learnt
+		conflicts, envelopes are kept across resolves.
+		"""
+		envelope = self.envelopes.get(family_name)
+		if envelope is None:
+			envelope = _FamilyEnvelope(family_name, self.memcache)
+			self.envelopes[family_name] = envelope
+		return envelope
+
+	def add_nogood(self, pkg, pkg_req):
+		"""
+		Record that the exact package 'pkg' has a requirement 'pkg_req' which caused a conflict
+		"""
+		reqs = self.nogoods.setdefault((pkg.name, str(pkg.version_range)), [])
+		if pkg_req not in reqs:
+			reqs.append(pkg_req)
+
+
+class _ResolveProfile(object):
+	"""
+	Records where the time goes in a resolve. Phase times are exclusive of one another,
+	except for 'backtracking', which is the total time spent resolving candidate
+	configurations that then failed (including the phases run within them). Per-family
+	times are the time spent in the subtrees of the search below each choice of that
+	family's version. Each candidate configuration is also recorded in a tree, so the cost
+	of any subtree of the search can be seen.
+	"""
+	PHASES = ("caching", "metafiles", "variant_removal", "common_variants", \
+		"single_variants", "transitivity", "ordering", "sat", "commands")
+
+	# beyond this many candidates the tree is no longer recorded, to bound memory use
+	MAX_TREE_NODES = 10000
+
+	def __init__(self, solver=SOLVER_DEFAULT):
+		self.solver = solver
+		self.request = []
+		self.start_time = time.time()
+		self.total_time = 0.0
+		self.phase_times = dict((x, 0.0) for x in _ResolveProfile.PHASES)
+		self.phase_calls = dict((x, 0) for x in _ResolveProfile.PHASES)
+		self.backtracking_time = 0.0
+		self.num_failed_candidates = 0
+		self.num_configs = 0
+		self.depth = 0
+		self.max_depth = 0
+		# family -> [decisions, candidates, max branching, time, failed time]
+		self.families = {}
+		self.tree = []
+		self.num_tree_nodes = 0
+		self.tree_truncated = False
+		self.node_stack = []
+		# time already counted as backtracking within each candidate on the node stack
+		self.failed_stack = []
+
+	def run_phase(self, phase, fn, *args):
+		t = time.time()
+		try:
+			return fn(*args)
+		finally:
+			self.add_phase_time(phase, time.time() - t)
+
+	def add_phase_time(self, phase, secs):
+		self.phase_times[phase] += secs
+		self.phase_calls[phase] += 1
+
+	def start_decision(self, family):
+		"""
+		Record that a version of 'family' is about to be chosen from the filesystem. Returns
+		a token to pass to start_candidate.
+		"""
+		stats = self.families.get(family)
+		if stats is None:
+			stats = [0, 0, 0, 0.0, 0.0]
+			self.families[family] = stats
+		stats[0] += 1
+		return [family, 0]
+
+	def start_candidate(self, decision, candidate):
+		"""
+		Record the start of the resolve of a candidate configuration, returns a token to pass
+		to end_candidate.
+		"""
+		decision[1] += 1
+		stats = self.families[decision[0]]
+		stats[1] += 1
+		stats[2] = max(stats[2], decision[1])
+
+		self.num_configs += 1
+		self.depth += 1
+		self.max_depth = max(self.max_depth, self.depth)
+
+		node = None
+		if self.num_tree_nodes < _ResolveProfile.MAX_TREE_NODES:
+			node = {"candidate": candidate, "depth": self.depth, "children": []}
+			if self.node_stack and self.node_stack[-1]:
+				self.node_stack[-1]["children"].append(node)
+			else:
+				self.tree.append(node)
+			self.num_tree_nodes += 1
+		else:
+			self.tree_truncated = True
+		self.node_stack.append(node)
+		self.failed_stack.append(0.0)
+		return (decision[0], node, time.time())
+
+	def end_candidate(self, token, ok):
+		family, node, t = token
+		secs = time.time() - t
+		self.depth -= 1
+		self.node_stack.pop()
+		failed_secs = self.failed_stack.pop()
+
+		stats = self.families[family]
+		stats[3] += secs
+		if not ok:
+			stats[4] += secs
+			# don't count failed candidates within this one twice
+			self.backtracking_time += secs - failed_secs
+			self.num_failed_candidates += 1
+			failed_secs = secs
+		if self.failed_stack:
+			self.failed_stack[-1] += failed_secs
+		if node:
+			node["time"] = round(secs, 6)
+			node["ok"] = ok
+
+	def finish(self):
+		self.total_time = time.time() - self.start_time
+
+	def to_dict(self):
+		"""
+		Return the profile as a dict of plain types, suitable for writing as json
+		"""
+		phases = {}
+		for phase in _ResolveProfile.PHASES:
+			phases[phase] = {"time": round(self.phase_times[phase], 6), \
+				"calls": self.phase_calls[phase]}
+
+		families = {}
+		for family, stats in self.families.iteritems():
+			families[family] = {"decisions": stats[0], "candidates": stats[1], \
+				"max_branching": stats[2], "time": round(stats[3], 6), \
+				"failed_time": round(stats[4], 6)}
+
+		return {
+			"request": self.request,
+			"solver": self.solver,
+			"total_time": round(self.total_time, 6),
+			"phases": phases,
+			"backtracking": {"time": round(self.backtracking_time, 6), \
+				"failed_candidates": self.num_failed_candidates},
+			"num_configs": self.num_configs,
+			"max_depth": self.max_depth,
+			"families": families,
+			"tree": self.tree,
+			"tree_truncated": self.tree_truncated }
+
+	def summary(self, max_families=10):
+		"""
+		Return a human-readable summary of the profile
+		"""
+		lines = []
+		lines.append("resolve profile: %.3fs, %d configurations spawned, max depth %d" % \
+			(self.total_time, self.num_configs, self.max_depth))
+
+		lines.append("  %-18s %10s %8s" % ("phase", "time", "calls"))
+		phases_time = 0.0
+		for phase in _ResolveProfile.PHASES:
+			if self.phase_calls[phase]:
+				lines.append("  %-18s %9.3fs %8d" % (phase, self.phase_times[phase], \
+					self.phase_calls[phase]))
+				phases_time += self.phase_times[phase]
+		lines.append("  %-18s %9.3fs" % ("other", max(self.total_time - phases_time, 0.0)))
+		lines.append("  %-18s %9.3fs (%d failed candidates)" % ("backtracking", \
+			self.backtracking_time, self.num_failed_candidates))
+
+		if self.families:
+			lines.append("  families searched, by time:")
+			lines.append("    %-24s %9s %10s %13s %10s %10s" % ("family", "decisions", \
+				"candidates", "max-branching", "time", "failed"))
+			fams = sorted(self.families.iteritems(), key=lambda x: -x[1][3])
+			for family, stats in fams[:max_families]:
+				lines.append("    %-24s %9d %10d %13d %9.3fs %9.3fs" % ((family,) + tuple(stats)))
+			if len(fams) > max_families:
+				lines.append("    ... and %d more" % (len(fams) - max_families))
+
+		return '\n'.join(lines)
+
+
+class _FailureLog(object):
+	"""
+	The failed configuration attempts of a memory-bounded resolve (see Resolver). This acts
+	like the list of failure strings it replaces, except that only the most recent 'size'
+	entries are kept. len() is the total number of failures, including dropped ones, and
+	iterating yields a note of how many were dropped, followed by the entries kept.
+	"""
+	def __init__(self, size):
+		self.entries = collections.deque(maxlen=max(size, 1))
+		self.num_fails = 0
+
+	def append(self, s):
+		self.entries.append(s)
+		self.num_fails += 1
+
+	def extend(self, strs):
+		for s in strs:
+			self.append(s)
+
+	def num_dropped(self):
+		return self.num_fails - len(self.entries)
+
+	def __len__(self):
+		return self.num_fails
+
+	def __iter__(self):
+		num_dropped = self.num_dropped()
+		if num_dropped:
+			yield "(%d earlier failed attempts were not kept)" % num_dropped
+		for s in self.entries:
+			yield s
+
+	def __getitem__(self, key):
+		"""
+		slicing uses failure numbers, so log[n:] is the kept failures after the first n
+		"""
+		if not isinstance(key, slice):
+			raise TypeError("_FailureLog only supports slicing")
+		start, stop, step = key.indices(self.num_fails)
+		first = self.num_dropped()
+		return [self.entries[i - first] for i in range(max(start, first), stop, step)]
+
+
+class _PersistentList(object):
+	"""
+	An append-only list that can be copied in constant time. A copy shares the items of the
+	original up to the point at which it was taken, and both can then be appended to
+	independently. Chains of copies are flattened once they reach MAX_DEPTH, so iteration
+	stays linear in the number of items.
+	"""
+	MAX_DEPTH = 32
+
+	def __init__(self, items=None, parent=None):
+		self.parent = parent
+		self.parent_len = 0
+		self.depth = 0
+		if parent is not None:
+			self.parent_len = len(parent)
+			self.depth = parent.depth + 1
+		self.items = items or []
+
+	def append(self, item):
+		self.items.append(item)
+
+	def copy(self):
+		if self.depth >= _PersistentList.MAX_DEPTH:
+			# flatten ourselves, so that later copies start a new chain
+			self.items = list(self)
+			self.parent = None
+			self.parent_len = 0
+			self.depth = 0
+		return _PersistentList(parent=self)
+
+	def __len__(self):
+		return self.parent_len + len(self.items)
+
+	def __iter__(self):
+		chain = []
+		node = self
+		nitems = len(self.items)
+		while node is not None:
+			chain.append((node, nitems))
+			nitems = node.parent_len - (node.parent.parent_len if node.parent else 0)
+			node = node.parent
+		for node, nitems in reversed(chain):
+			for item in node.items[:nitems]:
+				yield item
+
+
+class _PersistentMap(object):
+	"""
+	A dict that can be copied cheaply, and which iterates in the order its keys were first
+	added - a key that is removed and added again keeps its place. Copies share a base dict,
+	which is never changed, and each holds only the changes made since that base was taken,
+	so copying costs time in proportion to those changes. Once they grow to half the size
+	of the base, they are merged into a new base on the next copy. Each key's place in the
+	iteration order is given by position().
+	"""
+	MIN_MERGE = 8
+	REMOVED = object()
+
+	def __init__(self):
+		# key -> value, or REMOVED. Shared between copies, never changed
+		self.base = {}
+		# the base's keys, in order, and key -> index. Shared between copies, never changed
+		self.base_keys = []
+		self.base_positions = {}
+		# key -> value, or REMOVED, for each key changed since the base was taken
+		self.changes = {}
+		# the keys added since the base was taken, in order, and key -> index into the
+		# base's keys followed by these
+		self.new_keys = []
+		self.new_positions = {}
+		self.num_keys = 0
+
+	def copy(self):
+		if len(self.changes) > max(_PersistentMap.MIN_MERGE, len(self.base) / 2):
+			self._merge()
+		m = _PersistentMap.__new__(_PersistentMap)
+		m.base = self.base
+		m.base_keys = self.base_keys
+		m.base_positions = self.base_positions
+		m.changes = self.changes.copy()
+		m.new_keys = self.new_keys[:]
+		m.new_positions = self.new_positions.copy()
+		m.num_keys = self.num_keys
+		return m
+
+	def _merge(self):
+		base = self.base.copy()
+		base.update(self.changes)
+		self.base = base
+		self.base_keys = self.base_keys + self.new_keys
+		if self.new_positions:
+			positions = self.base_positions.copy()
+			positions.update(self.new_positions)
+			self.base_positions = positions
+		self.changes = {}
+		self.new_keys = []
+		self.new_positions = {}
+
+	def _get(self, key):
+		value = self.changes.get(key)
+		if value is None:
+			value = self.base.get(key)
+		return value
+
+	# lookups are inlined, as they are made often during a resolve
+
+	def get(self, key, default=None):
+		value = self.changes.get(key)
+		if value is None:
+			value = self.base.get(key)
+			if value is None:
+				return default
+		if value is _PersistentMap.REMOVED:
+			return default
+		return value
+
+	def __getitem__(self, key):
+		value = self.changes.get(key)
+		if value is None:
+			value = self.base.get(key)
+			if value is None:
+				raise KeyError(key)
+		if value is _PersistentMap.REMOVED:
+			raise KeyError(key)
+		return value
+
+	def __contains__(self, key):
+		value = self.changes.get(key)
+		if value is None:
+			value = self.base.get(key)
+			if value is None:
+				return False
+		return value is not _PersistentMap.REMOVED
+
+	def __setitem__(self, key, value):
+		prev = self._get(key)
+		if prev is None:
+			self.new_positions[key] = len(self.base_keys) + len(self.new_keys)
+			self.new_keys.append(key)
+		if (prev is None) or (prev is _PersistentMap.REMOVED):
+			self.num_keys += 1
+		self.changes[key] = value
+
+	def __delitem__(self, key):
+		if key not in self:
+			raise KeyError(key)
+		self.changes[key] = _PersistentMap.REMOVED
+		self.num_keys -= 1
+
+	def __len__(self):
+		return self.num_keys
+
+	def position(self, key):
+		"""
+		Return the place of 'key' in the iteration order. A removed key keeps its place
+		"""
+		pos = self.base_positions.get(key)
+		if pos is None:
+			pos = self.new_positions[key]
+		return pos
+
+	def items(self):
+		removed = _PersistentMap.REMOVED
+		if not self.changes:
+			base = self.base
+			return [(x, base[x]) for x in self.base_keys if base[x] is not removed]
+		items = []
+		changes = self.changes
+		base = self.base
+		for key in self.base_keys:
+			value = changes.get(key)
+			if value is None:
+				value = base[key]
+			if value is not removed:
+				items.append((key, value))
+		for key in self.new_keys:
+			value = changes[key]
+			if value is not removed:
+				items.append((key, value))
+		return items
+
+	def keys(self):
+		return [x[0] for x in self.items()]
+
+	def values(self):
+		return [x[1] for x in self.items()]
+
+	# the contents are listed before iterating, so the map may be changed during iteration
+
+	def iteritems(self):
+		return iter(self.items())
+
+	def iterkeys(self):
+		return iter(self.keys())
+
+	def itervalues(self):
+		return iter(self.values())
+
+	__iter__ = iterkeys
+
+	def __getstate__(self):
+		# removed keys are kept (as None), so that they keep their place if added again
+		items = []
+		for key in self.base_keys + self.new_keys:
+			value = self._get(key)
+			if value is _PersistentMap.REMOVED:
+				value = None
+			items.append((key, value))
+		return items
+
+	def __setstate__(self, items):
+		self.__init__()
+		for key, value in items:
+			self.base_positions[key] = len(self.base_keys)
+			self.base_keys.append(key)
+			if value is None:
+				self.base[key] = _PersistentMap.REMOVED
+			else:
+				self.base[key] = value
+				self.num_keys += 1
+
+
+class _Worklist(object):
+	"""
+	The packages that each phase of _Configuration.resolve_packages_no_filesys may have
+	something to do for, so that a pass of a phase visits only those. A package is queued
+	for a phase whenever a change is made to the configuration that could give the phase
+	something to do with it - see _Configuration._package_set. Queues are emptied in the
+	order of the configuration's package map, since package resolution is sensitive to the
+	order in which packages are visited. The worklist also counts the unresolved packages,
+	and holds the conditional requirements that the metafiles phase is to add next.
+	"""
+	PHASES = ("metafiles", "variant_removal", "common_variants", "single_variants")
+
+	def __init__(self):
+		# phase -> names of the packages that its next pass visits
+		self.queues = dict((x, set()) for x in _Worklist.PHASES)
+		# (number, package, request, conditionals) for each conditional requirement that
+		# has just been found, or whose awaited condition has just been added
+		self.cond_ready = []
+		self.num_unresolved = 0
+
+	def copy(self):
+		w = _Worklist.__new__(_Worklist)
+		w.queues = dict((x, y.copy()) for x, y in self.queues.iteritems())
+		w.cond_ready = self.cond_ready[:]
+		w.num_unresolved = self.num_unresolved
+		return w
+
+	def push(self, name, phases=PHASES):
+		for phase in phases:
+			self.queues[phase].add(name)
+
+	def pop(self, phase, pkgs):
+		"""
+		Empty the queue of 'phase', returning the names in it that are in the package map
+		'pkgs', in the map's order
+		"""
+		names = self.queues[phase]
+		if not names:
+			return []
+		self.queues[phase] = set()
+		return sorted((x for x in names if x in pkgs), key=pkgs.position)
+
+	def has_work(self, phase):
+		if self.queues[phase]:
+			return True
+		return (phase == "metafiles") and bool(self.cond_ready)
+
+	def is_empty(self):
+		for phase in _Worklist.PHASES:
+			if self.has_work(phase):
+				return False
+		return True
+
+
+class _DotGraph(object):
+	"""
+	A snapshot of a configuration's dot-graph. It is rendered to dot text the first time
+	it is converted to a string, so a failed configuration attempt costs nothing to record
+	unless its graph is actually looked at.
+	"""
+	def __init__(self, connections):
+		self.connections = connections
+		self.dot_str = None
+
+	def __str__(self):
+		if self.dot_str is None:
+			self.dot_str = dot_graph_to_string(self.connections)
+			self.connections = None
+		return self.dot_str
+
+
+class _ParsedPackageRequest(PackageRequest):
+	"""
+	A read-only package request, parsed from package metadata. These are shared between
+	all the configurations in a resolve, so they must never be modified.
+	"""
+	def __init__(self, pkg_req):
+		self.__dict__.update(pkg_req.__dict__)
+
+	def __setattr__(self, attr, value):
+		raise AttributeError("cannot modify shared package request '%s'" % self.short_name())
+
+
+class _MetafileRequests(object):
+	"""
+	The requirements of a package metafile, parsed into _ParsedPackageRequests. Each list is
+	parsed the first time it is needed, and then reused for the rest of the resolve.
+	"""
+	def __init__(self, metadata, memcache):
+		self.metadata = metadata
+		self.memcache = memcache
+		self._requires = {}
+		self._cond_requires = None
+		self._variants = None
+		self._variant_deps = None
+
+	def get_requires(self, include_build_reqs=False):
+		"""
+		Returns the required packages, as a (possibly empty) tuple of requests
+		"""
+		reqs = self._requires.get(include_build_reqs)
+		if reqs is None:
+			strs = self.metadata.get_requires(include_build_reqs) or []
+			reqs = tuple(get_parsed_pkg_req(x, self.memcache) for x in strs)
+			self._requires[include_build_reqs] = reqs
+		return reqs
+
+	def get_conditional_requires(self):
+		"""
+		Returns the conditional requirements, as a tuple of (request, conditionals)
+		"""
+		if self._cond_requires is None:
+			cond_requires = []
+			for pkg_str, conditionals in self.metadata.get_conditional_requires():
+				if pkg_str.endswith("=l") or pkg_str.endswith("=e"):
+					# conditionals are never resolved against the filesystem
+					str_to_pkg_req(pkg_str)
+				cond_requires.append((get_parsed_pkg_req(pkg_str, self.memcache), conditionals))
+			self._cond_requires = tuple(cond_requires)
+		return self._cond_requires
+
+	def get_variants(self):
+		"""
+		Returns the variants, as a tuple of (metadata node, requests) pairs, or None
+		"""
+		if self._variants is None:
+			metafile_variants = self.metadata.get_variants()
+			if not metafile_variants:
+				return None
+			variants = []
+			for metavar in metafile_variants:
+				if type(metavar) != list:
+					raise PkgSystemError("malformed variant metadata: " + str(metavar))
+				variants.append((metavar, \
+					tuple(get_parsed_pkg_req(x, self.memcache) for x in metavar)))
+			self._variants = tuple(variants)
+		return self._variants
+
+	def get_variant_dependencies(self):
+		"""
+		Returns a tuple with an entry for each variant (see get_variants). Each entry is a
+		tuple of (request, family, other family) for each of the variant's requests, where
+		'other family' is the request's anti-package, or the package that an anti-request
+		excludes. A request can only conflict with a config that holds a package of one of
+		these two families - see _Configuration.test_pkg_req_add.
+		"""
+		if self._variant_deps is None:
+			variant_deps = []
+			for metavar, requests in (self.get_variants() or ()):
+				deps = []
+				for pkg_req in requests:
+					if pkg_req.is_anti():
+						deps.append((pkg_req, pkg_req.name, pkg_req.name[1:]))
+					else:
+						deps.append((pkg_req, pkg_req.name, anti_name(pkg_req)))
+				variant_deps.append(tuple(deps))
+			self._variant_deps = tuple(variant_deps)
+		return self._variant_deps
+
+
+class _FamilyEnvelope(object):
+	"""
+	The versions of a package family, ordered for searching, along with the dependencies
+	that transitivity can infer from any window of them - see
+	_Configuration._add_transitive_dependencies. A window is given by a version range, and
+	is bounded by the earliest and latest versions in the range (family default versions
+	take precedence, as in RezMemCache.find_package_in_range). The bounds are found by
+	bisection, and the dependencies of each pair of bounds are computed once, so that only
+	the first query for a window loads any metafiles.
+	"""
+	def __init__(self, family_name, memcache):
+		self.name = family_name
+		self.memcache = memcache
+		# (family path, Version, epoch), in ascending version order
+		self.entries = sorted(memcache.iter_packages(family_name), key=lambda x: x[1])
+		# (bounds, entry indices) for each group of versions to search in turn
+		self.tiers = []
+		# (earliest index, latest index) -> list of PackageRequests, or None
+		self.requests = {}
+		# version range string -> dict of required ranges, or None
+		self.required_ranges = {}
+
+		default = None
+		fam_pkg_path = memcache.get_family_package(family_name)
+		if fam_pkg_path:
+			fam_metadata = memcache.get_family_metafile(fam_pkg_path)
+			if fam_metadata.default:
+				default = VersionRange(fam_metadata.default)
+
+		if default:
+			idxs = range(len(self.entries))
+			defaults = [i for i in idxs if default.contains_version(self.entries[i][1])]
+			defaults_set = set(defaults)
+			others = [i for i in idxs if i not in defaults_set]
+			self._add_tier(defaults)
+			self._add_tier(others)
+		else:
+			self._add_tier(range(len(self.entries)))
+
+	def _add_tier(self, idxs):
+		if idxs:
+			self.tiers.append(([self.entries[i][1].ge for i in idxs], idxs))
+
+	def _find(self, ver_range, latest):
+		"""
+		Return the index of the earliest or latest entry in the range, or None
+		"""
+		for ges, idxs in self.tiers:
+			found = None
+			for ver in ver_range.versions:
+				if latest:
+					j = bisect.bisect_left(ges, ver.lt) - 1
+					if (j >= 0) and (ges[j] >= ver.ge) and ((found is None) or (j > found)):
+						found = j
+				else:
+					j = bisect.bisect_left(ges, ver.ge)
+					if (j < len(ges)) and (ges[j] < ver.lt) and ((found is None) or (j < found)):
+						found = j
+			if found is not None:
+				# of equal versions, the one found first on the package paths wins
+				while (found > 0) and (ges[found - 1] == ges[found]):
+					found -= 1
+				return idxs[found]
+		return None
+
+	def _get_metafile(self, i):
+		found_path, found_ver, found_epoch = self.entries[i]
+		return self.memcache.get_metafile(
+			os.path.join(found_path, str(found_ver), PKG_METADATA_FILENAME))
+
+	def get_transitive_requests(self, ver_range):
+		"""
+		Return the package requests that every version in the range can be assumed to pull
+		in, given dependency transitivity. Returns None if this can't be known, for example
+		if the range contains no versions.
+		"""
+		e = self._find(ver_range, False)
+		if e is None:
+			return None
+		l = self._find(ver_range, True)
+		if l is None:
+			return None
+
+		key = (e, l)
+		if key not in self.requests:
+			self.requests[key] = self._get_transitive_requests(e, l)
+		return self.requests[key]
+
+	def _get_transitive_requests(self, e, l):
+		metafile_e = self._get_metafile(e)
+		if not metafile_e:
+			return None
+		metafile_l = self._get_metafile(l)
+		if not metafile_l:
+			return None
+
+		pkg_reqs = []
+		metafile_reqs_e = get_metafile_requests(metafile_e, self.memcache)
+		metafile_reqs_l = get_metafile_requests(metafile_l, self.memcache)
+		requires_e = metafile_reqs_e.get_requires()
+		requires_l = metafile_reqs_l.get_requires()
+		if (not requires_e) or (not requires_l):
+			return pkg_reqs
+
+		# find pkgs that exist in the requires of both, these are added to the config as
+		# 'transitivity' packages
+		for pkg_req_e in requires_e:
+			# weak requests are already converted to anti-packages
+			if pkg_req_e.is_anti():
+				continue
+
+			for pkg_req_l in requires_l:
+				if (pkg_req_e.name == pkg_req_l.name):
+					pkg_req = pkg_req_e
+					if (pkg_req_e.version != pkg_req_l.version):
+						# calc version range
+						v_e = Version(pkg_req_e.version)
+						v_l = Version(pkg_req_l.version)
+						if(not v_e.ge < v_l.lt):
+							continue
+						v = Version()
+						v.ge = v_e.ge
+						v.lt = v_l.lt
+						if (v.ge == Version.NEG_INF) and (v.lt != Version.INF):
+							v.ge = [0]
+						pkg_req = PackageRequest(pkg_req_e.name, str(v))
+					pkg_reqs.append(pkg_req)
+
+		# find common variants that exist in both. Note that this code is somewhat redundant,
+		# v similar work is done in resolve_common_variants - fix this in rez V2
+		variants_e = metafile_reqs_e.get_variants()
+		variants_l = metafile_reqs_l.get_variants()
+		if (not variants_e) or (not variants_l):
+			return pkg_reqs
+
+		common_pkg_fams = None
+		pkg_vers = {}
+
+		for metavar, variant in (variants_e + variants_l):
+			comm_fams = set()
+			for pkgreq in variant:
+				comm_fams.add(pkgreq.name)
+				if pkgreq.name in pkg_vers:
+					pkg_vers[pkgreq.name].append(pkgreq.version)
+				else:
+					pkg_vers[pkgreq.name] = [ pkgreq.version ]
+
+			if (common_pkg_fams == None):
+				common_pkg_fams = comm_fams
+			else:
+				common_pkg_fams &= comm_fams
+
+			if len(common_pkg_fams) == 0:
+				break
+
+		if (common_pkg_fams != None):
+			for pkg_fam in common_pkg_fams:
+				ver_range = VersionRange(str("|").join(pkg_vers[pkg_fam]))
+				v = Version()
+				if len(ver_range.versions) > 0:
+					v.ge = ver_range.versions[0].ge
+					v.lt = ver_range.versions[-1].lt
+					if (v.ge == Version.NEG_INF) and (v.lt != Version.INF):
+						v.ge = [0]
+					pkg_reqs.append(PackageRequest(pkg_fam, str(v)))
+
+		return pkg_reqs
+
+	def get_required_ranges(self, ver_range):
+		"""
+		Return a dict mapping each family that every version in the range requires (either
+		directly or in all of its variants) to the union of the ranges required of it. Unlike
+		get_transitive_requests this does not assume dependency transitivity, every version's
+		metafile is read. Returns None if this can't be known.
+		"""
+		key = str(ver_range)
+		if key not in self.required_ranges:
+			self.required_ranges[key] = self._get_required_ranges(ver_range)
+		return self.required_ranges[key]
+
+	def _get_required_ranges(self, ver_range):
+		required = None
+		for i, entry in enumerate(self.entries):
+			if not ver_range.contains_version(entry[1]):
+				continue
+			metafile = self._get_metafile(i)
+			if not metafile:
+				return None
+
+			metafile_reqs = get_metafile_requests(metafile, self.memcache)
+			ranges = {}
+			variants = metafile_reqs.get_variants()
+			if variants:
+				for metavar, variant in variants:
+					variant_ranges = {}
+					for pkg_req in variant:
+						if not pkg_req.is_anti():
+							variant_ranges[pkg_req.name] = pkg_req.version_range
+					if metavar is variants[0][0]:
+						ranges = variant_ranges
+					else:
+						ranges = dict((x, ranges[x].get_union(variant_ranges[x])) \
+							for x in ranges if x in variant_ranges)
+			for pkg_req in metafile_reqs.get_requires():
+				if not pkg_req.is_anti():
+					ranges[pkg_req.name] = pkg_req.version_range
+
+			if required is None:
+				required = ranges
+			else:
+				required = dict((x, required[x].get_union(ranges[x])) \
+					for x in required if x in ranges)
+			if not required:
+				break
+
+		return required
 
 
 class _PackageVariant(object):
@@ -718,19 +2361,26 @@ class _PackageVariant(object):
 	removed during config resolution - a variant with an empty working_list is fully
 	resolved. This class has been written with foward compatibility in mind - currently
 	a variant is just a list of dependencies, but it may later become a dict, with
-	more info than just dependencies.
+	more info than just dependencies. 'requests' holds the dependencies parsed into
+	package requests, and the working list is a subset of these. 'deps' holds the families
+	each request could conflict with, see _MetafileRequests.get_variant_dependencies.
 	"""
-	def __init__(self, metadata_node, _working_list=None):
+	def __init__(self, metadata_node, requests, deps, _working_list=None, _dep_names=None):
 		self.metadata = metadata_node
+		self.requests = requests
+		self.deps = deps
 		if _working_list is not None:
 			self.working_list = _working_list[:]
-		elif type(self.metadata) == list:
-			self.working_list = self.metadata[:]
 		else:
-			raise PkgSystemError("malformed variant metadata: " + str(self.metadata))
+			self.working_list = list(requests)
+		if _dep_names is not None:
+			self.dep_names = _dep_names
+		else:
+			self.dep_names = frozenset(x[1] for x in deps) | frozenset(x[2] for x in deps)
 
 	def copy(self):
-		return _PackageVariant(self.metadata, self.working_list)
+		return _PackageVariant(self.metadata, self.requests, self.deps, self.working_list, \
+			self.dep_names)
 
 	def __str__(self):
 		return str(self.metadata)
@@ -743,6 +2393,11 @@ class _Package(object):
 	def __init__(self, pkg_req, memcache=None):
 		self.is_transitivity = False
 		self.has_added_transitivity = False
+		# set when no exact package matches this package's version range, so that
+		# the lookup isn't repeated on every pass of resolve_packages_no_filesys
+		self.metafile_missing = False
+		# the configuration that may modify this package in place, see _Configuration._own_package
+		self.owner = None
 		if pkg_req:
 			self.name = pkg_req.name
 			self.version_range = pkg_req.version_range
@@ -768,6 +2423,7 @@ class _Package(object):
 
 		if not skip_version_range:
 			p.version_range = self.version_range.copy()
+			p.metafile_missing = self.metafile_missing
 
 		p.variants = None
 		if self.variants is not None:
@@ -837,15 +2493,21 @@ class _Package(object):
 		else:
 			return None
 
+	def can_resolve_metafile(self):
+		"""
+		Return True if this package's metafile can be resolved, ie its version is exact
+		"""
+		return self.version_range.is_any() or not self.version_range.is_inexact()
+
 	def resolve_metafile(self, memcache):
 		"""
 		attempt to resolve the metafile, the metadata member will be set if
 		successful, and True will be returned. If the package has no variants,
 		then its root-path is set and this package is regarded as fully-resolved.
 		"""
-		is_any = self.version_range.is_any()
-		if not is_any and self.version_range.is_inexact():
+		if not self.can_resolve_metafile():
 			return False
+		is_any = self.version_range.is_any()
 
 		if not self.base_path:
 			fam_path, ver, pkg_epoch = memcache.find_package_in_range(
@@ -860,16 +2522,28 @@ class _Package(object):
 				self.timestamp = pkg_epoch
 				self.base_path = base_path
 				self.metadata = memcache.get_metafile(metafile)
-				metafile_variants = self.metadata.get_variants()
+				if isinstance(self.metadata.get_commands(), basestring):
+					# compile new-style commands now, so that errors are reported up front
+					try:
+						memcache.get_commands_code(metafile)
+					except (SyntaxError, TypeError), e:
+						import traceback
+						raise PkgCommandError("%s:\n %s" % (self.short_name(), \
+							''.join(traceback.format_exception_only(type(e), e))))
+				metafile_reqs = get_metafile_requests(self.metadata, memcache)
+				metafile_variants = metafile_reqs.get_variants()
 				if metafile_variants:
 					# convert variants from metafile into _PackageVariants
 					self.variants = []
-					for metavar in metafile_variants:
-						pkg_var = _PackageVariant(metavar)
+					variant_deps = metafile_reqs.get_variant_dependencies()
+					for (metavar, requests), deps in zip(metafile_variants, variant_deps):
+						pkg_var = _PackageVariant(metavar, requests, deps)
 						self.variants.append(pkg_var)
 				else:
 					# no variants, we're fully resolved
 					self.resolve(self.base_path)
+			else:
+				self.metafile_missing = True
 
 		return (self.base_path != None)
 
@@ -886,7 +2560,7 @@ class _Package(object):
 		if (variants):
 			vars = []
 			for var in variants:
-				vars.append(var.working_list)
+				vars.append([x.short_name() for x in var.working_list])
 			l.append("working_vars:" + str(vars))
 		return str(l)
 
@@ -902,13 +2576,22 @@ class _Configuration(object):
 	def __init__(self, rctxt, inc_uid = False):
 		# resolving context
 		self.rctxt = rctxt
-		# packages map, for quick lookup
-		self.pkgs = {}
-		self.cond_requires = []
+		# packages map, for quick lookup. This iterates in the order packages were added,
+		# and package resolution is sensitive to this
+		self.pkgs = _PersistentMap()
+		# packages are shared between configs, and only modified in place by their owner
+		self.owner = object()
+		# the packages that resolve_packages_no_filesys has yet to visit
+		self.worklist = _Worklist()
+		# conditional requirements that are waiting for a condition to be added to the
+		# config, indexed by that condition: family -> tuple of worklist cond_ready entries
+		self.cond_requires = _PersistentMap()
 		# packages list, for order retention wrt resolving
-		self.families = []
+		self.families = _PersistentList()
 		# connections in a dot graph
-		self.dot_graph = []
+		self.dot_graph = _PersistentList()
+		# (family, family, connection type) dependencies, see get_dependency_graph
+		self.family_edges = _PersistentList()
 		# uid
 		if inc_uid:
 			_Configuration.s_uid += 1
@@ -938,7 +2621,7 @@ class _Configuration(object):
 		"""
 		returns True if all packages are resolved
 		"""
-		return (self.get_num_resolved_packages() == self.get_num_packages())
+		return (self.worklist.num_unresolved == 0)
 
 	ADDPKG_CONFLICT 	= 0
 	ADDPKG_ADD 			= 1
@@ -1060,6 +2743,22 @@ class _Configuration(object):
 			pkg_add = _Package(pkg_req, self.rctxt.memcache)
 		return (_Configuration.ADDPKG_ADD, pkg_add)
 
+	def find_nogood(self, pkg_req):
+		"""
+		Check an exact package request against the conflicts learnt so far in this resolve.
+		Returns a (requirement, conflicting package) tuple if adding the package would
+		certainly lead to a conflict, or None otherwise. This is sound because package ranges
+		in a config only ever get reduced, so a conflict with this config is also a conflict
+		with every config that is reduced from it.
+		"""
+		reqs = self.rctxt.nogoods.get((pkg_req.name, pkg_req.version))
+		if reqs:
+			for req in reqs:
+				pkg_conflicting = self.get_conflicting_package(req)
+				if pkg_conflicting:
+					return (req, pkg_conflicting)
+		return None
+
 	def get_conflicting_package(self, pkg_req):
 		"""
 		return a package in the current configuration that 'pkg' would conflict with, or
@@ -1079,6 +2778,10 @@ class _Configuration(object):
 	PKGCONN_CYCLIC		= 5
 	PKGCONN_TRANSITIVE	= 6
 
+	# errors that mean a candidate config could not be resolved, so the next is tried
+	CANDIDATE_ERRORS = (PkgConfigNotResolvedError, PkgsUnresolvedError, PkgConflictError, \
+		PkgNotFoundError, PkgFamilyNotFoundError, PkgSystemError)
+
 	def add_package(self, pkg_req, parent_pkg=None, dot_connection_type=0):
 		"""
 		add a package request to this configuration, optionally describing the 'parent'
@@ -1090,6 +2793,11 @@ class _Configuration(object):
 
 		self._add_package_to_dot_graph(pkg_req.short_name(), pkg, result,
 									   parent_pkg, dot_connection_type)
+		if parent_pkg:
+			connt = _Configuration.PKGCONN_REQUIRES
+			if dot_connection_type == _Configuration.PKGCONN_TRANSITIVE:
+				connt = _Configuration.PKGCONN_TRANSITIVE
+			self.family_edges.append( (parent_pkg.name, pkg_req.name, connt) )
 
 		if (result == _Configuration.ADDPKG_CONFLICT):
 			pkg_conflict = PackageConflict(pkg.as_package_request(), pkg_req)
@@ -1101,16 +2809,81 @@ class _Configuration(object):
 
 			# add pkg, possibly replacing existing pkg. This is to retain order of package addition,
 			# since package resolution is sensitive to this
-			if (not pkg.is_anti()) and (not (pkg.name in self.pkgs)):
+			pkg_prev = self.pkgs.get(pkg.name)
+			if (not pkg.is_anti()) and (pkg_prev is None):
 				self.families.append(pkg.name)
+			pkg.owner = self.owner
 			self.pkgs[pkg.name] = pkg
+			self._package_set(pkg.name, pkg_prev, pkg)
 
 			# if pkg is non-anti then remove its anti from the config, if it's there. Adding a
 			# non-anti pkg to the config without a conflict occurring always means we can safely
 			# remove the anti pkg, if it exists.
 			if not pkg.is_anti():
-				if anti_name(pkg) in self.pkgs:
+				pkg_anti = self.pkgs.get(anti_name(pkg))
+				if pkg_anti is not None:
 					del self.pkgs[anti_name(pkg)]
+					self._package_set(anti_name(pkg), pkg_anti, None)
+
+	def _package_set(self, name, pkg_prev, pkg):
+		"""
+		update the worklist for 'pkg' replacing 'pkg_prev' as the package 'name' (either may
+		be None, for a package that is added or removed)
+		"""
+		worklist = self.worklist
+		if pkg_prev and (not pkg_prev.is_anti()) and (not pkg_prev.is_resolved()):
+			worklist.num_unresolved -= 1
+		if pkg:
+			if (not pkg.is_anti()) and (not pkg.is_resolved()):
+				worklist.num_unresolved += 1
+			worklist.push(name)
+
+		# packages with variants that could now conflict with the config
+		queue = worklist.queues["variant_removal"]
+		for name_ in self.rctxt.variant_dependents.get(name, ()):
+			queue.add(name_)
+
+		# conditional requirements that were waiting for this package
+		if pkg and (pkg_prev is None):
+			entries = self.cond_requires.get(name)
+			if entries:
+				del self.cond_requires[name]
+				worklist.cond_ready.extend(entries)
+
+	def _metafile_resolved(self, name, pkg):
+		"""
+		update the worklist for the package 'name', whose metafile has just been resolved
+		"""
+		if pkg.is_resolved():
+			self.worklist.num_unresolved -= 1
+			return
+
+		self.worklist.push(name, _Worklist.PHASES[1:])
+		self._add_variant_dependents(name, pkg)
+
+	def _add_variant_dependents(self, name, pkg):
+		"""
+		record that the variants of the package 'name' could conflict with the packages
+		they depend on, see _package_set
+		"""
+		dependents = self.rctxt.variant_dependents
+		for variant in pkg.variants:
+			for dep_name in variant.dep_names:
+				names = dependents.get(dep_name)
+				if names is None:
+					names = set()
+					dependents[dep_name] = names
+				names.add(name)
+
+	def _reset_worklist(self):
+		"""
+		rebuild the worklist, queueing every package for every phase
+		"""
+		self.worklist = _Worklist()
+		for name, pkg in self.pkgs.iteritems():
+			self._package_set(name, None, pkg)
+			if pkg.variants:
+				self._add_variant_dependents(name, pkg)
 
 	def _add_package_to_dot_graph(self, short_name, pkg, result, parent_pkg=None,
 								  dot_connection_type=0):
@@ -1126,7 +2899,7 @@ class _Configuration(object):
 		if (result == _Configuration.ADDPKG_CONFLICT):
 			self.dot_graph.append( ( pkg.short_name(), ( short_name, \
 				_Configuration.PKGCONN_CONFLICT ) ) )
-			self.rctxt.last_fail_dot_graph = self.get_dot_graph_as_string()
+			self.rctxt.last_fail_dot_graph = self.get_dot_graph()
 
 		elif (result == _Configuration.ADDPKG_ADD) and pkg:
 
@@ -1146,46 +2919,19 @@ class _Configuration(object):
 					self.dot_graph.append( ( pkgname_existing, ( pkgname, connt ) ) )
 			self.dot_graph.append( ( pkgname, None ) )
 
+	def get_dot_graph(self):
+		"""
+		return a snapshot of the dot-graph as it is now. It is only rendered to a string
+		when used as one, see _DotGraph.
+		"""
+		return _DotGraph(self.dot_graph.copy())
+
 	def get_dot_graph_as_string(self):
 		"""
 		return a string-representation of the dot-graph. You should be able to
 		write this to file, and view it in a dot viewer, such as dotty or graphviz
 		"""
-		dotstr = "digraph g { \n"
-		conns = set()
-
-		for connection in self.dot_graph:
-			if type(connection) == type(""):
-				verbatim_txt = connection
-				dotstr += verbatim_txt + '\n';
-			else:
-				if connection not in conns:
-					if connection[1]:
-						dep, conntype = connection[1]
-						dotstr += '"' + connection[0] + '" -> "' + dep + '" '
-						if(conntype == _Configuration.PKGCONN_REQUIRES):
-							col = make_random_color_string()
-							conn_style = '[label=needs color="' + col + '" fontcolor="' + col + '"]'
-						elif(conntype == _Configuration.PKGCONN_TRANSITIVE):
-							col = make_random_color_string()
-							conn_style = '[label=willneed color="' + col + '" fontcolor="' + col + '"]'
-						elif(conntype == _Configuration.PKGCONN_RESOLVE):
-							conn_style = '[label=resolve color="green4" fontcolor="green4" style="bold"]'
-						elif(conntype == _Configuration.PKGCONN_REDUCE):
-							conn_style = '[label=reduce color="grey30" fontcolor="grey30" style="dashed"]'
-						elif(conntype == _Configuration.PKGCONN_VARIANT):
-							conn_style = '[label=variant color="grey30" fontcolor="grey30" style="dashed"]'
-						elif(conntype == _Configuration.PKGCONN_CYCLIC):
-							conn_style = '[label=CYCLE color="red" fontcolor="red" fontsize="30" style="bold"]'
-						else:
-							conn_style = '[label=CONFLICT color="red" fontcolor="red" fontsize="30" style="bold"]'
-						dotstr += conn_style + ' ;\n'
-					else:
-						dotstr += '"' + connection[0] + '" ;\n'
-					conns.add(connection)
-
-		dotstr += "}\n"
-		return dotstr
+		return dot_graph_to_string(self.dot_graph)
 
 	def add_dot_graph_verbatim(self, txt):
 		"""
@@ -1195,34 +2941,359 @@ class _Configuration(object):
 
 	def copy(self):
 		"""
-		return a shallow copy
+		return a shallow copy. The copy owns the same packages as this config, so changes
+		made to a package through either config are seen by both. It shares the worklist
+		too, since the copy is made to replace this config - see swap.
 		"""
 		confcopy = _Configuration(self.rctxt)
 		confcopy.pkgs = self.pkgs.copy()
-		confcopy.cond_requires = self.cond_requires[:]
-		confcopy.families = self.families[:]
-		confcopy.dot_graph = self.dot_graph[:]
+		confcopy.owner = self.owner
+		confcopy.worklist = self.worklist
+		confcopy.cond_requires = self.cond_requires.copy()
+		confcopy.families = self.families.copy()
+		confcopy.dot_graph = self.dot_graph.copy()
+		confcopy.family_edges = self.family_edges.copy()
 		return confcopy
 
 	def deep_copy(self):
+		"""
+		return a copy that can be changed independently of this config. Packages are
+		shared, and copied by either config before it changes them - see _own_package.
+		"""
 		confcopy = _Configuration(self.rctxt)
-		confcopy.families = self.families[:]
-		confcopy.dot_graph = self.dot_graph[:]
-
-		confcopy.pkgs = {}
-		for k,v in self.pkgs.iteritems():
-			confcopy.pkgs[k] = v.copy()
-		confcopy.cond_requires = self.cond_requires[:]
+		confcopy.pkgs = self.pkgs.copy()
+		confcopy.families = self.families.copy()
+		confcopy.dot_graph = self.dot_graph.copy()
+		confcopy.family_edges = self.family_edges.copy()
+		confcopy.worklist = self.worklist.copy()
+		confcopy.cond_requires = self.cond_requires.copy()
+
+		# neither config owns the shared packages any more
+		self.owner = object()
 		return confcopy
 
+	def get_next_version_range(self, ver_range, pkg_req_):
+		"""
+		Return 'ver_range', restricted to versions less desirable than the resolved package
+		request 'pkg_req_', or None if there are none.
+		"""
+		try:
+			if (self.rctxt.resolve_mode == RESOLVE_MODE_LATEST):
+				return ver_range.get_intersection(VersionRange("0+<" + pkg_req_.version))
+			else:
+				ver_inc = Version(pkg_req_.version).get_inc()
+				return ver_range.get_intersection(VersionRange(str(ver_inc) + '+'))
+		except VersionError:
+			return None
+
+	def resolve_speculatively(self, pkg, pkg_req_, ver_range):
+		"""
+		Resolve the candidate 'pkg_req_' for the unresolved package 'pkg', along with up to
+		rctxt.num_procs-1 of the next most desirable candidates (taken from 'ver_range'), each
+		in a forked process. The most desirable candidate that succeeds wins, and the work on
+		less desirable candidates is abandoned. Failures of more desirable candidates are
+		merged into the resolving context in order, so the result is that of a sequential
+		search.
+
+		Returns a tuple (status, ver_range, num_done):
+		- ("ok", None, n): a candidate resolved, and this config has become its resolution;
+		- ("fail", ver_range, n): all n candidates failed, 'ver_range' holds the candidates
+		  remaining to be searched;
+		- ("error", ver_range, n): the first n candidates failed, and the next raised an error
+		  which must be reproduced by resolving it in this process.
+		"""
+		import cPickle
+		import select
+		import signal
+
+		# candidates are (package request, version range after it, known to fail)
+		candidates = [(pkg_req_, ver_range, None)]
+		num_procs = 1
+		while (num_procs < self.rctxt.num_procs) and (ver_range is not None):
+			try:
+				req = PackageRequest(pkg.name, str(ver_range), self.rctxt.memcache, \
+					self.rctxt.resolve_mode==RESOLVE_MODE_LATEST)
+			except PkgsUnresolvedError:
+				break
+			nogood = self.find_nogood(req)
+			ver_range = self.get_next_version_range(ver_range, req)
+			candidates.append((req, ver_range, nogood))
+			if not nogood:
+				num_procs += 1
+
+		procs = {}
+		results = {}
+		winner = None
+		sys.stdout.flush()
+		sys.stderr.flush()
+		try:
+			for i, (req, ver_range_, nogood) in enumerate(candidates):
+				if nogood:
+					continue
+				fd_read, fd_write = os.pipe()
+				pid = os.fork()
+				if pid == 0:
+					os.close(fd_read)
+					try:
+						result = self._resolve_candidate_in_worker(pkg, req)
+						data = cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+						while data:
+							data = data[os.write(fd_write, data):]
+					finally:
+						os._exit(0)
+				os.close(fd_write)
+				procs[fd_read] = (i, pid, [])
+
+			# read results until the most desirable success (or error) is known
+			while procs:
+				fds = select.select(procs.keys(), [], [])[0]
+				for fd in fds:
+					i, pid, chunks = procs[fd]
+					chunk = os.read(fd, 1 << 16)
+					if chunk:
+						chunks.append(chunk)
+						continue
+					del procs[fd]
+					os.close(fd)
+					os.waitpid(pid, 0)
+					try:
+						results[i] = cPickle.loads(''.join(chunks))
+					except Exception:
+						results[i] = ("error", None, None)
+
+				winner = None
+				for i, (req, ver_range_, nogood) in enumerate(candidates):
+					if nogood:
+						continue
+					if i not in results:
+						winner = -1
+						break
+					if results[i][0] != "fail":
+						winner = i
+						break
+				if winner != -1:
+					break
+		finally:
+			for fd, (i, pid, chunks) in procs.iteritems():
+				os.kill(pid, signal.SIGKILL)
+				os.close(fd)
+				os.waitpid(pid, 0)
+
+		# merge the results of the candidates that would have been searched sequentially
+		num_done = len(candidates) if (winner is None) else winner
+		for i in range(num_done):
+			if candidates[i][2]:
+				self.rctxt.num_pruned += 1
+			else:
+				self._merge_worker_result(results[i][1])
+
+		if winner is None:
+			return ("fail", candidates[-1][1], num_done)
+
+		status, context, state = results[winner]
+		if status == "error":
+			ver_range = candidates[winner - 1][1] if winner else None
+			return ("error", ver_range, num_done)
+
+		self._merge_worker_result(context)
+		pkgs, families, dot_graph, family_edges, cond_requires = state
+		for pkg_ in pkgs.itervalues():
+			pkg_.owner = self.owner
+		self.pkgs = pkgs
+		self.families = _PersistentList(families)
+		self.dot_graph = _PersistentList(dot_graph)
+		self.family_edges = _PersistentList(family_edges)
+		self.cond_requires = cond_requires
+		self._reset_worklist()
+		return ("ok", None, num_done + 1)
+
+	def _resolve_candidate_in_worker(self, pkg, pkg_req_):
+		"""
+		Run in a forked process by resolve_speculatively. Returns (status, context, state),
+		where status is one of "ok", "fail", "error", context holds the changes made to the
+		resolving context, and state holds the resolved config on success.
+		"""
+		rctxt = self.rctxt
+		rctxt.is_worker = True
+		# the memcached connection belongs to the parent process
+		rctxt.memcache.mc = None
+
+		num_fails = len(rctxt.config_fail_list)
+		num_pruned = rctxt.num_pruned
+		num_configs = rctxt.num_configs
+		num_passes = rctxt.num_passes
+		num_visits = rctxt.num_visits
+		last_fail_dot_graph = rctxt.last_fail_dot_graph
+
+		try:
+			pkg_resolve_str = pkg.short_name() + " --> " + pkg_req_.short_name()
+			config2 = self.try_resolve_candidate(pkg_req_, pkg_resolve_str)
+		except Exception:
+			return ("error", None, None)
+
+		dot_graph = rctxt.last_fail_dot_graph
+		if dot_graph is last_fail_dot_graph:
+			dot_graph = None
+		else:
+			dot_graph = str(dot_graph)
+		context = (rctxt.config_fail_list[num_fails:], len(rctxt.config_fail_list) - num_fails, \
+			rctxt.nogoods, rctxt.num_pruned - num_pruned, rctxt.num_configs - num_configs, \
+			rctxt.num_passes - num_passes, rctxt.num_visits - num_visits, dot_graph)
+
+		if config2 is None:
+			return ("fail", context, None)
+
+		state = (config2.pkgs, list(config2.families), list(config2.dot_graph), \
+			list(config2.family_edges), config2.cond_requires)
+		return ("ok", context, state)
+
+	def _merge_worker_result(self, context):
+		fails, num_fails, nogoods, num_pruned, num_configs, num_passes, num_visits, \
+			dot_graph = context
+		self.rctxt.config_fail_list.extend(fails)
+		if num_fails > len(fails):
+			# a memory-bounded worker only sends back the failures it kept
+			self.rctxt.config_fail_list.num_fails += num_fails - len(fails)
+		self.rctxt.add_nogoods(nogoods)
+		self.rctxt.num_pruned += num_pruned
+		self.rctxt.num_configs += num_configs
+		self.rctxt.num_passes += num_passes
+		self.rctxt.num_visits += num_visits
+		# keep config uids in step with a sequential resolve
+		_Configuration.s_uid += num_configs
+		if dot_graph is not None:
+			self.rctxt.last_fail_dot_graph = dot_graph
+
+	def try_resolve_candidate(self, pkg_req_, pkg_resolve_str):
+		"""
+		Attempt to fully resolve a copy of this config with the package request 'pkg_req_'
+		added to it. Returns the resolved config, or None if it could not be resolved (the
+		failure is recorded in the resolving context). This is what resolve_packages does for
+		each candidate, except that it does it inline, so that each level of the search costs
+		one stack frame.
+		"""
+		config2 = self.spawn_candidate(pkg_req_, pkg_resolve_str)
+		if config2 is None:
+			return None
+
+		try:
+			config2.resolve_packages()
+		except _Configuration.CANDIDATE_ERRORS, e:
+			self.record_candidate_failure(config2, e)
+			return None
+		return config2
+
+	def spawn_candidate(self, pkg_req_, pkg_resolve_str):
+		"""
+		Return a copy of this config with the package request 'pkg_req_' added to it, to be
+		resolved next, or None if adding it conflicts (the failure is recorded in the
+		resolving context).
+		"""
+		# create config copy, bit of fiddling though cause we want a proper guid
+		config2 =_Configuration(self.rctxt, True)
+		guid_ = config2.uid
+
+		config2 = self.deep_copy()
+		config2.uid = guid_
+
+		self.rctxt.num_configs += 1
+		self.rctxt.check_budgets(self)
+
+		if (self.rctxt.verbosity != 0):
+			print
+			print "SPAWNED NEW CONFIG #" + str(config2.uid) + " FROM PARENT #" + str(self.uid) + \
+				" BASED ON FILESYS RESOLUTION: " + pkg_resolve_str
+
+		# attempt to add package to config copy
+		try:
+			config2.add_package(pkg_req_, None, _Configuration.PKGCONN_RESOLVE)
+		except PkgConflictError, e:
+			self.rctxt.last_fail_dot_graph = config2.get_dot_graph()
+
+			if (self.rctxt.verbosity != 0):
+				print
+				print "CONFIG #" + str(config2.uid) + " FAILED (" + e.__class__.__name__ + "):"
+				print str(e)
+				print
+				print "ROLLING BACK TO CONFIG #" + self.uid
+			return None
+
+		if (self.rctxt.verbosity != 0):
+			print
+			print "config after applying: " + pkg_resolve_str
+			if (self.rctxt.verbosity == 1):
+				print str(config2)
+			elif (self.rctxt.verbosity == 2):
+				config2.dump()
+
+		return config2
+
+	def record_candidate_failure(self, config2, e):
+		"""
+		Record that the candidate config 'config2' failed to resolve with the error 'e'.
+		Raises PkgConfigNotResolvedError if this takes the resolve past max_fails.
+		"""
+		# store fail reason into list, unless it's a PkgConfigNotResolvedError - this error just
+		# tells us that the sub-config failed because its sub-config failed.
+		if (type(e) not in [PkgConfigNotResolvedError, PkgsUnresolvedError]):
+
+			sys.stderr.write("conflict " + str(len(self.rctxt.config_fail_list)) + \
+				": " + config2.short_str() + '\n')
+			sys.stderr.flush()
+
+			if self.rctxt.max_fail_history >= 0:
+				config_str = config2.short_str().strip()
+			else:
+				config_str = str(config2).strip()
+			this_fail = "config: (" + config_str + "): " + \
+				e.__class__.__name__ + ": " + str(e)
+
+			if(self.rctxt.max_fails >= 0):
+				if(len(self.rctxt.config_fail_list) <= self.rctxt.max_fails):
+					self.rctxt.config_fail_list.append(this_fail)
+					if(len(self.rctxt.config_fail_list) > self.rctxt.max_fails):
+						self.rctxt.config_fail_list.append( \
+							"Maximum configuration failures reached.")
+						pkg_reqs_ = self.get_all_packages_as_package_requests()
+						raise PkgConfigNotResolvedError(pkg_reqs_, \
+							self.rctxt.config_fail_list, self.rctxt.last_fail_dot_graph)
+			else:
+				self.rctxt.config_fail_list.append(this_fail)
+
+		if (self.rctxt.verbosity != 0):
+			print
+			print "CONFIG #" + str(config2.uid) + " FAILED (" + e.__class__.__name__ + "):"
+			print str(e)
+			print
+			print "ROLLING BACK TO CONFIG #" + str(self.uid)
+
 	def swap(self, a):
 		"""
 		swap this config's contents with another
 		"""
 		self.pkgs, a.pkgs = a.pkgs, self.pkgs
+		self.owner, a.owner = a.owner, self.owner
+		self.worklist, a.worklist = a.worklist, self.worklist
 		self.cond_requires, a.cond_requires = a.cond_requires, self.cond_requires
 		self.families, a.families = a.families, self.families
 		self.dot_graph, a.dot_graph = a.dot_graph, self.dot_graph
+		self.family_edges, a.family_edges = a.family_edges, self.family_edges
+
+	def _own_package(self, name, config2=None):
+		"""
+		return the package 'name', first replacing it with a private copy if it is shared
+		with another config. This must be called before changing a package. If config2 is
+		a shallow copy of this config and holds the same package, it is updated too.
+		"""
+		pkg = self.pkgs[name]
+		if pkg.owner is not self.owner:
+			pkg_ = pkg.copy()
+			pkg_.owner = self.owner
+			self.pkgs[name] = pkg_
+			if config2 and (config2.pkgs.get(name) is pkg):
+				config2.pkgs[name] = pkg_
+			pkg = pkg_
+		return pkg
 
 	def get_unresolved_packages_as_package_requests(self):
 		"""
@@ -1256,6 +3327,8 @@ class _Configuration(object):
 		while (not self.all_resolved()) and \
 		    ((self.rctxt.max_fails == -1) or (len(self.rctxt.config_fail_list) <= self.rctxt.max_fails)):
 
+			self.rctxt.check_budgets(self)
+
 			# do an initial resolve pass
 			self.resolve_packages_no_filesys()
 			if self.all_resolved():
@@ -1267,7 +3340,7 @@ class _Configuration(object):
 				raise PkgsUnresolvedError(pkg_reqs)
 
 			# add transitive dependencies
-			self.add_transitive_dependencies()
+			self._run_phase("transitivity", self.add_transitive_dependencies)
 
 			# this shouldn't happen here but just in case...
 			if self.all_resolved():
@@ -1300,6 +3373,12 @@ class _Configuration(object):
 
 			else:
 
+				# the config the resolve's search starts from, which is checked if the search
+				# fails, see check_request_satisfiable
+				if not self.rctxt.request_checked:
+					self.rctxt.request_checked = True
+					self.rctxt.unchecked_config = self
+
 				ver_range_valid = pkg.version_range
 				valid_config_found = False
 
@@ -1308,6 +3387,10 @@ class _Configuration(object):
 				# work down). The first config to resolve represents the most desirable. Note
 				# that resolve_packages will be called recursively
 				num_version_searches = 0
+				speculate = self.rctxt.can_speculate()
+				decision = None
+				if self.rctxt.profile:
+					decision = self.rctxt.profile.start_decision(pkg.name)
 				while (not (ver_range_valid == None)) and \
 		            ((self.rctxt.max_fails == -1) or \
 		            	(len(self.rctxt.config_fail_list) <= self.rctxt.max_fails)):
@@ -1329,7 +3412,7 @@ class _Configuration(object):
 							self.add_dot_graph_verbatim('"' + \
 								e.pkg_reqs[0].short_name() + '" -> "' + \
 								e.pkg_reqs[0].short_name() + ' NOT FOUND" ;')
-							self.rctxt.last_fail_dot_graph = self.get_dot_graph_as_string()
+							self.rctxt.last_fail_dot_graph = self.get_dot_graph()
 
 							sys.stderr.write("Warning! Package not found: " + str(e.pkg_reqs[0]) + "\n")
 							raise PkgNotFoundError(e.pkg_reqs[0])
@@ -1342,96 +3425,67 @@ class _Configuration(object):
 							raise e
 
 					pkg_resolve_str = pkg.short_name() + " --> " + pkg_req_.short_name()
+					nogood = self.find_nogood(pkg_req_)
 
 					# restrict next package search to one version less desirable
-					try:
-						if (self.rctxt.resolve_mode == RESOLVE_MODE_LATEST):
-							ver_range_valid = ver_range_valid.get_intersection(VersionRange("0+<" + pkg_req_.version))
-						else:
-							ver_inc = Version(pkg_req_.version).get_inc()
-							ver_range_valid = ver_range_valid.get_intersection(VersionRange(str(ver_inc) + '+'))
-					except VersionError:
-						ver_range_valid = None
-
-					# create config copy, bit of fiddling though cause we want a proper guid
-					config2 =_Configuration(self.rctxt, True)
-					guid_ = config2.uid
-
-					config2 = self.deep_copy()
-					config2.uid = guid_
-
-					if (self.rctxt.verbosity != 0):
-						print
-						print "SPAWNED NEW CONFIG #" + str(config2.uid) + " FROM PARENT #" + str(self.uid) + \
-							" BASED ON FILESYS RESOLUTION: " + pkg_resolve_str
-
-					# attempt to add package to config copy
-					try:
-						config2.add_package(pkg_req_, None, _Configuration.PKGCONN_RESOLVE)
-					except PkgConflictError, e:
-						self.rctxt.last_fail_dot_graph = config2.get_dot_graph_as_string()
+					ver_range_valid = self.get_next_version_range(ver_range_valid, pkg_req_)
 
+					if nogood:
+						# this candidate is known to fail, skip it
+						self.rctxt.num_pruned += 1
 						if (self.rctxt.verbosity != 0):
 							print
-							print "CONFIG #" + str(config2.uid) + " FAILED (" + e.__class__.__name__ + "):"
-							print str(e)
-							print
-							print "ROLLING BACK TO CONFIG #" + self.uid
+							print "PRUNED " + pkg_resolve_str + ": " + pkg_req_.short_name() + \
+								" requires " + nogood[0].short_name() + ", which conflicts with " + \
+								nogood[1].short_name()
 						continue
 
-					if (self.rctxt.verbosity != 0):
-						print
-						print "config after applying: " + pkg_resolve_str
-						if (self.rctxt.verbosity == 1):
-							print str(config2)
-						elif (self.rctxt.verbosity == 2):
-							config2.dump()
-
-					# now fully resolve config copy
+					if speculate:
+						status, ver_range_, num_done = self.resolve_speculatively(pkg, \
+							pkg_req_, ver_range_valid)
+						if status == "ok":
+							valid_config_found = True
+							break
+						elif status == "fail":
+							ver_range_valid = ver_range_
+							self.check_request_satisfiable()
+							continue
+
+						# a candidate raised an error, resolve up to it here so that it is raised
+						# in this process
+						speculate = False
+						if num_done:
+							ver_range_valid = ver_range_
+							continue
+
+					token = None
+					if decision:
+						token = self.rctxt.profile.start_candidate(decision, pkg_req_.short_name())
+
+					# now fully resolve a config copy with the candidate added. This recurses, and
+					# is done here rather than in a helper so that each level of the search costs
+					# one stack frame - deep searches would otherwise hit python's recursion limit
+					config2 = self.spawn_candidate(pkg_req_, pkg_resolve_str)
+					ok = False
 					try:
-						config2.resolve_packages()
-					except ( \
-						PkgConfigNotResolvedError, \
-						PkgsUnresolvedError, \
-						PkgConflictError, \
-						PkgNotFoundError, \
-						PkgFamilyNotFoundError, \
-						PkgSystemError), e:
-
-						# store fail reason into list, unless it's a PkgConfigNotResolvedError - this error just
-						# tells us that the sub-config failed because its sub-config failed.
-						if (type(e) not in [PkgConfigNotResolvedError, PkgsUnresolvedError]):
-
-							sys.stderr.write("conflict " + str(len(self.rctxt.config_fail_list)) + \
-								": " + config2.short_str() + '\n')
-							sys.stderr.flush()
-
-							this_fail = "config: (" + str(config2).strip() + "): " + \
-								e.__class__.__name__ + ": " + str(e)
-
-							if(self.rctxt.max_fails >= 0):
-								if(len(self.rctxt.config_fail_list) <= self.rctxt.max_fails):
-									self.rctxt.config_fail_list.append(this_fail)
-									if(len(self.rctxt.config_fail_list) > self.rctxt.max_fails):
-										self.rctxt.config_fail_list.append( \
-											"Maximum configuration failures reached.")
-										pkg_reqs_ = self.get_all_packages_as_package_requests()
-										raise PkgConfigNotResolvedError(pkg_reqs_, \
-											self.rctxt.config_fail_list, self.rctxt.last_fail_dot_graph)
-							else:
-								self.rctxt.config_fail_list.append(this_fail)
-
-						if (self.rctxt.verbosity != 0):
-							print
-							print "CONFIG #" + str(config2.uid) + " FAILED (" + e.__class__.__name__ + "):"
-							print str(e)
-							print
-							print "ROLLING BACK TO CONFIG #" + str(self.uid)
-
+						if config2 is not None:
+							config2.resolve_packages()
+							ok = True
+					except _Configuration.CANDIDATE_ERRORS, e:
+						if e is self.rctxt.unsatisfiable:
+							raise
+						self.record_candidate_failure(config2, e)
+					finally:
+						if token:
+							self.rctxt.profile.end_candidate(token, ok)
+					if not ok:
+						self.check_request_satisfiable()
 						continue
 
-					# if we got here then we have a valid config yay!
+					# if we got here then we have a valid config yay! config2 now holds our old
+					# contents, release them rather than keeping them until this search returns
 					self.swap(config2)
+					del config2
 					valid_config_found = True
 					break
 
@@ -1450,6 +3504,101 @@ class _Configuration(object):
 		# woohoo, we have a fully resolved configuration!
 		#################################################
 
+		return self._run_phase("ordering", self.get_package_resolutions)
+
+	def check_satisfiable(self):
+		"""
+		A cheap test for a configuration that can't be resolved, whichever versions are
+		chosen: some inexact package requires, in all of its versions, a range of a family
+		that conflicts with the package of that family already in the config, or with a
+		range that another inexact package requires in all of its versions. Every version's
+		metafile is read, so this is only done once the search has failed, see
+		check_request_satisfiable. Raises PkgConfigNotResolvedError, with an explanation of
+		the conflict.
+		"""
+		required = {}
+		for name in self.families:
+			pkg = self.pkgs[name]
+			if pkg.is_anti() or pkg.is_metafile_resolved():
+				continue
+
+			envelope = self.rctxt.get_family_envelope(pkg.name)
+			ranges = envelope.get_required_ranges(pkg.version_range)
+			if not ranges:
+				continue
+
+			for fam in sorted(ranges):
+				ver_range = ranges[fam]
+				if fam == pkg.name:
+					continue
+				pkg_req = PackageRequest(fam, str(ver_range))
+
+				pkg2 = self.pkgs.get(fam)
+				if pkg2 and (not pkg2.is_anti()) and \
+						(not ver_range.get_intersection(pkg2.version_range)):
+					self._raise_unsatisfiable(pkg, pkg_req, pkg2.short_name(), \
+						pkg2.short_name())
+
+				for pkg3, pkg_req3 in required.get(fam, []):
+					if not ver_range.get_intersection(pkg_req3.version_range):
+						self._raise_unsatisfiable(pkg, pkg_req, pkg3.short_name(), \
+							"%s, required by all versions of %s" % \
+							(pkg_req3.short_name(), pkg3.short_name()))
+
+				required.setdefault(fam, []).append((pkg, pkg_req))
+
+	def check_request_satisfiable(self):
+		"""
+		Called when a candidate config fails to resolve. On the first failure of a resolve,
+		the config its search started from is checked with check_satisfiable, so that an
+		unsatisfiable request fails straight away rather than once the search is exhausted.
+		Requests that resolve without a failure never pay for the check. The error is
+		re-raised by each level of the search, rather than being taken as the failure of
+		just one candidate.
+		"""
+		config = self.rctxt.unchecked_config
+		if config is None:
+			return
+		self.rctxt.unchecked_config = None
+		try:
+			config.check_satisfiable()
+		except PkgConfigNotResolvedError, e:
+			self.rctxt.unsatisfiable = e
+			raise
+
+	def _raise_unsatisfiable(self, pkg, pkg_req, other_name, other_desc):
+		conflict = pkg_req.short_name() + " <--!--> " + other_name
+		self.add_dot_graph_verbatim('"' + conflict + '" [style=filled fillcolor="orangered"] ;')
+		self.add_dot_graph_verbatim('"' + pkg.short_name() + '" -> "' + conflict + '" ;')
+		self.add_dot_graph_verbatim('"' + other_name + '" -> "' + conflict + '" ;')
+		self.rctxt.last_fail_dot_graph = self.get_dot_graph()
+
+		msg = "all versions of %s require %s, which conflicts with %s" % \
+			(pkg.short_name(), pkg_req.short_name(), other_desc)
+		if (self.rctxt.verbosity != 0):
+			print
+			print "REQUEST CANNOT BE RESOLVED: " + msg
+
+		self.rctxt.config_fail_list.append("config: (" + self.short_str().strip() + \
+			"): unsatisfiable: " + msg)
+		pkg_reqs_ = self.get_all_packages_as_package_requests()
+		raise PkgConfigNotResolvedError(pkg_reqs_, \
+			self.rctxt.config_fail_list, self.rctxt.last_fail_dot_graph)
+
+	def _run_phase(self, phase, fn, *args):
+		"""
+		call fn(*args), timing it as the given phase if the resolve is being profiled
+		"""
+		if self.rctxt.profile:
+			return self.rctxt.profile.run_phase(phase, fn, *args)
+		return fn(*args)
+
+	def get_package_resolutions(self):
+		"""
+		Convert a fully resolved configuration into a list of ResolvedPackages, ordered so
+		that required packages appear before requirees. Raises PkgCyclicDependency if there
+		are cycles.
+		"""
 		# check for cyclic dependencies
 		cyclic_deps = self.detect_cyclic_dependencies()
 		if len(cyclic_deps) > 0:
@@ -1475,150 +3624,65 @@ class _Configuration(object):
 
 		return pkg_ress
 
-	def _create_family_dependency_tree(self):
+	def get_dependency_graph(self):
 		"""
-		From the dot-graph, extract a dependency tree containing unversioned pkgs (ie families),
-		and a set of all existing families
+		Return a DependencyGraph of the (non-anti) families in this config, with an edge
+		for each dependency recorded as packages were added to it.
 		"""
-		deps = set()
-		fams = set()
-		for conn in self.dot_graph:
-			if (type(conn) != type("")) and \
-				(conn[0][0] != '!'):
-				fam1 = conn[0].split('-',1)[0]
-				fams.add(fam1)
-				if (conn[1] != None) and \
-					(conn[1][1] == _Configuration.PKGCONN_REQUIRES) and \
-					(conn[1][0][0] != '!'):
-					fam2 = conn[1][0].split('-',1)[0]
-					fams.add(fam2)
-					if fam1 != fam2:
-						deps.add( (fam1, fam2) )
-
-		return deps, fams
+		graph = DependencyGraph()
+		for name in self.families:
+			pkg = self.pkgs.get(name)
+			if pkg and not pkg.is_anti():
+				graph.add_node(name)
+
+		for fam1, fam2, connt in self.family_edges:
+			if (fam1 != fam2) and graph.has_node(fam1) and graph.has_node(fam2):
+				graph.add_edge(fam1, fam2, connt)
+		return graph
 
 	def get_ordered_families(self):
 		"""
 		Return the families of all packages in such an order that required packages appear
 		before requirees. This means we can properly order package command construction -
 		if A requires B, then A's commands might refer to an env-var set in B's commands.
+		Where the order is otherwise free, families appear in the order they were added.
 		"""
-		fam_list = []
-		deps, fams = self._create_family_dependency_tree()
-
-		while len(deps) > 0:
-			parents = set()
-			children = set()
-			for dep in deps:
-				parents.add(dep[0])
-				children.add(dep[1])
-
-			leaf_fams = children - parents
-			if len(leaf_fams) == 0:
-				break 	# if we hit this then there are cycle(s) somewhere
-
-			for fam in leaf_fams:
-				fam_list.append(fam)
-
-			del_deps = set()
-			for dep in deps:
-				if dep[1] in leaf_fams:
-					del_deps.add(dep)
-			deps -= del_deps
-
-			fams -= leaf_fams
-
-		# anything left in the fam set is a topmost node
-		for fam in fams:
-			fam_list.append(fam)
-
-		return fam_list
-
+		graph = self.get_dependency_graph()
+		return graph.get_ordered_nodes([_Configuration.PKGCONN_REQUIRES])
 
 	def detect_cyclic_dependencies(self):
 		"""
-		detect cyclic dependencies, if they exist
+		detect cyclic dependencies, if they exist. Returns a set of (pkg, required-pkg)
+		short-name pairs, for each dependency that is part of a cycle.
 		"""
-		# extract dependency tree from dot-graph
-		deps = self._create_family_dependency_tree()[0]
-
-		# remove leaf nodes
-		while len(deps) > 0:
-			parents = set()
-			children = set()
-			for dep in deps:
-				parents.add(dep[0])
-				children.add(dep[1])
-
-			leaf_fams = children - parents
-			if len(leaf_fams) == 0:
-				break
-
-			del_deps = set()
-			for dep in deps:
-				if dep[1] in leaf_fams:
-					del_deps.add(dep)
-			deps -= del_deps
-
-		# remove topmost nodes
-		while len(deps) > 0:
-			parents = set()
-			children = set()
-			for dep in deps:
-				parents.add(dep[0])
-				children.add(dep[1])
-
-			top_fams = parents - children
-			if len(top_fams) == 0:
-				break
-
-			del_deps = set()
-			for dep in deps:
-				if dep[0] in top_fams:
-					del_deps.add(dep)
-			deps -= del_deps
-
-		# anything left is part of a cyclic loop...
-
-		if len(deps) > 0:
-			# inject pkg versions into deps list
-			deps2 = set()
-			for dep in deps:
-				pkg1 = self.pkgs[ dep[0] ].short_name()
-				pkg2 = self.pkgs[ dep[1] ].short_name()
-				deps2.add( (pkg1, pkg2) )
-			deps = deps2
-
+		graph = self.get_dependency_graph()
+		deps = set()
+		for fam1, fam2 in graph.get_cycle_edges([_Configuration.PKGCONN_REQUIRES]):
+			deps.add( (self.pkgs[fam1].short_name(), self.pkgs[fam2].short_name()) )
 		return deps
 
 	def resolve_packages_no_filesys(self):
 		"""
-		resolve current packages as far as possible without querying the file system
+		resolve current packages as far as possible without querying the file system. Each
+		phase only visits the packages that changes to the config have queued for it (see
+		_Worklist), and is skipped when there are none. This stops once no phase has any
+		left, which is when a pass of every phase over every package would change nothing.
 		"""
-
-		nresolved_metafiles = -1
-		nresolved_common_variant_pkgs = -1
-		nconflicting_variants_removed = -1
-		nresolved_single_variant_pkgs = -1
-
-		while ((( \
-				nresolved_metafiles + \
-				nresolved_common_variant_pkgs + \
-				nconflicting_variants_removed + \
-				nresolved_single_variant_pkgs) != 0) and
-				(not self.all_resolved())):
-
+		phases = (
 			# resolve metafiles
-			nresolved_metafiles = self.resolve_metafiles()
-
+			("metafiles", self.resolve_metafiles),
 			# remove conflicting variants
-			nconflicting_variants_removed = self.remove_conflicting_variants()
-
+			("variant_removal", self.remove_conflicting_variants),
 			# resolve common variant packages
-			nresolved_common_variant_pkgs = self.resolve_common_variants()
-
+			("common_variants", self.resolve_common_variants),
 			# resolve packages with a single, fully-resolved variant
-			nresolved_single_variant_pkgs = self.resolve_single_variant_packages()
+			("single_variants", self.resolve_single_variant_packages) )
+
+		while (not self.worklist.is_empty()) and (not self.all_resolved()):
+			for phase, fn in phases:
+				if self.worklist.has_work(phase):
+					self.rctxt.num_passes += 1
+					self._run_phase(phase, fn)
 
 	def remove_least_suitable_variant(self):
 		"""
@@ -1628,34 +3692,37 @@ class _Configuration(object):
 		TODO remove this I think, error instead
 		"""
 
-		bad_pkg = None
+		bad_name = None
 		bad_variant = None
+		bad_variant_index = None
 		bad_variant_score = -1
 
 		for name,pkg in self.pkgs.iteritems():
 			if (not pkg.is_resolved()) and (not pkg.is_anti()):
-				for variant in pkg.get_variants():
+				for i, variant in enumerate(pkg.get_variants()):
 					sc = self.get_num_unknown_pkgs(variant.working_list)
 					if (sc > bad_variant_score):
-						bad_pkg = pkg
+						bad_name = name
 						bad_variant = variant
+						bad_variant_index = i
 						bad_variant_score = sc
 
-		bad_pkg.get_variants().remove(bad_variant)
+		bad_pkg = self._own_package(bad_name)
+		del bad_pkg.get_variants()[bad_variant_index]
+		self.worklist.push(bad_name, ("common_variants", "single_variants"))
 
 		if (self.rctxt.verbosity != 0):
 			print
 			print "removed least suitable variant:"
 			print bad_pkg.short_name() + " variant:" + str(bad_variant)
 
-	def get_num_unknown_pkgs(self, pkg_strs):
+	def get_num_unknown_pkgs(self, pkg_reqs):
 		"""
-		given a list of package strings, return the number of packages in the list
+		given a list of package requests, return the number of packages in the list
 		which do not appear in the current configuration
 		"""
 		num = 0
-		for pkg_str in pkg_strs:
-			pkg_req = str_to_pkg_req(pkg_str, self.rctxt.memcache)
+		for pkg_req in pkg_reqs:
 			if pkg_req.name not in self.pkgs:
 				num += 1
 
@@ -1664,19 +3731,27 @@ class _Configuration(object):
 	def resolve_metafiles(self):
 		"""
 		for each package, resolve metafiles until no more can be resolved, returning
-		the number of metafiles that were resolved.
+		the number of metafiles that were resolved. Conditional requirements are added
+		once all of their conditions are in the config - until then, each waits in
+		cond_requires for one of the conditions that isn't.
 		"""
 		num = 0
 		config2 = None
 
-		def add_require(pkg, pkg_req_str, memcache=None):
-			pkg_req = str_to_pkg_req(pkg_req_str, memcache)
+		def add_require(pkg, pkg_req, learn=False):
 			if (self.rctxt.verbosity != 0):
 				print
 				print "adding " + pkg.short_name() + \
 					"'s required package " + pkg_req.short_name() + '...'
 
-			config2.add_package(pkg_req, pkg)
+			try:
+				config2.add_package(pkg_req, pkg)
+			except PkgConflictError:
+				# an unconditional requirement of an exact package will always conflict with
+				# this config, and any config further reduced from it
+				if learn and (not pkg_req.is_anti()) and (pkg_req.name != pkg.name):
+					self.rctxt.add_nogood(pkg, pkg_req)
+				raise
 
 			if (self.rctxt.verbosity != 0):
 				print "config after adding " + pkg.short_name() + \
@@ -1686,10 +3761,33 @@ class _Configuration(object):
 			elif (self.rctxt.verbosity == 2):
 				config2.dump()
 
-		for name, pkg in self.pkgs.iteritems():
-			if (pkg.metadata == None):
+		def add_cond_requires():
+			# add the queued conditional requirements whose conditions are all in the
+			# config, in the order they were found
+			worklist = config2.worklist
+			while worklist.cond_ready:
+				entries = sorted(worklist.cond_ready, key=lambda x: x[0])
+				worklist.cond_ready = []
+				for entry in entries:
+					src_pkg, pkg_req, conditionals = entry[1:]
+					# for now, do a simple check without version
+					missing = [x for x in conditionals if x not in config2.pkgs]
+					if missing:
+						config2.cond_requires[missing[0]] = \
+							config2.cond_requires.get(missing[0], ()) + (entry,)
+					else:
+						add_require(src_pkg, pkg_req)
+
+		for name in self.worklist.pop("metafiles", self.pkgs):
+			pkg = self.pkgs[name]
+			self.rctxt.num_visits += 1
+			if (pkg.metadata == None) and (not pkg.metafile_missing) \
+					and pkg.can_resolve_metafile():
+				pkg = self._own_package(name, config2)
 				if pkg.resolve_metafile(self.rctxt.memcache):
 					num += 1
+					if (config2 is None) or (config2.pkgs.get(name) is pkg):
+						self._metafile_resolved(name, pkg)
 
 					if (self.rctxt.verbosity != 0):
 						print
@@ -1699,30 +3797,33 @@ class _Configuration(object):
 
 					# add required packages to the configuration, this may
 					# reduce wrt existing packages (eg: foo-1 -> foo-1.2 is a reduction)
-					requires = pkg.metadata.get_requires(self.rctxt.build_requires)
+					metafile_reqs = get_metafile_requests(pkg.metadata, self.rctxt.memcache)
+					requires = metafile_reqs.get_requires(self.rctxt.build_requires)
 
 					if requires:
-						for pkg_str in requires:
+						for pkg_req in requires:
 							if not config2:
 								config2 = self.copy()
-							add_require(pkg, pkg_str, self.rctxt.memcache)
-
-					# since conditional requirements might not be filled immediately,
-					# add the current pkg to the list, so we know it later:
-					cond_requires = [(pkg, pkg_str, cond) for pkg_str, cond in \
-									 pkg.metadata.get_conditional_requires()]
-					cond_requires = self.cond_requires + cond_requires
-					if cond_requires:
+							add_require(pkg, pkg_req, True)
+
+					# conditional requirements might not be filled immediately, so queue
+					# them along with any whose conditions have been added since the last
+					# metafile was resolved
+					for pkg_req, conditionals in metafile_reqs.get_conditional_requires():
+						self.rctxt.num_cond_requires += 1
+						self.worklist.cond_ready.append((self.rctxt.num_cond_requires, pkg, \
+							pkg_req, conditionals))
+					if self.worklist.cond_ready:
 						if not config2:
 							config2 = self.copy()
-						# reset this: it will be copied over in the loop, excluding any successes
-						config2.cond_requires = []
-						for src_pkg, pkg_req_str, conditionals in cond_requires:
-							# for now, do a simple check without verison
-							if set(conditionals).issubset(config2.pkgs.keys()):
-								add_require(src_pkg, pkg_req_str)
-							else:
-								config2.cond_requires.append((src_pkg, pkg_req_str, conditionals))
+						add_cond_requires()
+
+		# conditions added since the last metafile was resolved, or in other phases
+		if self.worklist.cond_ready:
+			if not config2:
+				config2 = self.copy()
+			add_cond_requires()
+
 		if config2:
 			self.swap(config2)
 		return num
@@ -1752,108 +3853,20 @@ class _Configuration(object):
 			if pkg.has_added_transitivity:
 				continue
 
-			# get the requires lists for the earliest and latest versions of this pkg
-			found_path, found_ver, found_epoch = self.rctxt.memcache.find_package_in_range(
-				pkg.name, pkg.version_range, latest=False)
-
-			if (not found_path) or (not found_ver):
-				continue
-			metafile_e = self.rctxt.memcache.get_metafile(
-				os.path.join(found_path, str(found_ver), PKG_METADATA_FILENAME))
-			if not metafile_e:
-				continue
-
-			found_path, found_ver, found_epoch = self.rctxt.memcache.find_package_in_range(
-				pkg.name, pkg.version_range, latest=True)
-
-			if (not found_path) or (not found_ver):
-				continue
-			metafile_l = self.rctxt.memcache.get_metafile(
-				os.path.join(found_path, str(found_ver), PKG_METADATA_FILENAME))
-			if not metafile_l:
+			# the requests implied by the earliest and latest versions in the pkg's range
+			envelope = self.rctxt.get_family_envelope(pkg.name)
+			pkg_reqs = envelope.get_transitive_requests(pkg.version_range)
+			if pkg_reqs is None:
 				continue
 
+			pkg = self._own_package(name, config2)
 			pkg.has_added_transitivity = True
 
-			requires_e = metafile_e.get_requires()
-			requires_l = metafile_l.get_requires()
-			if (not requires_e) or (not requires_l):
-				continue
-
-			# find pkgs that exist in the requires of both, and add these to the current
-			# config as 'transitivity' packages
-			for pkg_str_e in requires_e:
-				if (pkg_str_e[0] == '!') or (pkg_str_e[0] == '~'):
-					continue
-
-				pkg_req_e = str_to_pkg_req(pkg_str_e, self.rctxt.memcache)
-
-				for pkg_str_l in requires_l:
-					pkg_req_l = str_to_pkg_req(pkg_str_l, self.rctxt.memcache)
-					if (pkg_req_e.name == pkg_req_l.name):
-						pkg_req = pkg_req_e
-						if (pkg_req_e.version != pkg_req_l.version):
-							# calc version range
-							v_e = Version(pkg_req_e.version)
-							v_l = Version(pkg_req_l.version)
-							if(not v_e.ge < v_l.lt):
-								continue
-							v = Version()
-							v.ge = v_e.ge
-							v.lt = v_l.lt
-							if (v.ge == Version.NEG_INF) and (v.lt != Version.INF):
-								v.ge = [0]
-							pkg_req = PackageRequest(pkg_req_e.name, str(v))
-
-						if not config2:
-							config2 = self.copy()
-						config2.add_package(pkg_req, pkg, _Configuration.PKGCONN_TRANSITIVE)
-						num = num + 1
-
-			# find common variants that exist in both. Note that this code is somewhat redundant,
-			# v similar work is done in resolve_common_variants - fix this in rez V2
-			variants_e = metafile_e.get_variants()
-			variants_l = metafile_l.get_variants()
-			if (not variants_e) or (not variants_l):
-				continue
-
-			common_pkg_fams = None
-			pkg_vers = {}
-
-			for variant in (variants_e + variants_l):
-				comm_fams = set()
-				for pkgstr in variant:
-					pkgreq = str_to_pkg_req(pkgstr, self.rctxt.memcache)
-					comm_fams.add(pkgreq.name)
-					if pkgreq.name in pkg_vers:
-						pkg_vers[pkgreq.name].append(pkgreq.version)
-					else:
-						pkg_vers[pkgreq.name] = [ pkgreq.version ]
-
-				if (common_pkg_fams == None):
-					common_pkg_fams = comm_fams
-				else:
-					common_pkg_fams &= comm_fams
-
-				if len(common_pkg_fams) == 0:
-					break
-
-			if (common_pkg_fams != None):
-				for pkg_fam in common_pkg_fams:
-					ver_range = VersionRange(str("|").join(pkg_vers[pkg_fam]))
-					v = Version()
-					if len(ver_range.versions) > 0:
-						v.ge = ver_range.versions[0].ge
-						v.lt = ver_range.versions[-1].lt
-						if (v.ge == Version.NEG_INF) and (v.lt != Version.INF):
-							v.ge = [0]
-
-						pkg_req = PackageRequest(pkg_fam, str(v))
-
-						if not config2:
-							config2 = self.copy()
-						config2.add_package(pkg_req, pkg, _Configuration.PKGCONN_TRANSITIVE)
-						num = num + 1
+			for pkg_req in pkg_reqs:
+				if not config2:
+					config2 = self.copy()
+				config2.add_package(pkg_req, pkg, _Configuration.PKGCONN_TRANSITIVE)
+				num = num + 1
 
 		if config2:
 			self.swap(config2)
@@ -1873,7 +3886,9 @@ class _Configuration(object):
 
 		num = 0
 
-		for name,pkg in self.pkgs.iteritems():
+		for name in self.worklist.pop("variant_removal", self.pkgs):
+			pkg = self.pkgs[name]
+			self.rctxt.num_visits += 1
 
 			variants = pkg.get_variants()
 			if variants != None:
@@ -1881,8 +3896,9 @@ class _Configuration(object):
 
 				conflicting_variants = set()
 				for variant in variants:
-					for pkgstr in variant.metadata:
-						pkg_req_ = str_to_pkg_req(pkgstr, self.rctxt.memcache)
+					for pkg_req_, fam, other_fam in variant.deps:
+						if (fam not in self.pkgs) and (other_fam not in self.pkgs):
+							continue
 						pkg_conflicting = self.get_conflicting_package(pkg_req_)
 						if pkg_conflicting:
 							pkg_req_conflicting = pkg_conflicting.as_package_request()
@@ -1916,11 +3932,13 @@ class _Configuration(object):
 							self.dot_graph.append( ( pkg_req_conflicting.short_name(), \
 								( varstr, _Configuration.PKGCONN_CONFLICT ) ) )
 
-						self.rctxt.last_fail_dot_graph = self.get_dot_graph_as_string()
+						self.rctxt.last_fail_dot_graph = self.get_dot_graph()
 						raise PkgConflictError(conflicts)
 					else:
-						for cv in conflicting_variants:
-							variants.remove(cv)
+						pkg = self._own_package(name)
+						pkg.variants = [pkg.variants[i] for i, variant in enumerate(variants) \
+							if variant not in conflicting_variants]
+						self.worklist.push(name, ("common_variants", "single_variants"))
 
 						if (self.rctxt.verbosity == 2):
 							print
@@ -1943,7 +3961,9 @@ class _Configuration(object):
 		num = 0
 		config2 = self.copy()
 
-		for name,pkg in self.pkgs.iteritems():
+		for name in self.worklist.pop("common_variants", self.pkgs):
+			pkg = self.pkgs[name]
+			self.rctxt.num_visits += 1
 
 			variants = pkg.get_variants()
 			if variants != None:
@@ -1953,17 +3973,16 @@ class _Configuration(object):
 				pkgname_versions = {}
 				pkgname_entries = {}
 
-				for variant in variants:
+				for i, variant in enumerate(variants):
 					if (len(variant.working_list) > 0):
 						pkgname_set = set()
-						for pkgstr in variant.working_list:
-							pkg_req = str_to_pkg_req(pkgstr, self.rctxt.memcache)
+						for pkg_req in variant.working_list:
 							pkgname_set.add(pkg_req.name)
 							if not (pkg_req.name in pkgname_versions):
 								pkgname_versions[pkg_req.name] = []
 								pkgname_entries[pkg_req.name] = []
 							pkgname_versions[pkg_req.name].append(pkg_req.version)
-							pkgname_entries[pkg_req.name].append([ variant.working_list, pkgstr ])
+							pkgname_entries[pkg_req.name].append([ i, pkg_req ])
 						pkgname_sets.append(pkgname_set)
 
 				if (len(pkgname_sets) > 0):
@@ -1972,6 +3991,11 @@ class _Configuration(object):
 						common_pkgnames = common_pkgnames.intersection(pkgname_set)
 
 					num += len(common_pkgnames)
+					if common_pkgnames:
+						pkg_own = self._own_package(name, config2)
+						# a variant may be left with an empty working list, and then no
+						# longer counts towards the common families
+						self.worklist.push(name, ("common_variants", "single_variants"))
 
 					# add the union of each common package to the configuration,
 					# and remove the packages from the variants' working lists
@@ -1983,7 +4007,7 @@ class _Configuration(object):
 						config2.add_package(pkg_req_, pkg)
 
 						for entry in pkgname_entries[common_pkgname]:
-							entry[0].remove(entry[1])
+							pkg_own.variants[entry[0]].working_list.remove(entry[1])
 
 						if (self.rctxt.verbosity != 0):
 							print
@@ -2004,7 +4028,9 @@ class _Configuration(object):
 		"""
 
 		num = 0
-		for name,pkg in self.pkgs.iteritems():
+		for name in self.worklist.pop("single_variants", self.pkgs):
+			pkg = self.pkgs[name]
+			self.rctxt.num_visits += 1
 			if pkg.is_resolved():
 				continue
 
@@ -2015,7 +4041,7 @@ class _Configuration(object):
 
 					# check resolved path exists
 					root_path = pkg.base_path + '/' + str('/').join(variant.metadata)
-					if not os.path.isdir(root_path):
+					if not self.rctxt.memcache.is_dir(root_path):
 						pkg_req_ = pkg.as_package_request()
 
 						self.add_dot_graph_verbatim('"' + \
@@ -2024,12 +4050,14 @@ class _Configuration(object):
 						self.add_dot_graph_verbatim('"' + \
 							pkg_req_.short_name() + '" -> "' + \
 							pkg_req_.short_name() + ' NOT FOUND" ;')
-						self.rctxt.last_fail_dot_graph = self.get_dot_graph_as_string()
+						self.rctxt.last_fail_dot_graph = self.get_dot_graph()
 
 						sys.stderr.write("Warning! Package not found: " + str(pkg_req_) + "\n")
 						raise PkgNotFoundError(pkg_req_, root_path)
 
+					pkg = self._own_package(name)
 					pkg.resolve(root_path)
+					self.worklist.num_unresolved -= 1
 					num += 1
 
 					if (self.rctxt.verbosity != 0):
@@ -2091,6 +4119,69 @@ class _Configuration(object):
 ##############################################################################
 
 
+_g_batch_resolve = None
+
+def _get_request_fingerprint(pkg_reqs):
+	"""
+	Return a key which is the same for requests that resolve identically. Request order
+	affects the resolve, so it is kept.
+	"""
+	return tuple(str(x) for x in pkg_reqs)
+
+def _init_resolve_many_process():
+	# the memcached connection belongs to the parent process
+	_g_batch_resolve[0].rctxt.memcache.mc = None
+
+def _resolve_many_process(job):
+	"""
+	Resolve one request in a worker process, see Resolver.resolve_many
+	"""
+	j, pkg_reqs = job
+	resolver, args = _g_batch_resolve
+	try:
+		result = resolver.resolve(pkg_reqs, *args)
+	except (RezError, VersionError), e:
+		result = e
+	return j, result
+
+def dot_graph_to_string(connections):
+	"""
+	Render dot-graph connections (see _Configuration.dot_graph) into a string
+	"""
+	lines = ["digraph g { "]
+	conns = set()
+
+	for connection in connections:
+		if type(connection) == type(""):
+			lines.append(connection)
+		else:
+			if connection not in conns:
+				if connection[1]:
+					dep, conntype = connection[1]
+					if(conntype == _Configuration.PKGCONN_REQUIRES):
+						col = make_random_color_string()
+						conn_style = '[label=needs color="' + col + '" fontcolor="' + col + '"]'
+					elif(conntype == _Configuration.PKGCONN_TRANSITIVE):
+						col = make_random_color_string()
+						conn_style = '[label=willneed color="' + col + '" fontcolor="' + col + '"]'
+					elif(conntype == _Configuration.PKGCONN_RESOLVE):
+						conn_style = '[label=resolve color="green4" fontcolor="green4" style="bold"]'
+					elif(conntype == _Configuration.PKGCONN_REDUCE):
+						conn_style = '[label=reduce color="grey30" fontcolor="grey30" style="dashed"]'
+					elif(conntype == _Configuration.PKGCONN_VARIANT):
+						conn_style = '[label=variant color="grey30" fontcolor="grey30" style="dashed"]'
+					elif(conntype == _Configuration.PKGCONN_CYCLIC):
+						conn_style = '[label=CYCLE color="red" fontcolor="red" fontsize="30" style="bold"]'
+					else:
+						conn_style = '[label=CONFLICT color="red" fontcolor="red" fontsize="30" style="bold"]'
+					lines.append('"' + connection[0] + '" -> "' + dep + '" ' + conn_style + ' ;')
+				else:
+					lines.append('"' + connection[0] + '" ;')
+				conns.add(connection)
+
+	lines.append("}")
+	return '\n'.join(lines) + '\n'
+
 def pkg_to_pkg_req(pkg):
 	"""
 	Helper fn to convert a _Package to a PackageRequest
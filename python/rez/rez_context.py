@@ -0,0 +1,226 @@
+"""
+Structured context files.
+
+A context file holds a resolved environment as data - the request, the resolved packages with
+their roots and metadata, and the rex commands that configure the environment - as json. Tools
+that need to know about an environment load it in one read, rather than parsing env-vars such
+as REZ_RESOLVE. Shell code is generated from the commands when it is first asked for, and cached
+next to the context file, one script per shell. rez-env writes a context file for each
+environment, and points REZ_CONTEXT_DATA at it.
+"""
+import os
+import json
+import tempfile
+import rex
+import rez_metafile
+from rez_exceptions import *
+
+
+# commands that can appear in a context, by name (see rex.Command.name)
+_g_command_classes = dict((x.__name__.lower(), x) for x in (rex.Setenv, rex.Unsetenv,
+    rex.Prependenv, rex.Appendenv, rex.Alias, rex.Info, rex.Error, rex.Comment, rex.Source,
+    rex.Command))
+
+
+class ResolvedContext(object):
+    """
+    A resolved environment, see create_context and load_context.
+    """
+    # only update this if the context format changes
+    CONTEXT_VERSION = 1
+
+    def __init__(self, data, filename=None):
+        if (not isinstance(data, dict)) or \
+                (data.get("context_version") != ResolvedContext.CONTEXT_VERSION):
+            raise PkgSystemError("'%s' is not a version %d context file" % \
+                (filename, ResolvedContext.CONTEXT_VERSION))
+        self.filename = filename
+        self.rez_version = data["rez_version"]
+        self.request = data["request"]
+        self.resolve_mode = data["resolve_mode"]
+        self.request_time = data["request_time"]
+        self.num_fails = data["num_fails"]
+        self.packages = data["packages"]
+        self.commands = [_g_command_classes[x[0]](*x[1:]) for x in data["commands"]]
+
+    def get_resolve(self):
+        """
+        Return the resolved packages, as strings, in the order their commands are run.
+        """
+        return [_short_name(x) for x in self.packages]
+
+    def get_package(self, name):
+        """
+        Return the dict of the resolved package of the given family - its name, version,
+        base, root, timestamp and metadata - or None if the family is not in the resolve.
+        """
+        for pkg in self.packages:
+            if pkg["name"] == name:
+                return pkg
+        return None
+
+    def get_tools(self):
+        """
+        Return a list of (package name, [tools]) for each resolved package that has tools.
+        """
+        return [(x["name"], x["metadata"]["tools"]) for x in self.packages \
+            if x["metadata"].get("tools")]
+
+    def save(self, filename):
+        """
+        Write the context to the given file. Scripts cached for an earlier context of the
+        same name are out of date, and are regenerated when next asked for.
+        """
+        data = {
+            "context_version":  ResolvedContext.CONTEXT_VERSION,
+            "rez_version":      self.rez_version,
+            "request":          self.request,
+            "resolve_mode":     self.resolve_mode,
+            "request_time":     self.request_time,
+            "num_fails":        self.num_fails,
+            "packages":         self.packages,
+            "commands":         [[x.name] + list(x.args) for x in self.commands] }
+
+        # metadata values that json can't represent (such as dates) are written as strings
+        _write_file(filename, json.dumps(data, default=str))
+        self.filename = filename
+
+    def get_script(self, shell):
+        """
+        Return shell code which, when run by the given shell (see rex.shells), configures
+        this environment.
+        """
+        if not self.filename:
+            return rex.interpret(self.commands, shell=shell)
+        with open(self.get_script_file(shell)) as f:
+            return f.read()
+
+    def get_script_file(self, shell):
+        """
+        Return the file of shell code for the given shell, generating it first if it is not
+        cached, or is older than the context file. The context must have been saved.
+        """
+        if not self.filename:
+            raise PkgSystemError("the context has not been saved")
+        script_file = get_script_filename(self.filename, shell)
+        try:
+            if os.path.getmtime(script_file) >= os.path.getmtime(self.filename):
+                return script_file
+        except OSError:
+            pass
+
+        _write_file(script_file, rex.interpret(self.commands, shell=shell) + '\n')
+        return script_file
+
+    def apply(self, environ=None):
+        """
+        Configure the environment in this python session, or the given environ dict,
+        and return it.
+        """
+        return rex.Python(environ=environ)._execute(self.commands)
+
+
+def create_context(request, result, resolve_mode, request_time):
+    """
+    Create a ResolvedContext from the result of Resolver.resolve. 'request' is the resolved
+    request, as a list of strings, including the OS package if it was requested.
+    """
+    pkg_res_list, commands, dot_graph, num_fails = result
+    packages = []
+    for pkg_res in pkg_res_list:
+        metadict = _get_metadict(pkg_res.metadata)
+        packages.append({
+            "name":         pkg_res.name,
+            "version":      pkg_res.version,
+            "base":         pkg_res.base,
+            "root":         pkg_res.root,
+            "timestamp":    pkg_res.timestamp,
+            "metadata":     metadict })
+
+    return ResolvedContext({
+        "context_version":  ResolvedContext.CONTEXT_VERSION,
+        "rez_version":      os.getenv("REZ_VERSION"),
+        "request":          list(request),
+        "resolve_mode":     resolve_mode,
+        "request_time":     request_time,
+        "num_fails":        num_fails,
+        "packages":         packages,
+        "commands":         [[x.name] + list(x.args) for x in commands] })
+
+
+def load_context(filename):
+    """
+    Load a ResolvedContext from a file written by ResolvedContext.save.
+    """
+    with open(filename) as f:
+        data = json.load(f)
+    return ResolvedContext(data, filename)
+
+
+def get_script_filename(filename, shell):
+    """
+    Return the file that shell code for the context file 'filename' is cached in.
+    """
+    return os.path.splitext(filename)[0] + '.' + os.path.basename(shell)
+
+
+def _get_metadict(metadata):
+    """
+    Return the full contents of a resolved package's metafile, less its commands, which are
+    already in the context's commands. The resolver's metadata views leave out fields it
+    doesn't need (such as description and help), so the metafile is loaded again. Overlay
+    packages have no metafile, and only their view's contents are available.
+    """
+    if not metadata:
+        return {}
+    if isinstance(metadata, rez_metafile.ConfigMetadataView) and \
+            os.path.isfile(metadata.filename):
+        metadict = rez_metafile.load_metadict(metadata.filename) or {}
+    else:
+        metadict = metadata.metadict
+    metadict = dict(metadict)
+    metadict.pop("commands", None)
+    return metadict
+
+
+def _short_name(pkg):
+    if pkg["version"]:
+        return pkg["name"] + '-' + pkg["version"]
+    return pkg["name"]
+
+
+def _write_file(filename, s):
+    # written to a temp file first, so that a reader never sees a partial file
+    if isinstance(s, unicode):
+        s = s.encode("utf-8")
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                   prefix=".tmp-" + os.path.basename(filename))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(s)
+        # mkstemp files are private, give the file the permissions open() would have
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmpfile, 0666 & ~umask)
+        os.rename(tmpfile, filename)
+    except:
+        os.remove(tmpfile)
+        raise
+
+
+#    Copyright 2008-2012 Dr D Studios Pty Limited (ACN 127 184 954) (Dr. D Studios)
+#
+#    This file is part of Rez.
+#
+#    Rez is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Rez is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Rez.  If not, see <http://www.gnu.org/licenses/>.
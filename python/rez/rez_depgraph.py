@@ -0,0 +1,221 @@
+"""
+A directed dependency graph, with typed edges. Used by the resolver to order the packages
+of a resolve and to detect cyclic dependencies between them, and by rez-depends.
+
+An edge (a, b) means 'a depends on b'. Nodes are kept in the order they were first added,
+and this order is used to break ties, so that results do not depend on hashing.
+"""
+import heapq
+
+
+class DependencyGraph(object):
+    """
+    A directed graph of hashable nodes. Each edge has a type (any hashable value), so that
+    one graph can hold several kinds of connection, and algorithms can be restricted to
+    some of them.
+    """
+    def __init__(self):
+        self.nodes = []
+        self.index = {}
+        self.edges = {}     # node -> {child: set of edge types}
+
+    def add_node(self, node):
+        """
+        add a node, if it doesn't already exist
+        """
+        if node not in self.index:
+            self.index[node] = len(self.nodes)
+            self.nodes.append(node)
+            self.edges[node] = {}
+
+    def add_edge(self, node1, node2, edge_type=None):
+        """
+        add an edge of the given type from node1 to node2 (node1 depends on node2),
+        adding the nodes if they don't already exist
+        """
+        self.add_node(node1)
+        self.add_node(node2)
+        children = self.edges[node1]
+        if node2 in children:
+            children[node2].add(edge_type)
+        else:
+            children[node2] = set([edge_type])
+
+    def has_node(self, node):
+        return (node in self.index)
+
+    def get_children(self, node, edge_types=None):
+        """
+        return the nodes that 'node' depends on, in the order they were added to the graph.
+        If edge_types is given, only edges of those types are followed.
+        """
+        children = [x for x, types in self.edges[node].iteritems() \
+            if (edge_types is None) or (not types.isdisjoint(edge_types))]
+        children.sort(key=self.index.get)
+        return children
+
+    def get_edges(self, edge_types=None):
+        """
+        return a list of (node1, node2) edges, optionally only those of the given types
+        """
+        return [(x, y) for x in self.nodes for y in self.get_children(x, edge_types)]
+
+    def get_ordered_nodes(self, edge_types=None):
+        """
+        Return the nodes in an order where each node appears after all the nodes it depends
+        on (Kahn's algorithm). Where there is a choice, the node that was added to the graph
+        first comes first. Nodes that are part of, or depend on, a cycle cannot be ordered -
+        these are appended at the end, in the order they were added.
+        """
+        children = dict((x, self.get_children(x, edge_types)) for x in self.nodes)
+        parents = dict((x, []) for x in self.nodes)
+        num_deps = {}
+        for node in self.nodes:
+            num_deps[node] = len(children[node])
+            for child in children[node]:
+                parents[child].append(node)
+
+        ready = [self.index[x] for x in self.nodes if num_deps[x] == 0]
+        heapq.heapify(ready)
+
+        ordered = []
+        done = set()
+        while ready:
+            node = self.nodes[heapq.heappop(ready)]
+            ordered.append(node)
+            done.add(node)
+            for parent in parents[node]:
+                num_deps[parent] -= 1
+                if num_deps[parent] == 0:
+                    heapq.heappush(ready, self.index[parent])
+
+        if len(ordered) < len(self.nodes):
+            ordered += [x for x in self.nodes if x not in done]
+        return ordered
+
+    def get_strongly_connected_components(self, edge_types=None):
+        """
+        Return the strongly connected components of the graph (Tarjan's algorithm), as a
+        list of lists of nodes. Components appear in dependency order - a component comes
+        after every component it depends on.
+        """
+        children = dict((x, self.get_children(x, edge_types)) for x in self.nodes)
+        indices = {}
+        lowlinks = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        for root in self.nodes:
+            if root in indices:
+                continue
+
+            # iterative depth-first search, so that deep graphs don't hit the recursion limit
+            indices[root] = lowlinks[root] = len(indices)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(children[root]))]
+
+            while work:
+                node, it = work[-1]
+                child = next(it, None)
+                if child is not None:
+                    if child not in indices:
+                        indices[child] = lowlinks[child] = len(indices)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(children[child])))
+                    elif child in on_stack:
+                        lowlinks[node] = min(lowlinks[node], indices[child])
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+
+                if lowlinks[node] == indices[node]:
+                    component = []
+                    while True:
+                        node2 = stack.pop()
+                        on_stack.remove(node2)
+                        component.append(node2)
+                        if node2 == node:
+                            break
+                    component.sort(key=self.index.get)
+                    components.append(component)
+
+        return components
+
+    def get_cycles(self, edge_types=None):
+        """
+        Return the strongly connected components that contain a cycle, ie those with more
+        than one node, or a single node that depends on itself.
+        """
+        cycles = []
+        for component in self.get_strongly_connected_components(edge_types):
+            if (len(component) > 1) or \
+                    (component[0] in self.get_children(component[0], edge_types)):
+                cycles.append(component)
+        return cycles
+
+    def get_cycle_edges(self, edge_types=None):
+        """
+        Return the edges that are part of a cycle, as a set of (node1, node2) pairs
+        """
+        edges = set()
+        for component in self.get_cycles(edge_types):
+            nodes = set(component)
+            for node in component:
+                for child in self.get_children(node, edge_types):
+                    if child in nodes:
+                        edges.add((node, child))
+        return edges
+
+    def find_cycle(self, component, edge_types=None):
+        """
+        Given a cyclic component (see get_cycles), return the shortest cycle within it
+        that passes through its first node, as a list of nodes that starts and ends with
+        that node.
+        """
+        nodes = set(component)
+        start = component[0]
+        prev = {}
+        queue = [start]
+        i = 0
+        while i < len(queue):
+            node = queue[i]
+            i += 1
+            for child in self.get_children(node, edge_types):
+                if child not in nodes:
+                    continue
+                if child == start:
+                    cycle = [start]
+                    while node != start:
+                        cycle.append(node)
+                        node = prev[node]
+                    cycle.append(start)
+                    cycle.reverse()
+                    return cycle
+                if child not in prev:
+                    prev[child] = node
+                    queue.append(child)
+        return []
+
+
+#    Copyright 2008-2012 Dr D Studios Pty Limited (ACN 127 184 954) (Dr. D Studios)
+#
+#    This file is part of Rez.
+#
+#    Rez is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Rez is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Rez.  If not, see <http://www.gnu.org/licenses/>.
@@ -95,6 +95,27 @@ class PkgConfigNotResolvedError(RezError):
         return str(strs)
 
 
+class PkgResolveBudgetError(RezError):
+    """
+    A resolve was abandoned because it exceeded one of its budgets (see Resolver). 'budget'
+    is the name of the budget ('time', 'configs', 'fs_ops' or 'memory'), 'limit' is its
+    limit and 'value' the amount used. 'fail_config_list' and 'last_dot_graph' are the
+    failed configuration attempts and the last dot-graph, up to the point the resolve stopped.
+    """
+    def __init__(self, budget=None, limit=None, value=None, pkg_reqs=None,
+                 fail_config_list=None, last_dot_graph=None):
+        RezError.__init__(self)
+        self.budget = budget
+        self.limit = limit
+        self.value = value
+        self.pkg_reqs = pkg_reqs
+        self.fail_config_list = fail_config_list
+        self.last_dot_graph = last_dot_graph
+    def __str__(self):
+        return "resolve exceeded its %s budget (limit %s, used %s)" % \
+            (self.budget, self.limit, self.value)
+
+
 class PkgCommandError(RezError):
     """
     There is an error in a command or list of commands
@@ -127,6 +148,18 @@ class PkgCyclicDependency(RezError):
         return s
 
 
+class PkgLockError(RezError):
+    """
+    An environment could not be built from a lock file, because a locked package is missing
+    or has changed since the lock was written
+    """
+    def __init__(self, pkg_name=None, value=None):
+        RezError.__init__(self, value)
+        self.pkg_name = pkg_name
+    def __str__(self):
+        return "%s: %s" % (self.pkg_name, str(self.value))
+
+
 
 
 
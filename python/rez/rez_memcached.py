@@ -1,6 +1,10 @@
 import sys
 import os
 import time
+import errno
+import imp
+import marshal
+import binascii
 from collections import defaultdict
 import rez_filesys
 import rez_metafile
@@ -26,6 +30,15 @@ def print_cache_warning(msg):
 def _filter_epoch(vers, cache):
     return [x for x in vers if x[1] <= cache.epoch]
 
+def _load_code(data, cache):
+    return marshal.loads(data)
+
+# the cached_path data that is recorded, see RezMemCache.start_recording
+_g_recorded_keys = ("VERSIONS", "PKGYAML", "FAMPKGYAML")
+
+# marshalled bytecode is specific to the python version, so the magic number is part of the key
+_g_code_cache_key = "PKGCODE-" + binascii.hexlify(imp.get_magic())
+
 # init
 _g_caching_enabled = not os.getenv("REZ_DISABLE_CACHING")
 if _g_caching_enabled:
@@ -40,7 +53,7 @@ if _g_caching_enabled:
         _g_caching_enabled = False
     mc = None
 
-def cached_path(key, default=None, postfilter=None):
+def cached_path(key, default=None, postfilter=None, keep_unfiltered=False):
     """
     A decorator to aid in automatically caching functions
 
@@ -49,6 +62,8 @@ def cached_path(key, default=None, postfilter=None):
     postfilter : filter function to apply to after retrieving data from the memcache client.
         should take the data and an instance of the memcache as arguments and
         return a modified copy of data.
+    keep_unfiltered : if True, the data is also cached before the postfilter is applied, so
+        that it can be filtered again later (see RezMemCache.set_epoch).
     """
     def decorator(func):
         def wrapped_func(self, path, *args, **kwargs):
@@ -59,10 +74,13 @@ def cached_path(key, default=None, postfilter=None):
             # FIXME: allow None to be cached.
             data = cache.get(path)
             if data is not None:
+                if self.recording is not None:
+                    self._record(key, path, self.unfiltered[key].get(path, data))
                 return data
  
+            self.num_fs_ops += 1
             try:
-                path_modtime = os.path.getmtime(path)
+                path_modtime = self._get_mtime(key, path)
             except OSError:
                 if default is not None:
                     return default
@@ -80,6 +98,7 @@ def cached_path(key, default=None, postfilter=None):
 
             if not data:
                 # get data
+                self.num_fs_ops += 1
                 data = func(self, path, *args, **kwargs)
 
             assert data is not None, "Cached function must not return None"
@@ -88,6 +107,10 @@ def cached_path(key, default=None, postfilter=None):
             if self.mc:
                 self.mc.set(k, (path_modtime, data))
 
+            if keep_unfiltered:
+                self.unfiltered[key][path] = data
+            if self.recording is not None:
+                self._record(key, path, data)
             if postfilter:
                 data = postfilter(data, self)
             
@@ -101,6 +124,54 @@ def cached_path(key, default=None, postfilter=None):
         return wrapped_func
     return decorator
 
+# the root that overlay packages appear under, see RezMemCache.set_overlay. There is nothing
+# on disk at this path.
+OVERLAY_PATH = "<overlay>"
+
+class PackageOverlay(object):
+    """
+    A set of hypothetical packages, which are resolved as though they had been released, but
+    exist only in memory. Each package is given as the contents of its package.yaml, with an
+    optional 'timestamp' entry for its release time (default 0). See RezMemCache.set_overlay.
+    """
+    def __init__(self, packages=None):
+        # family name -> list of (Version, timestamp, metadict)
+        self.families = {}
+        for metadict in (packages or []):
+            self.add_package(metadict)
+
+    def add_package(self, metadict):
+        if not isinstance(metadict, dict):
+            raise PkgSystemError("overlay package is not a dictionary: " + str(metadict))
+        metadict = dict(metadict)
+        name = metadict.get("name")
+        version = metadict.get("version")
+        if (not name) or (version is None):
+            raise PkgSystemError("overlay package is missing a name or version: " + \
+                str(metadict))
+        metadict["name"] = str(name)
+        metadict["version"] = str(version)
+        metadict.setdefault("config_version", 0)
+        timestamp = int(metadict.pop("timestamp", 0))
+
+        entries = self.families.setdefault(metadict["name"], [])
+        ver = Version(metadict["version"])
+        if [x for x in entries if x[0] == ver]:
+            raise PkgSystemError("overlay package %s-%s is given more than once" % \
+                (metadict["name"], metadict["version"]))
+        entries.append((ver, timestamp, metadict))
+
+def load_package_overlay(filename):
+    """
+    Load a PackageOverlay from a yaml file, which holds a list of packages.
+    """
+    packages = rez_metafile.load_metadict(filename)
+    if packages is None:
+        packages = []
+    if not isinstance(packages, list):
+        raise PkgSystemError("overlay file '%s' does not contain a list of packages" % filename)
+    return PackageOverlay(packages)
+
 class RezMemCache(object):
     """
     Cache for filesystem access and resolves.
@@ -108,12 +179,188 @@ class RezMemCache(object):
     def __init__(self, time_epoch=0, use_caching=True):
         self.epoch = time_epoch or int(time.time())
         self.cache = defaultdict(dict)
+        # data as it was before being filtered by epoch, see cached_path
+        self.unfiltered = defaultdict(dict)
         self.families = set()
+        self.overlay = None
+        # package paths to search in place of rez_filesys._g_syspaths, see set_package_paths
+        self.package_paths = None
+        # answers recorded so far, see start_recording
+        self.recording = None
+        # path existence answers being replayed, see replay
+        self.replay_answers = None
+        # number of filesystem lookups made, this is used by the resolver's fs_ops budget
+        self.num_fs_ops = 0
         self.mc = None
         if use_caching and _g_caching_enabled:
             mc = _create_client()
             self.mc = MemCacheClient(mc)
 
+    def set_epoch(self, time_epoch=0):
+        """
+        Change the time epoch, so that packages newer than this are ignored from now on.
+        Everything already read is kept - version listings are just filtered again, and
+        requests that were bound to a version are parsed again.
+        """
+        self.epoch = time_epoch or int(time.time())
+        cache = self.cache["VERSIONS"]
+        for path, vers in self.unfiltered["VERSIONS"].iteritems():
+            cache[path] = _filter_epoch(vers, self)
+        self._drop_bound_requests()
+
+    def _drop_bound_requests(self):
+        # requests such as 'foo=l' are bound to the latest (or earliest) version when they
+        # are parsed (see rez_config.get_parsed_pkg_req), so they depend on the epoch and the
+        # overlay. Package requirements are re-read from the parsed requests when next asked for
+        cache = self.cache["PKGREQ"]
+        for str_ in [x for x in cache if x.endswith("=l") or x.endswith("=e")]:
+            del cache[str_]
+        self.cache["PKGREQS"].clear()
+
+    def set_overlay(self, overlay):
+        """
+        Add the packages of a PackageOverlay (or None) to those found on disk. Overlay packages
+        are found under OVERLAY_PATH, ahead of the package paths, so they take the place of
+        any released package of the same version. Replaces any previous overlay. Nothing else
+        in the cache is dropped, so families that are not in the overlay stay warm.
+        """
+        if self.overlay:
+            for family_name, entries in self.overlay.families.iteritems():
+                family_path = os.path.join(OVERLAY_PATH, family_name)
+                self.cache["VERSIONS"].pop(family_path, None)
+                self.unfiltered["VERSIONS"].pop(family_path, None)
+                for ver, timestamp, metadict in entries:
+                    metafile = os.path.join(family_path, str(ver), PKG_METADATA_FILENAME)
+                    self.cache["PKGYAML"].pop(metafile, None)
+                    self.cache[_g_code_cache_key].pop(metafile, None)
+
+        self.overlay = overlay
+        self._drop_bound_requests()
+        if not overlay:
+            return
+
+        for family_name, entries in overlay.families.iteritems():
+            family_path = os.path.join(OVERLAY_PATH, family_name)
+            vers = sorted((ver, timestamp) for ver, timestamp, metadict in entries)
+            self.unfiltered["VERSIONS"][family_path] = vers
+            self.cache["VERSIONS"][family_path] = _filter_epoch(vers, self)
+            for ver, timestamp, metadict in entries:
+                metafile = os.path.join(family_path, str(ver), PKG_METADATA_FILENAME)
+                metadata = rez_metafile.ConfigMetadataView(metafile, dict(metadict))
+                self.cache["PKGYAML"][metafile] = metadata
+                commands = metadata.get_commands()
+                if isinstance(commands, basestring):
+                    try:
+                        code = compile(commands, metafile, 'exec')
+                    except (SyntaxError, TypeError), e:
+                        raise PkgSystemError("overlay package %s-%s has invalid commands: %s" \
+                            % (family_name, ver, str(e)))
+                    self.cache[_g_code_cache_key][metafile] = code
+
+    def is_overlay_path(self, path):
+        """
+        Return True if the given path is that of an overlay package, which is not on disk.
+        """
+        return bool(self.overlay) and path.startswith(OVERLAY_PATH + os.sep)
+
+    def set_package_paths(self, paths):
+        """
+        Search the given package paths (or None) in place of those in REZ_PACKAGES_PATH.
+        """
+        self.package_paths = list(paths) if paths else None
+
+    def start_recording(self):
+        """
+        Record every answer given from now on - version listings, metafiles, and whether
+        files and directories exist - so that they can be replayed, see get_recording.
+        Answers that come from the local cache are recorded too.
+        """
+        self.recording = {"isfile": {}, "isdir": {}}
+        for key in _g_recorded_keys:
+            self.recording[key] = {}
+
+    def get_recording(self):
+        """
+        Stop recording, and return the recorded answers as plain data, suitable for yaml.
+        """
+        rec = self.recording
+        self.recording = None
+        return {
+            "paths":            list(self._get_package_paths(None, None, False)),
+            "versions":         dict((path, [[str(ver), timestamp] for ver, timestamp in vers]) \
+                                for path, vers in rec["VERSIONS"].iteritems()),
+            "metafiles":        dict((path, dict(metadata.metadict)) \
+                                for path, metadata in rec["PKGYAML"].iteritems()),
+            "family_metafiles": dict((path, dict(metadata.metadict)) \
+                                for path, metadata in rec["FAMPKGYAML"].iteritems()),
+            "isfile":           rec["isfile"],
+            "isdir":            rec["isdir"] }
+
+    def replay(self, recording):
+        """
+        Answer only from the given recording (see get_recording), in place of the package
+        paths. Anything that was not recorded does not exist. Everything already cached is
+        dropped, and memcached is no longer used.
+        """
+        self.mc = None
+        self.cache = defaultdict(dict)
+        self.unfiltered = defaultdict(dict)
+        self.families = set()
+        self.set_package_paths(recording["paths"])
+        self.replay_answers = {"isfile": dict(recording["isfile"]),
+                               "isdir": dict(recording["isdir"])}
+
+        for path, vers in recording["versions"].iteritems():
+            vers = [(Version(ver), timestamp) for ver, timestamp in vers]
+            self.unfiltered["VERSIONS"][path] = vers
+            self.cache["VERSIONS"][path] = _filter_epoch(vers, self)
+        for path, metadict in recording["metafiles"].iteritems():
+            self.cache["PKGYAML"][path] = rez_metafile.ConfigMetadataView(path, metadict)
+        for path, metadict in recording["family_metafiles"].iteritems():
+            self.cache["FAMPKGYAML"][path] = rez_metafile.FamilyMetadata(path, metadict)
+
+    def _record(self, key, path, data):
+        if (key in _g_recorded_keys) and (not self.is_overlay_path(path)):
+            self.recording[key][path] = data
+
+    def _get_mtime(self, key, path):
+        if self.replay_answers is None:
+            return os.path.getmtime(path)
+        if key in _g_recorded_keys:
+            # recorded data is already in the local cache
+            raise OSError(errno.ENOENT, "not in the replayed recording", path)
+        # data derived from recorded data, such as compiled commands
+        return 0
+
+    def _check_path(self, path, test, answer_key):
+        if self.replay_answers is not None:
+            return self.replay_answers[answer_key].get(path, False)
+        result = test(path)
+        if (self.recording is not None) and (not self.is_overlay_path(path)):
+            self.recording[answer_key][path] = result
+        return result
+
+    def is_file(self, path):
+        """
+        Return True if the given file exists.
+        """
+        return self._check_path(path, os.path.isfile, "isfile")
+
+    def is_dir(self, path):
+        """
+        Return True if the given directory exists. Overlay package paths always exist.
+        """
+        if self.is_overlay_path(path):
+            return True
+        return self._check_path(path, os.path.isdir, "isdir")
+
+    def _get_package_paths(self, family_name, paths, include_overlay=True):
+        if paths is None:
+            paths = self.package_paths or rez_filesys._g_syspaths
+            if include_overlay and self.overlay and (family_name in self.overlay.families):
+                paths = [OVERLAY_PATH] + paths
+        return paths
+
     def caching_enabled(self):
         """
         whether the memcache client is being used
@@ -132,13 +379,22 @@ class RezMemCache(object):
     @cached_path("PKGYAML")
     def get_metafile(self, path):
         """
-        Load the yaml metadata in the given file.
+        Load the yaml metadata in the given file. Fields are decoded as the resolver asks
+        for them, see rez_metafile.ConfigMetadataView.
         """
-        d = rez_metafile.ConfigMetadata(path)
-        d.delete_nonessentials()
-        return d
+        return rez_metafile.ConfigMetadataView(path)
+
+    @cached_path(_g_code_cache_key, postfilter=_load_code)
+    def get_commands_code(self, path):
+        """
+        Compile the python commands in the given metafile, and return the code object. The
+        marshalled bytecode is what gets cached. Raises SyntaxError or TypeError if the
+        commands do not compile.
+        """
+        commands = self.get_metafile(path).get_commands()
+        return marshal.dumps(compile(commands, path, 'exec'))
 
-    @cached_path("VERSIONS", default=(), postfilter=_filter_epoch)
+    @cached_path("VERSIONS", default=(), postfilter=_filter_epoch, keep_unfiltered=True)
     def get_versions_in_directory(self, path, warnings=True):
         """
         For a given directory, return a list of (Version,epoch), which match version directories 
@@ -156,8 +412,10 @@ class RezMemCache(object):
         # check for special case - unversioned package
         # todo subtle bug here, unversioned pkg's timestamp not taken into account. In practice
         # though this should not cause any problems.
-        if not vers and ver_range.is_any() and os.path.isfile(os.path.join(path, PKG_METADATA_FILENAME)):
-            return (Version(""), 0)
+        if not vers and ver_range.is_any():
+            self.num_fs_ops += 1
+            if self.is_file(os.path.join(path, PKG_METADATA_FILENAME)):
+                return (Version(""), 0)
 
         if not ver_range.is_inexact():
             exact_ver = [x for x in vers if x[0] == ver_range.versions[0]]
@@ -177,13 +435,13 @@ class RezMemCache(object):
         return None
 
     def get_family_package(self, family_name, paths=None):
-        if paths is None:
-            paths = rez_filesys._g_syspaths
+        paths = self._get_package_paths(family_name, paths, False)
 
         for pkg_path in paths:
             family_path = os.path.join(pkg_path, family_name)
             family_package = os.path.join(family_path, PKG_METADATA_FILENAME)
-            if os.path.isfile(family_package):
+            self.num_fs_ops += 1
+            if self.is_file(family_package):
                 return family_package
 
     def iter_packages(self, family_name, paths=None):
@@ -191,8 +449,7 @@ class RezMemCache(object):
         Given a family name and a `VersionRange`, iterate through
         (family path, resolved `Version`, epoch) for all versions found.
         """
-        if paths is None:
-            paths = rez_filesys._g_syspaths
+        paths = self._get_package_paths(family_name, paths)
 
         for pkg_path in paths:
             family_path = os.path.join(pkg_path, family_name)
@@ -200,10 +457,12 @@ class RezMemCache(object):
             if vers:
                 for ver, timestamp in vers:
                     yield family_path, ver, timestamp
-            elif os.path.isfile(os.path.join(family_path, PKG_METADATA_FILENAME)):
+            else:
                 # check for special case - unversioned package.
                 # only allowed when no versioned packages exist.
-                yield family_path, Version(""), 0
+                self.num_fs_ops += 1
+                if self.is_file(os.path.join(family_path, PKG_METADATA_FILENAME)):
+                    yield family_path, Version(""), 0
 
     def find_package_in_range(self, family_name, ver_range, latest=True, exact=False,
                     paths=None):
@@ -257,8 +516,10 @@ class RezMemCache(object):
         # check for special case - unversioned package
         # todo subtle bug here, unversioned pkg's timestamp not taken into account. In practice
         # though this should not cause any problems.
-        if not vers and ver_range.is_any() and os.path.isfile(os.path.join(path, PKG_METADATA_FILENAME)):
-            return (Version(""), 0)
+        if not vers and ver_range.is_any():
+            self.num_fs_ops += 1
+            if self.is_file(os.path.join(path, PKG_METADATA_FILENAME)):
+                return (Version(""), 0)
 
         if not ver_range.is_inexact():
             exact_ver = [x for x in vers if x[0] == ver_range.versions[0]]
@@ -323,12 +584,14 @@ class RezMemCache(object):
         """
         if family_name in self.families:
             return True
+        if self.overlay and (family_name in self.overlay.families):
+            return True
 
-        if paths is None:
-            paths = rez_filesys._g_syspaths
+        paths = self._get_package_paths(family_name, paths, False)
 
         for path in paths:
-            if os.path.isdir(os.path.join(path, family_name)):
+            self.num_fs_ops += 1
+            if self.is_dir(os.path.join(path, family_name)):
                 self.families.add(family_name)
                 return True
 
@@ -336,9 +599,10 @@ class RezMemCache(object):
 
     def store_resolve(self, paths, pkg_reqs, result):
         """
-        Store a resolve in the cache.
+        Store a resolve in the cache. Resolves against an overlay, or that are being
+        recorded, are not stored.
         """
-        if not self.mc:
+        if (not self.mc) or self.overlay or (self.recording is not None):
             return
 
         pkg_res_list = result[0]
@@ -369,7 +633,7 @@ class RezMemCache(object):
         """
         Return a cached resolve, or None if the resolve is not found or possibly stale.
         """
-        if not self.mc:
+        if (not self.mc) or self.overlay or (self.recording is not None):
             return None,None
 
         k_base = (paths, pkg_reqs)
@@ -3,9 +3,23 @@ Class for loading and verifying rez metafiles
 """
 
 import yaml
+import marshal
 import subprocess
 import os
 
+# use the libyaml-based loader where available, it is much faster than the pure-python one
+try:
+	from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+	from yaml import SafeLoader as _YamlLoader
+
+# precompiled metadata sidecar. This is written at release time into the package's .metadata
+# dir, and holds the parsed contents of the package.yaml in marshal format. Only update the
+# version if the sidecar format changes.
+METADATA_SIDECAR_DIR = ".metadata"
+METADATA_SIDECAR_SUFFIX = ".marshal"
+METADATA_SIDECAR_VERSION = 1
+
 
 class ConfigMetadataError(Exception):
 	def __init__(self, value):
@@ -13,6 +27,68 @@ class ConfigMetadataError(Exception):
 	def __str__(self):
 		return str(self.value)
 
+def get_metadict_sidecar_path(filename):
+	"""
+	Return the path of the precompiled sidecar for the given metafile.
+	"""
+	dirpath, name = os.path.split(filename)
+	return os.path.join(dirpath, METADATA_SIDECAR_DIR, name + METADATA_SIDECAR_SUFFIX)
+
+def _parse_metafile(filename):
+	with open(filename) as f:
+		return yaml.load(f.read(), Loader=_YamlLoader)
+
+def _read_metadict_sidecar(filename, st):
+	"""
+	Return the metadata stored in the sidecar of the given metafile, or None if there is no
+	sidecar, or it is stale (the metafile's mtime or size has changed since it was written).
+	"""
+	try:
+		with open(get_metadict_sidecar_path(filename), 'rb') as f:
+			version, mtime, size, metadict = marshal.loads(f.read())
+	except (IOError, OSError, EOFError, ValueError, TypeError):
+		return None
+
+	if (version != METADATA_SIDECAR_VERSION) or (mtime != st.st_mtime) or (size != st.st_size):
+		return None
+	return metadict
+
+def load_metadict(filename):
+	"""
+	Load the contents of the given metafile. A valid precompiled sidecar is read in preference
+	to parsing the yaml.
+	"""
+	metadict = _read_metadict_sidecar(filename, os.stat(filename))
+	if metadict is None:
+		metadict = _parse_metafile(filename)
+	return metadict
+
+def write_metadict_sidecar(filename):
+	"""
+	Write a precompiled sidecar for the given metafile, so that later loads can skip yaml
+	parsing. Returns the sidecar path, or None if the metafile contains data that cannot be
+	stored in the sidecar (in which case the yaml is always parsed).
+	"""
+	st = os.stat(filename)
+	metadict = _parse_metafile(filename)
+	try:
+		data = marshal.dumps((METADATA_SIDECAR_VERSION, st.st_mtime, st.st_size, metadict))
+	except ValueError:
+		return None
+
+	sidecar = get_metadict_sidecar_path(filename)
+	sidecar_dir = os.path.dirname(sidecar)
+	if not os.path.isdir(sidecar_dir):
+		os.makedirs(sidecar_dir)
+
+	# write then rename, so a concurrent reader never sees a partial file
+	tmpfile = "%s.%d.tmp" % (sidecar, os.getpid())
+	with open(tmpfile, 'wb') as f:
+		f.write(data)
+	os.rename(tmpfile, sidecar)
+	return sidecar
+
+
 class _BaseMetadata(object):
 	"""
 	metafile. An incorrectly-formatted file will result in either a yaml exception (if
@@ -20,11 +96,12 @@ class _BaseMetadata(object):
 	metafile is acceptable, and is supported for fast integration of 3rd-party packages
 	"""
 
-	def __init__(self, filename):
+	def __init__(self, filename, metadict=None):
 		self.filename = filename
 
-		with open(filename) as f:
-			self.metadict = yaml.load(f.read()) or {}
+		if metadict is None:
+			metadict = load_metadict(filename)
+		self.metadict = metadict or {}
 
 	def _get_list(self, label, subtype=None, required=False):
 		value = self.metadict.get(label)
@@ -79,8 +156,8 @@ class ConfigMetadata(_BaseMetadata):
 	# format in a way that is not backwards compatible
 	METAFILE_VERSION = 0
 
-	def __init__(self, filename):
-		super(ConfigMetadata, self).__init__(filename)
+	def __init__(self, filename, metadict=None):
+		super(ConfigMetadata, self).__init__(filename, metadict)
 		# set defaults
 		self.uuid = None
 		self.authors = None
@@ -227,9 +304,108 @@ class ConfigMetadata(_BaseMetadata):
 			# allow use of yaml multi-line strings
 			self.commands = self._get_str("commands")
 
+class _lazy_field(object):
+	"""
+	Non-data descriptor which decodes a metadata field on first access, and then stores it
+	on the instance so that later accesses are plain attribute lookups.
+	"""
+	def __init__(self, decode):
+		self.decode = decode
+		self.name = decode.__name__
+
+	def __get__(self, obj, cls):
+		if obj is None:
+			return self
+		value = self.decode(obj)
+		obj.__dict__[self.name] = value
+		return value
+
+class _reloaded_field(object):
+	"""
+	Descriptor for a field that is not kept in memory. It is read from the metafile again
+	each time it is accessed.
+	"""
+	def __init__(self, name):
+		self.name = name
+
+	def __get__(self, obj, cls):
+		if obj is None:
+			return self
+		return getattr(ConfigMetadata(obj.filename), self.name)
+
+	def __set__(self, obj, value):
+		raise AttributeError("'%s' is read-only in a metadata view" % self.name)
+
+class ConfigMetadataView(ConfigMetadata):
+	"""
+	A lazily-decoded view of a package metafile, as used by the resolver. Only the root node
+	and config_version are validated up front; each other field is decoded and validated the
+	first time it is accessed. Nonessential fields (uuid, description, help, authors) are not
+	held in memory at all - they are read from the metafile again if asked for. If metadict
+	is given, it is used in place of the metafile's contents, and the file is never read.
+	"""
+	NONESSENTIALS = ("uuid", "description", "help", "authors")
+
+	uuid			= _reloaded_field("uuid")
+	description		= _reloaded_field("description")
+	help			= _reloaded_field("help")
+	authors			= _reloaded_field("authors")
+
+	def __init__(self, filename, metadict=None):
+		_BaseMetadata.__init__(self, filename, metadict)
+		self.config_version = ConfigMetadata.METAFILE_VERSION
+
+		if self.metadict:
+			if not isinstance(self.metadict, dict):
+				raise ConfigMetadataError("package metafile '" + self.filename + \
+					"' contains non-dictionary root node")
+
+			self.config_version = self._get_int("config_version",
+												required=True)
+
+			if (self.config_version < 0) or (self.config_version > ConfigMetadata.METAFILE_VERSION):
+				raise ConfigMetadataError("package metafile '" + self.filename + \
+					"' contains invalid config version '" + str(self.config_version) + "'")
+
+			self.delete_nonessentials()
+
+	def delete_nonessentials(self):
+		for label in ConfigMetadataView.NONESSENTIALS:
+			self.metadict.pop(label, None)
+
+	# each of these is decoded the first time it is accessed, see _lazy_field
+
+	@_lazy_field
+	def version(self):
+		return self._get_str("version")
+
+	@_lazy_field
+	def name(self):
+		return self._get_str("name")
+
+	@_lazy_field
+	def requires(self):
+		return self._get_list("requires", subtype=str)
+
+	@_lazy_field
+	def build_requires(self):
+		return self._get_list("build_requires", subtype=str)
+
+	@_lazy_field
+	def variants(self):
+		return self._get_list("variants", subtype=list)
+
+	@_lazy_field
+	def commands(self):
+		try:
+			return self._get_list("commands", subtype=str)
+		except ConfigMetadataError:
+			# allow use of yaml multi-line strings
+			return self._get_str("commands")
+
 class FamilyMetadata(ConfigMetadata):
-	def __init__(self, filename):
-		super(FamilyMetadata, self).__init__(filename)
+	def __init__(self, filename, metadict=None):
+		super(FamilyMetadata, self).__init__(filename, metadict)
 		self.blacklist = None
 		self.archive = None
 		self.default = None
@@ -380,6 +380,12 @@ class RezReleaseMode(object):
         with open(time_metafile, 'w') as f:
             f.write(str(get_epoch_time()) + '\n')
 
+    def write_metadata_sidecar(self):
+        # precompile the installed package.yaml, so that resolves can skip parsing the yaml
+        metafile = os.path.join(self.version_install_dir, enums.PKG_METADATA_FILENAME)
+        if os.path.isfile(metafile):
+            write_metadict_sidecar(metafile)
+
     def send_email(self):
         usr = os.getenv("USER", "unknown.user")
         pkgname = "%s-%s" % (self.metadata.name, str(self.this_version))
@@ -910,6 +916,7 @@ class RezReleaseMode(object):
         '''
         Final stage after installation
         '''
+        self.write_metadata_sidecar()
         self.write_time_metafile()
 
         self.send_email()
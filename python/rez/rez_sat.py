@@ -0,0 +1,550 @@
+"""
+Alternative resolver backend, which encodes a package request as a boolean satisfiability
+problem and solves it with a conflict-driven clause-learning (CDCL) solver.
+
+The encoding has a variable per package version, per package variant, and per package
+family (meaning 'this family is in the resolve'). Requirements, anti-packages, weak
+requests, conditional requirements and variants all become clauses over these. Decisions
+are made in the same order the default resolver makes them - the first family in request
+order with no version chosen yet is resolved to its most preferred version (latest or
+earliest) that has not been ruled out - so both backends pick the same packages, although
+not always in the same order. Clause learning means that a conflict is never rediscovered,
+however deep in the search it occurs. rez_benchmark.compare_solvers checks the two against
+each other.
+
+The one known difference is with assume_dt: the default resolver then prunes a family on
+the assumption that its versions' requirements change monotonically, and where a family
+breaks that assumption it can fail a request which this backend (which ignores
+assume_dt) resolves. Eg, if a-1.0 and a-3.0 require c-1 but a-2.0 requires c-2,
+the request 'a c-2' fails in the default resolver and resolves to a-2.0 here. Without
+assume_dt the two agree.
+
+Unlike the default resolver, every version of every reachable family has its metafile
+loaded up front, so this backend does more filesystem work on simple requests.
+"""
+import os
+from rez_config import *
+
+
+##############################################################################
+# CDCL solver
+##############################################################################
+
+class Solver(object):
+    """
+    A small CDCL SAT solver. Variables are positive integers, and literals are non-zero
+    integers where -v is the negation of v. Clauses are added with add_clause(), then
+    solve() is called with a decision callback, which controls the search order.
+    """
+    def __init__(self):
+        self.num_vars = 0
+        self.values = [None]
+        self.levels = [0]
+        self.reasons = [None]
+        self.watches = {}
+        self.trail = []
+        self.trail_lim = []
+        self.qhead = 0
+        self.num_conflicts = 0
+        self.num_decisions = 0
+        self.num_learnt = 0
+        self.ok = True
+
+    def new_var(self):
+        self.num_vars += 1
+        self.values.append(None)
+        self.levels.append(0)
+        self.reasons.append(None)
+        self.watches[self.num_vars] = []
+        self.watches[-self.num_vars] = []
+        return self.num_vars
+
+    def value(self, lit):
+        """
+        Return True, False or None (unassigned) for the given literal
+        """
+        v = self.values[abs(lit)]
+        if v is None or lit > 0:
+            return v
+        return not v
+
+    def decision_level(self):
+        return len(self.trail_lim)
+
+    def add_clause(self, lits):
+        """
+        Add a clause. This must be done before solve() is called. Returns False if the
+        problem is now known to be unsatisfiable.
+        """
+        if not self.ok:
+            return False
+
+        clause = []
+        for lit in lits:
+            if -lit in clause:
+                return True     # tautology
+            val = self.value(lit)
+            if val is True:
+                return True     # already satisfied at level 0
+            if (val is None) and (lit not in clause):
+                clause.append(lit)
+
+        if not clause:
+            self.ok = False
+        elif len(clause) == 1:
+            self._enqueue(clause[0], None)
+            self.ok = (self._propagate() is None)
+        else:
+            self.watches[clause[0]].append(clause)
+            self.watches[clause[1]].append(clause)
+        return self.ok
+
+    def _enqueue(self, lit, reason):
+        var = abs(lit)
+        self.values[var] = (lit > 0)
+        self.levels[var] = self.decision_level()
+        self.reasons[var] = reason
+        self.trail.append(lit)
+
+    def _propagate(self):
+        """
+        Unit propagation with two watched literals. The implied literal of a reason clause
+        is always its first. Returns a conflicting clause, or None.
+        """
+        while self.qhead < len(self.trail):
+            false_lit = -self.trail[self.qhead]
+            self.qhead += 1
+
+            watchers = self.watches[false_lit]
+            self.watches[false_lit] = kept = []
+            i = 0
+            while i < len(watchers):
+                clause = watchers[i]
+                i += 1
+                if clause[0] == false_lit:
+                    clause[0], clause[1] = clause[1], clause[0]
+
+                if self.value(clause[0]) is True:
+                    kept.append(clause)
+                    continue
+
+                # look for a new literal to watch
+                for k in xrange(2, len(clause)):
+                    if self.value(clause[k]) is not False:
+                        clause[1], clause[k] = clause[k], clause[1]
+                        self.watches[clause[1]].append(clause)
+                        break
+                else:
+                    kept.append(clause)
+                    if self.value(clause[0]) is False:
+                        kept.extend(watchers[i:])
+                        self.qhead = len(self.trail)
+                        return clause
+                    self._enqueue(clause[0], clause)
+        return None
+
+    def _analyze(self, conflict):
+        """
+        Derive a learnt clause from a conflict (first unique implication point). Returns the
+        clause, with the asserting literal first, and the level to backjump to.
+        """
+        seen = set()
+        learnt = [None]
+        counter = 0
+        lit = None
+        clause = conflict
+        index = len(self.trail) - 1
+        level = self.decision_level()
+
+        while True:
+            for q in (clause if lit is None else clause[1:]):
+                var = abs(q)
+                if (var not in seen) and (self.levels[var] > 0):
+                    seen.add(var)
+                    if self.levels[var] == level:
+                        counter += 1
+                    else:
+                        learnt.append(q)
+
+            while abs(self.trail[index]) not in seen:
+                index -= 1
+            lit = self.trail[index]
+            index -= 1
+            clause = self.reasons[abs(lit)]
+            counter -= 1
+            if counter == 0:
+                break
+
+        learnt[0] = -lit
+        if len(learnt) == 1:
+            return learnt, 0
+
+        # watch the literal from the highest remaining level second
+        imax = max(xrange(1, len(learnt)), key=lambda i: self.levels[abs(learnt[i])])
+        learnt[1], learnt[imax] = learnt[imax], learnt[1]
+        return learnt, self.levels[abs(learnt[1])]
+
+    def _backtrack(self, level):
+        if self.decision_level() > level:
+            for lit in self.trail[self.trail_lim[level]:]:
+                var = abs(lit)
+                self.values[var] = None
+                self.reasons[var] = None
+            del self.trail[self.trail_lim[level]:]
+            del self.trail_lim[level:]
+            self.qhead = len(self.trail)
+
+    def solve(self, decide):
+        """
+        Solve the problem. 'decide' is called with this solver whenever a decision is needed,
+        and must return an unassigned literal to set true, or None once every variable that
+        matters has been assigned. Returns True if satisfiable, False otherwise.
+        """
+        if not self.ok:
+            return False
+
+        while True:
+            conflict = self._propagate()
+            if conflict is not None:
+                self.num_conflicts += 1
+                if self.decision_level() == 0:
+                    self.ok = False
+                    return False
+
+                learnt, level = self._analyze(conflict)
+                self._backtrack(level)
+                if len(learnt) == 1:
+                    self._enqueue(learnt[0], None)
+                else:
+                    self.watches[learnt[0]].append(learnt)
+                    self.watches[learnt[1]].append(learnt)
+                    self._enqueue(learnt[0], learnt)
+                self.num_learnt += 1
+            else:
+                lit = decide(self)
+                if lit is None:
+                    return True
+                self.num_decisions += 1
+                self.trail_lim.append(len(self.trail))
+                self._enqueue(lit, None)
+
+
+##############################################################################
+# Package encoding
+##############################################################################
+
+class _SatPackage(object):
+    """
+    A package version in the SAT encoding
+    """
+    def __init__(self, name, version, base_path, var):
+        self.name = name
+        self.version = version
+        self.base_path = base_path
+        self.var = var
+        self.variants = None    # list of (metadata node, requests, var)
+        self.requires = ()
+        self.cond_requires = ()
+
+    def short_name(self):
+        verstr = str(self.version)
+        if verstr:
+            return self.name + '-' + verstr
+        return self.name
+
+
+class _SatFamily(object):
+    """
+    A package family in the SAT encoding. 'packages' are in order of preference.
+    """
+    def __init__(self, name, var):
+        self.name = name
+        self.var = var
+        self.packages = []
+
+
+class SatResolve(object):
+    """
+    Resolve a list of package requests with the SAT solver. After a successful solve(),
+    'packages' holds the chosen _SatPackages and 'variants' maps a chosen package's name
+    to the index of its chosen variant.
+    """
+    def __init__(self, rctxt):
+        self.rctxt = rctxt
+        self.memcache = rctxt.memcache
+        self.latest = (rctxt.resolve_mode != RESOLVE_MODE_EARLIEST)
+        self.solver = Solver()
+        self.families = {}
+        self.request_names = []
+        self.packages = []
+        self.variants = {}
+
+    def solve(self, pkg_reqs):
+        """
+        Returns True if a solution was found
+        """
+        for pkg_req in pkg_reqs:
+            if pkg_req.is_anti():
+                self._forbid(None, pkg_req)
+            else:
+                fam = self._get_family(pkg_req.name)
+                if fam is None:
+                    raise PkgFamilyNotFoundError(pkg_req.name)
+                if fam.name not in self.request_names:
+                    self.request_names.append(fam.name)
+                self._require(None, pkg_req)
+
+        if not self.solver.solve(self._decide):
+            return False
+
+        value = self.solver.value
+        for name in self._get_order():
+            fam = self.families[name]
+            for pkg in fam.packages:
+                if value(pkg.var):
+                    self.packages.append(pkg)
+                    for i, variant in enumerate(pkg.variants or []):
+                        if value(variant[2]):
+                            self.variants[pkg.name] = i
+        return True
+
+    def _get_candidates(self, name):
+        """
+        Return (family path, version, epoch) for every version of the family, in order of
+        preference. This is the ordering used by RezMemCache.find_package_in_range.
+        """
+        results = sorted(self.memcache.iter_packages(name), key=lambda x: x[1],
+                         reverse=self.latest)
+
+        fam_pkg_path = self.memcache.get_family_package(name)
+        if fam_pkg_path:
+            fam_metadata = self.memcache.get_family_metafile(fam_pkg_path)
+            if fam_metadata.default:
+                default = VersionRange(fam_metadata.default)
+                results = [x for x in results if default.contains_version(x[1])] + \
+                    [x for x in results if not default.contains_version(x[1])]
+
+        # if the same version exists in two paths, the first path wins
+        candidates = []
+        versions = set()
+        for result in results:
+            verstr = str(result[1])
+            if verstr not in versions:
+                versions.add(verstr)
+                candidates.append(result)
+        return candidates
+
+    def _get_family(self, name):
+        """
+        Return the _SatFamily for the given family, encoding it (and, transitively, every
+        family it can depend on) if this has not yet been done. Returns None if the family
+        does not exist.
+        """
+        if name in self.families:
+            return self.families[name]
+        if not self.memcache.package_family_exists(name):
+            self.families[name] = None
+            return None
+
+        solver = self.solver
+        fam = _SatFamily(name, solver.new_var())
+        self.families[name] = fam
+
+        for fam_path, ver, epoch in self._get_candidates(name):
+            verstr = str(ver)
+            base_path = os.path.join(fam_path, verstr) if verstr else fam_path
+            pkg = _SatPackage(name, ver, base_path, solver.new_var())
+            fam.packages.append(pkg)
+            # a package implies its family
+            solver.add_clause([-pkg.var, fam.var])
+
+        # a family implies one of its packages, and only one
+        solver.add_clause([-fam.var] + [x.var for x in fam.packages])
+        for i, pkg in enumerate(fam.packages):
+            for pkg2 in fam.packages[i+1:]:
+                solver.add_clause([-pkg.var, -pkg2.var])
+
+        for pkg in fam.packages:
+            self._encode_package(pkg)
+        return fam
+
+    def _encode_package(self, pkg):
+        solver = self.solver
+        metadata = self.memcache.get_metafile(os.path.join(pkg.base_path, PKG_METADATA_FILENAME))
+        reqs = get_metafile_requests(metadata, self.memcache)
+
+        pkg.requires = reqs.get_requires(self.rctxt.build_requires)
+        for pkg_req in pkg.requires:
+            if pkg_req.is_anti():
+                self._forbid(pkg.var, pkg_req)
+            else:
+                self._require(pkg.var, pkg_req)
+
+        pkg.cond_requires = reqs.get_conditional_requires()
+        for pkg_req, conditionals in pkg.cond_requires:
+            # conditions on anti-packages are never met, as in the default resolver
+            cond_lits = [-pkg.var]
+            for cond in conditionals:
+                cond_fam = None if cond.startswith('!') else self._get_family(cond)
+                if cond_fam is None:
+                    cond_lits = None
+                    break
+                cond_lits.append(-cond_fam.var)
+            if cond_lits is not None:
+                self._require_when(cond_lits, pkg_req)
+
+        variants = reqs.get_variants()
+        if variants:
+            pkg.variants = []
+            for metavar, requests in variants:
+                var = solver.new_var()
+                pkg.variants.append((metavar, requests, var))
+                solver.add_clause([-var, pkg.var])
+
+                root_path = pkg.base_path + '/' + str('/').join(metavar)
+                if not self.memcache.is_dir(root_path):
+                    solver.add_clause([-var])
+                    continue
+
+                for pkg_req in requests:
+                    if pkg_req.is_anti():
+                        self._forbid(var, pkg_req)
+                    else:
+                        self._require(var, pkg_req)
+
+            # a package implies one of its variants, and only one
+            vvars = [x[2] for x in pkg.variants]
+            solver.add_clause([-pkg.var] + vvars)
+            for i, var in enumerate(vvars):
+                for var2 in vvars[i+1:]:
+                    solver.add_clause([-var, -var2])
+
+    def _matching(self, pkg_req, name):
+        fam = self._get_family(name)
+        if fam is None:
+            return None, []
+        return fam, [x for x in fam.packages if
+                     pkg_req.version_range.matches_version(x.version, allow_inexact=True)]
+
+    def _require(self, var, pkg_req):
+        """
+        Encode 'var implies pkg_req', or just pkg_req if var is None
+        """
+        self._require_when([] if var is None else [-var], pkg_req)
+
+    def _require_when(self, lits, pkg_req):
+        fam, pkgs = self._matching(pkg_req, pkg_req.name)
+        if fam is None:
+            self.solver.add_clause(lits)
+            return
+        self.solver.add_clause(lits + [fam.var])
+        self.solver.add_clause(lits + [x.var for x in pkgs])
+
+    def _forbid(self, var, pkg_req):
+        """
+        Encode 'var implies not anti-request', or just 'not anti-request' if var is None
+        """
+        fam, pkgs = self._matching(pkg_req, pkg_req.name[1:])
+        lits = [] if var is None else [-var]
+        for pkg in pkgs:
+            self.solver.add_clause(lits + [-pkg.var])
+
+    def _get_order(self):
+        """
+        Return the names of the families currently in the resolve, in the order that they
+        were brought in - requested families first, then their requirements, breadth-first.
+        This includes families that are common to all the remaining variants of a package.
+        """
+        value = self.solver.value
+        order = []
+        common = set()
+        visited = set()
+        queue = list(self.request_names)
+        while queue:
+            name = queue.pop(0)
+            if name in visited:
+                continue
+            visited.add(name)
+            fam = self.families.get(name)
+            if (fam is None) or ((not value(fam.var)) and (name not in common)):
+                continue
+            order.append(name)
+
+            for pkg in fam.packages:
+                if value(pkg.var):
+                    queue.extend(x.name for x in pkg.requires if not x.is_anti())
+                    queue.extend(x[0].name for x in pkg.cond_requires)
+                    if pkg.variants:
+                        variants = [x for x in pkg.variants if value(x[2]) is not False]
+                        if (len(variants) == 1) and value(variants[0][2]):
+                            queue.extend(x.name for x in variants[0][1] if not x.is_anti())
+                        elif variants:
+                            # families common to all remaining variants are brought in
+                            # before a variant is chosen, as in the default resolver
+                            fams = [x.name for x in variants[0][1] if not x.is_anti()]
+                            for variant in variants[1:]:
+                                names = set(x.name for x in variant[1])
+                                fams = [x for x in fams if x in names]
+                            common.update(fams)
+                            queue.extend(fams)
+                    break
+        return order
+
+    def _decide(self, solver):
+        self.rctxt.check_budgets()
+        value = solver.value
+        order = self._get_order()
+
+        # resolve the first family with no package chosen yet, to its preferred package
+        for name in order:
+            fam = self.families[name]
+            if any(value(x.var) for x in fam.packages):
+                continue
+            for pkg in fam.packages:
+                if value(pkg.var) is None:
+                    return pkg.var
+
+        # then choose variants. Prefer the variant that brings in the fewest new families,
+        # and the first such variant in the metafile.
+        active = set(order)
+        for name in order:
+            for pkg in self.families[name].packages:
+                if (not value(pkg.var)) or (not pkg.variants):
+                    continue
+                if any(value(x[2]) for x in pkg.variants):
+                    break
+                best_var = None
+                best_score = None
+                for metavar, requests, var in pkg.variants:
+                    if value(var) is None:
+                        score = len([x for x in requests if x.name not in active])
+                        if (best_score is None) or (score < best_score):
+                            best_var = var
+                            best_score = score
+                if best_var is not None:
+                    return best_var
+                break
+
+        # anything left over is not needed
+        for var in xrange(1, solver.num_vars + 1):
+            if solver.values[var] is None:
+                return -var
+        return None
+
+
+#    Copyright 2008-2012 Dr D Studios Pty Limited (ACN 127 184 954) (Dr. D Studios)
+#
+#    This file is part of Rez.
+#
+#    Rez is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Rez is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Rez.  If not, see <http://www.gnu.org/licenses/>.
@@ -10,6 +10,8 @@ import time
 WRITE_PERMS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
 
 def gen_dotgraph_image(dot_data, out_file):
+    # dot_data may be a graph that is rendered on demand
+    dot_data = str(dot_data)
 
     # shortcut if writing .dot file
     if out_file.endswith(".dot"):
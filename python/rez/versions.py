@@ -320,7 +320,8 @@ class VersionRange(object):
 			v1 = vers[i+1]
 			if v0.lt < v1.ge:
 				v = Version("")
-				v.ge, v.lt = v0.lt, v1.ge
+				# copy, since the bounds may be clamped below
+				v.ge, v.lt = v0.lt[:], v1.ge[:]
 				vers_inv.versions.append(v)
 
 		if len(vers_inv.versions) > 0:
@@ -0,0 +1,105 @@
+"""
+Tests for rez. Run them from the python directory, with:
+
+    python -m unittest discover -s tests -t .
+
+Each test resolves against package repositories that it writes into temporary directories,
+either by hand (see write_package) or with the benchmark's generator (see
+rez_benchmark.generate_repository). Nothing else is searched.
+"""
+import os
+import atexit
+import shutil
+import tempfile
+import yaml
+
+# rez reads these when it is imported. The repositories the tests use are given to each
+# resolver explicitly, see create_resolver
+_g_empty_path = tempfile.mkdtemp(prefix="rez-tests-")
+_g_temp_dirs = [_g_empty_path]
+os.environ.setdefault("REZ_PACKAGES_PATH", _g_empty_path)
+os.environ.setdefault("REZ_LOCAL_PACKAGES_PATH", _g_empty_path)
+os.environ.setdefault("REZ_PLATFORM", "Linux")
+os.environ.setdefault("REZ_PATH", os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+
+from rez.rez_config import *
+
+
+def make_temp_dir():
+    """
+    Return a new temporary directory, which is removed when the tests exit.
+    """
+    path = tempfile.mkdtemp(prefix="rez-tests-")
+    _g_temp_dirs.append(path)
+    return path
+
+
+def write_package(path, name, version, metadict=None, timestamp=0):
+    """
+    Write a package into the repository 'path'. metadict is the content of its package.yaml,
+    less config_version, name and version.
+    """
+    base = os.path.join(path, name, version)
+    os.makedirs(os.path.join(base, ".metadata"))
+
+    metadict = dict(metadict or {})
+    metadict["config_version"] = 0
+    metadict["name"] = name
+    metadict["version"] = version
+    with open(os.path.join(base, PKG_METADATA_FILENAME), 'w') as f:
+        yaml.safe_dump(metadict, f, default_flow_style=False)
+    with open(os.path.join(base, ".metadata", "release_time.txt"), 'w') as f:
+        f.write(str(timestamp))
+
+    for variant in metadict.get("variants", []):
+        os.makedirs(os.path.join(base, *variant))
+
+
+def create_resolver(path, resolve_mode=RESOLVE_MODE_LATEST, **kwargs):
+    """
+    Create a quiet Resolver which only searches the repository 'path'. Other Resolver
+    options can be given.
+    """
+    kwargs.setdefault("caching", False)
+    resolver = Resolver(resolve_mode, quiet=True, **kwargs)
+    resolver.get_memcache().set_package_paths([path])
+    return resolver
+
+
+def resolve(resolver, request):
+    """
+    Resolve the request (a list of package strings) without the OS package. Returns the
+    resolved packages as strings, or the class name of the error raised.
+    """
+    try:
+        memcache = resolver.get_memcache()
+        pkg_reqs = [str_to_pkg_req(x, memcache) for x in request]
+        return [x.short_name() for x in resolver.resolve(pkg_reqs, True)[0]]
+    except Exception, e:
+        return e.__class__.__name__
+
+
+def _remove_temp_dirs():
+    for path in _g_temp_dirs:
+        shutil.rmtree(path, ignore_errors=True)
+
+atexit.register(_remove_temp_dirs)
+
+
+#    Copyright 2008-2012 Dr D Studios Pty Limited (ACN 127 184 954) (Dr. D Studios)
+#
+#    This file is part of Rez.
+#
+#    Rez is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Rez is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Rez.  If not, see <http://www.gnu.org/licenses/>.
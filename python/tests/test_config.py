@@ -0,0 +1,197 @@
+"""
+Tests of the resolver's configuration state, see _Configuration.
+"""
+import os
+import yaml
+import random
+import pickle
+import unittest
+from tests import make_temp_dir, write_package, create_resolver, resolve
+from rez.rez_config import _PersistentMap, PKG_METADATA_FILENAME
+from rez import rez_benchmark
+
+
+# the repositories resolved by TestResolveResults, as rez_benchmark.generate_repository
+# arguments
+RESOLVE_REPOSITORIES = [
+    dict(num_families=40, num_requests=10, seed=1),
+    dict(num_families=40, num_requests=10, anti_fraction=0.2, weak_fraction=0.2,
+         conditional_fraction=0.2, seed=6),
+    dict(num_families=40, num_requests=10, variant_fraction=0.5, seed=3) ]
+
+RESULTS_FILENAME = os.path.join(os.path.dirname(__file__), "data", "resolve_results.yaml")
+
+
+def get_resolve_requests(path, requests, seed):
+    """
+    Return the generated requests for the repository 'path', and for each, one of its
+    families with an old major version of one of its dependencies, which makes the
+    resolver backtrack.
+    """
+    rng = random.Random(seed)
+    requests2 = []
+    for request in requests:
+        fam = rng.choice(request)
+        latest = max(os.listdir(os.path.join(path, fam)))
+        with open(os.path.join(path, fam, latest, PKG_METADATA_FILENAME)) as f:
+            requires = yaml.safe_load(f).get("requires", [])
+        deps = [x.split('-')[0] for x in requires if x[0] not in "!~" and '?' not in x]
+        if deps:
+            requests2.append([fam, "%s-%d" % (rng.choice(deps), rng.randint(1, 2))])
+    return requests + requests2
+
+
+def get_resolve_results():
+    """
+    Resolve the requests of each of RESOLVE_REPOSITORIES. Returns a dict of results, keyed
+    by repository number and request, for RESULTS_FILENAME.
+    """
+    results = {}
+    for i, kwargs in enumerate(RESOLVE_REPOSITORIES):
+        path = make_temp_dir()
+        requests = rez_benchmark.generate_repository(path, **kwargs)
+        for request in get_resolve_requests(path, requests, i):
+            result = resolve(create_resolver(path, assume_dt=True), request)
+            if isinstance(result, list):
+                result.sort()
+            results["%d: %s" % (i, ' '.join(request))] = result
+    return results
+
+
+class _ReferenceMap(object):
+    """
+    What a _PersistentMap should behave like: a dict, which iterates in the order keys
+    were first added.
+    """
+    def __init__(self):
+        self.items = {}
+        self.order = []
+
+    def copy(self):
+        m = _ReferenceMap()
+        m.items = self.items.copy()
+        m.order = self.order[:]
+        return m
+
+    def __setitem__(self, key, value):
+        if key not in self.order:
+            self.order.append(key)
+        self.items[key] = value
+
+    def __delitem__(self, key):
+        del self.items[key]
+
+    def contents(self):
+        return [(x, self.items[x]) for x in self.order if x in self.items]
+
+
+class TestPersistentMap(unittest.TestCase):
+    NUM_STEPS = 5000
+
+    def _check(self, m, ref):
+        self.assertEqual(list(m.iteritems()), ref.contents())
+        self.assertEqual(len(m), len(ref.items))
+        for key in ref.order:
+            self.assertEqual(key in m, key in ref.items)
+            self.assertEqual(m.get(key), ref.items.get(key))
+
+    def test_against_dict(self):
+        # apply the same random changes to maps and to reference copies, copying both as
+        # configs are copied during a resolve
+        rng = random.Random(0)
+        maps = [(_PersistentMap(), _ReferenceMap())]
+        for i in range(self.NUM_STEPS):
+            m, ref = rng.choice(maps)
+            key = "fam%d" % rng.randint(0, 200)
+            op = rng.random()
+            if op < 0.6:
+                m[key] = ref[key] = i
+            elif op < 0.7:
+                if key in ref.items:
+                    del m[key]
+                    del ref[key]
+                else:
+                    self.assertRaises(KeyError, m.__delitem__, key)
+            elif op < 0.8:
+                self.assertEqual(m.get(key), ref.items.get(key))
+            elif op < 0.98:
+                maps.append((m.copy(), ref.copy()))
+            else:
+                maps.append((pickle.loads(pickle.dumps(m, 2)), ref.copy()))
+
+        for m, ref in maps:
+            self._check(m, ref)
+
+    def test_copies_are_independent(self):
+        m = _PersistentMap()
+        for i in range(100):
+            m["fam%d" % i] = i
+        m2 = m.copy()
+        m2["fam0"] = -1
+        m2["new"] = -2
+        del m2["fam1"]
+        m["fam2"] = -3
+
+        self.assertEqual(m["fam0"], 0)
+        self.assertTrue("new" not in m)
+        self.assertEqual(m["fam1"], 1)
+        self.assertEqual(m2["fam2"], 2)
+        self.assertEqual(len(m), 100)
+        self.assertEqual(len(m2), 100)
+        self.assertRaises(KeyError, m2.__getitem__, "fam1")
+
+
+class TestResolveResults(unittest.TestCase):
+    """
+    Resolves must pick the packages they did before the configuration state was made
+    persistent. The expected results were written by get_resolve_results.
+    """
+    def test_results(self):
+        with open(RESULTS_FILENAME) as f:
+            expected = yaml.safe_load(f)
+        results = get_resolve_results()
+        self.assertEqual(sorted(results), sorted(expected))
+        for key in sorted(expected):
+            self.assertEqual(results[key], expected[key], key)
+
+
+class TestConditionalRequires(unittest.TestCase):
+    def setUp(self):
+        self.path = make_temp_dir()
+        write_package(self.path, "c", "1.0")
+        write_package(self.path, "d", "1.0")
+        write_package(self.path, "z", "1.0")
+        write_package(self.path, "foo", "1.0", {"requires": ["c-1?z"]})
+        write_package(self.path, "bar", "1.0", {"requires": ["z-1", "d-1?y"]})
+
+    def test_condition_added(self):
+        # whichever of foo and bar has its metafile resolved first, bar adds the condition of
+        # foo's conditional requirement
+        for request in (["foo-1.0", "bar-1.0"], ["bar-1.0", "foo-1.0"]):
+            self.assertEqual(sorted(resolve(create_resolver(self.path), request)),
+                             ["bar-1.0", "c-1.0", "foo-1.0", "z-1.0"])
+
+    def test_condition_not_added(self):
+        self.assertEqual(resolve(create_resolver(self.path), ["foo-1.0"]), ["foo-1.0"])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+#    Copyright 2008-2012 Dr D Studios Pty Limited (ACN 127 184 954) (Dr. D Studios)
+#
+#    This file is part of Rez.
+#
+#    Rez is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Rez is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Rez.  If not, see <http://www.gnu.org/licenses/>.
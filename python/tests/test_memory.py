@@ -0,0 +1,75 @@
+"""
+Tests of the memory-bounded resolver mode, see Resolver's max_fail_history.
+"""
+import unittest
+from tests import make_temp_dir, write_package, create_resolver, resolve
+from rez.rez_config import _FailureLog
+
+
+class TestFailureLog(unittest.TestCase):
+    def test_keeps_most_recent(self):
+        log = _FailureLog(3)
+        for i in range(100):
+            log.append("fail %d" % i)
+
+        self.assertEqual(len(log), 100)
+        self.assertEqual(len(log.entries), 3)
+        self.assertEqual(list(log), ["(97 earlier failed attempts were not kept)",
+                                     "fail 97", "fail 98", "fail 99"])
+        self.assertEqual(log[98:], ["fail 98", "fail 99"])
+        self.assertEqual(log[0:], ["fail 97", "fail 98", "fail 99"])
+
+
+class TestBoundedResolve(unittest.TestCase):
+    NUM_VERSIONS = 30
+    MAX_FAIL_HISTORY = 3
+
+    def setUp(self):
+        # every version of 'a' but the earliest requires c-1, which conflicts with the
+        # request, so a resolve fails once for each of them
+        self.path = make_temp_dir()
+        write_package(self.path, "c", "1.0")
+        write_package(self.path, "c", "2.0")
+        write_package(self.path, "a", "1.0", {"requires": ["c-2"]})
+        for i in range(2, self.NUM_VERSIONS + 1):
+            write_package(self.path, "a", "%d.0" % i, {"requires": ["c-1"]})
+        self.request = ["a", "c-2"]
+
+    def test_history_stays_within_its_cap(self):
+        resolver = create_resolver(self.path)
+        expected = resolve(resolver, self.request)
+        fails = list(resolver.rctxt.config_fail_list)
+        self.assertEqual(expected, ["c-2.0", "a-1.0"])
+        self.assertEqual(len(fails), self.NUM_VERSIONS - 1)
+
+        resolver = create_resolver(self.path, max_fail_history=self.MAX_FAIL_HISTORY)
+        self.assertEqual(resolve(resolver, self.request), expected)
+        log = resolver.rctxt.config_fail_list
+        self.assertEqual(len(log), len(fails))
+        self.assertEqual(len(log.entries), self.MAX_FAIL_HISTORY)
+
+        # the entries kept describe each failed config briefly
+        size = sum(len(x) for x in log.entries)
+        self.assertTrue(size <= sum(len(x) for x in fails[-self.MAX_FAIL_HISTORY:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+#    Copyright 2008-2012 Dr D Studios Pty Limited (ACN 127 184 954) (Dr. D Studios)
+#
+#    This file is part of Rez.
+#
+#    Rez is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Rez is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Rez.  If not, see <http://www.gnu.org/licenses/>.
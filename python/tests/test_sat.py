@@ -0,0 +1,94 @@
+"""
+Differential tests of the SAT resolver backend (see rez_sat) against the default resolver.
+"""
+import unittest
+from tests import make_temp_dir, write_package, create_resolver, resolve
+from rez.rez_config import SOLVER_DEFAULT, SOLVER_SAT
+from rez import rez_benchmark
+
+
+class TestSatDifferential(unittest.TestCase):
+    """
+    Both backends must pick the same packages for every request over generated repositories,
+    although not necessarily in the same order. Dependency transitivity holds in these, see
+    TestSatTransitivity.
+    """
+    NUM_FAMILIES = 40
+    NUM_REQUESTS = 15
+
+    def _resolve(self, path, request, solver):
+        result = resolve(create_resolver(path, assume_dt=True, solver=solver), request)
+        if isinstance(result, list):
+            result.sort()
+        return result
+
+    def _check_repository(self, **kwargs):
+        path = make_temp_dir()
+        requests = rez_benchmark.generate_repository(path, self.NUM_FAMILIES,
+            num_requests=self.NUM_REQUESTS, **kwargs)
+        for request in requests:
+            expected = self._resolve(path, request, SOLVER_DEFAULT)
+            result = self._resolve(path, request, SOLVER_SAT)
+            self.assertEqual(result, expected, "%s: default %s, sat %s" % \
+                (' '.join(request), expected, result))
+
+    def test_default_repository(self):
+        self._check_repository(seed=1)
+
+    def test_conflicting_repository(self):
+        self._check_repository(anti_fraction=0.3, weak_fraction=0.2,
+                               conditional_fraction=0.2, seed=2)
+
+    def test_variant_repository(self):
+        self._check_repository(variant_fraction=0.6, seed=3)
+
+
+class TestSatTransitivity(unittest.TestCase):
+    """
+    The default resolver assumes dependency transitivity, the SAT backend does not. Where a
+    family breaks it, they can differ - this is the known difference between them.
+    """
+    def setUp(self):
+        # a-2.0 requires c-2, but the versions either side of it require c-1
+        self.path = make_temp_dir()
+        write_package(self.path, "c", "1.0")
+        write_package(self.path, "c", "2.0")
+        write_package(self.path, "a", "1.0", {"requires": ["c-1"]})
+        write_package(self.path, "a", "2.0", {"requires": ["c-2"]})
+        write_package(self.path, "a", "3.0", {"requires": ["c-1"]})
+        self.request = ["a", "c-2"]
+
+    def test_assume_dt(self):
+        self.assertEqual(resolve(create_resolver(self.path, assume_dt=True), self.request),
+                         "PkgConflictError")
+        self.assertEqual(resolve(create_resolver(self.path, assume_dt=True,
+                                                 solver=SOLVER_SAT), self.request),
+                         ["c-2.0", "a-2.0"])
+
+    def test_no_assume_dt(self):
+        for solver in (SOLVER_DEFAULT, SOLVER_SAT):
+            self.assertEqual(resolve(create_resolver(self.path, assume_dt=False,
+                                                     solver=solver), self.request),
+                             ["c-2.0", "a-2.0"])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+#    Copyright 2008-2012 Dr D Studios Pty Limited (ACN 127 184 954) (Dr. D Studios)
+#
+#    This file is part of Rez.
+#
+#    Rez is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Rez is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with Rez.  If not, see <http://www.gnu.org/licenses/>.